@@ -0,0 +1,172 @@
+"""
+Consolidated database of the packages installed into a prefix.
+
+The metadata of each installed package lives in EGG-INFO/<name>
+(egginst.json and _info.json).  Reading them all means opening hundreds of
+files, so their content is also kept in a single file, EGG-INFO/_installed.json,
+mapping each name to a dictionary with the keys:
+
+egg_name: the filename of the egg used to install the package (from
+    egginst.json), or None
+info: the content of _info.json, or None
+stamp: the [mtime, size] of egginst.json and of _info.json (None for a
+    missing file) when the entry was read
+
+The database is updated by EggInst.install and remove.  When reading it,
+the entries which do not match the content of EGG-INFO are rebuilt from the
+per-package files, and the database is written back when possible.  An
+entry does not match when its package directory was added or removed, or
+when the stamp of its files changed (e.g. because a package was installed,
+removed or replaced by an older egginst): checking this only requires the
+files to be stat'ed, not read.
+"""
+import json
+import os
+import re
+import sys
+import threading
+from os.path import isdir, join
+
+from utils import rm_rf
+
+DB_FILENAME = '_installed.json'
+DB_VERSION = 2
+
+# names of EGG-INFO entries which are package metadata directories
+_NAME_PAT = re.compile(r'([a-z0-9_.]+)$')
+
+# maps the database path -> ((mtime, size) of the file, packages)
+_cache = {}
+_lock = threading.Lock()
+
+
+def db_path(prefix):
+    return join(prefix, 'EGG-INFO', DB_FILENAME)
+
+
+def _load_json(path):
+    try:
+        with open(path) as fp:
+            return json.load(fp)
+    except (IOError, ValueError):
+        return None
+
+
+def _read_entry(meta_dir):
+    meta = _load_json(join(meta_dir, 'egginst.json'))
+    return {'egg_name': meta['egg_name'] if meta else None,
+            'info': _load_json(join(meta_dir, '_info.json'))}
+
+
+def _stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime, st.st_size
+
+
+def _entry_stamp(meta_dir):
+    # a list of lists, as read back from the database
+    return [None if stamp is None else list(stamp)
+            for stamp in (_stamp(join(meta_dir, 'egginst.json')),
+                          _stamp(join(meta_dir, '_info.json')))]
+
+
+def _load(path):
+    stamp = _stamp(path)
+    if stamp is None:
+        return {}
+    with _lock:
+        cached = _cache.get(path)
+    if cached is not None and cached[0] == stamp:
+        return dict(cached[1])
+
+    data = _load_json(path)
+    if not isinstance(data, dict) or data.get('version') != DB_VERSION:
+        return {}
+    packages = data['packages']
+    with _lock:
+        _cache[path] = (stamp, packages)
+    return dict(packages)
+
+
+def _write(path, packages):
+    if not packages:
+        rm_rf(path)
+        return
+    tmp_path = path + '.tmp%d' % os.getpid()
+    with open(tmp_path, 'w') as fo:
+        json.dump({'version': DB_VERSION, 'packages': packages}, fo,
+                  separators=(',', ':'), sort_keys=True)
+    if sys.platform == 'win32':
+        rm_rf(path)
+    os.rename(tmp_path, path)
+    stamp = _stamp(path)
+    with _lock:
+        _cache[path] = (stamp, dict(packages))
+
+
+def read_installed(prefix, refresh=()):
+    """
+    Return a dictionary mapping the names of the packages installed into
+    prefix to their entries (see above), which should not be modified.
+    The entries of the names in refresh are read from the per-package files
+    again.
+
+    All the entries are checked, which costs a listing of EGG-INFO and two
+    stat calls per package: looking up a single package should rather be
+    done through its own metadata (see EggCollection.find).
+    """
+    egg_info_dir = join(prefix, 'EGG-INFO')
+    if not isdir(egg_info_dir):
+        return {}
+    names = set(fn for fn in os.listdir(egg_info_dir)
+                if _NAME_PAT.match(fn) and not fn.startswith(DB_FILENAME))
+
+    path = db_path(prefix)
+    packages = _load(path)
+    stale = names.symmetric_difference(packages)
+    stale.update(refresh)
+    stamps = {}
+    for name in names:
+        stamps[name] = _entry_stamp(join(egg_info_dir, name))
+        if name in packages and packages[name].get('stamp') != stamps[name]:
+            stale.add(name)
+    if not stale:
+        return packages
+
+    for name in stale:
+        if name in names:
+            entry = _read_entry(join(egg_info_dir, name))
+            entry['stamp'] = stamps[name]
+            packages[name] = entry
+        else:
+            packages.pop(name, None)
+    try:
+        _write(path, packages)
+    except (IOError, OSError):
+        # e.g. read-only prefix: the entries are rebuilt on each read
+        pass
+    return packages
+
+
+def update_installed(prefix, name):
+    """
+    Update the entry of the given package, after it has been installed or
+    removed.  Only the metadata of that package is looked at.
+    """
+    path = db_path(prefix)
+    packages = _load(path)
+    meta_dir = join(prefix, 'EGG-INFO', name)
+    if isdir(meta_dir):
+        entry = _read_entry(meta_dir)
+        entry['stamp'] = _entry_stamp(meta_dir)
+        packages[name] = entry
+    else:
+        packages.pop(name, None)
+    try:
+        _write(path, packages)
+    except (IOError, OSError):
+        # the entry is rebuilt by the next read_installed
+        pass
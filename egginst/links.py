@@ -7,10 +7,14 @@ from egginst.utils import rm_rf
 verbose = False
 
 
-def create_link(arcname, link, prefix):
+def link_destination(arcname, prefix):
     usr = 'EGG-INFO/usr/'
     assert arcname.startswith(usr), arcname
-    dst = join(prefix, arcname[len(usr):])
+    return join(prefix, arcname[len(usr):])
+
+
+def create_link(arcname, link, prefix):
+    dst = link_destination(arcname, prefix)
 
     # Create the destination directory if it does not exist.  In most cases
     # it will exist, but you never know.
@@ -24,13 +28,26 @@ def create_link(arcname, link, prefix):
     return dst
 
 
+def _iter_links(egg):
+    for line in egg.lines_from_arcname('EGG-INFO/inst/files_to_install.txt'):
+        arcname, link = line.split()
+        if link == 'False':
+            continue
+        yield arcname, link
+
+
+def destinations(egg):
+    """
+    Return the list of the links create(egg) creates.
+    """
+    return [link_destination(arcname, egg.prefix)
+            for arcname, link in _iter_links(egg)]
+
+
 def create(egg):
     """
     Given the content of the EGG-INFO/inst/files_to_install.txt file,
     create/remove the links listed therein.
     """
-    for line in egg.lines_from_arcname('EGG-INFO/inst/files_to_install.txt'):
-        arcname, link = line.split()
-        if link == 'False':
-            continue
+    for arcname, link in _iter_links(egg):
         egg.files.append(create_link(arcname, link, egg.prefix))
@@ -13,16 +13,23 @@ import sys
 import re
 import json
 import shutil
+import threading
 import warnings
 import zipfile
+from itertools import izip
+from multiprocessing.pool import ThreadPool
 from uuid import uuid4
-from os.path import abspath, basename, dirname, join, isdir, isfile, sep
+from os.path import (abspath, basename, commonprefix, dirname, join, isdir,
+                     isfile, normpath, sep)
 
 import eggmeta
+import installdb
+import object_code
 import scripts
 
-from utils import (on_win, bin_dir_name, rel_site_packages, human_bytes, ensure_dir,
-                   rm_empty_dir, rm_rf, get_executable, makedirs, is_zipinfo_symlink, is_zipinfo_dir)
+from utils import (on_win, bin_dir_name, rel_site_packages, human_bytes,
+                   rm_empty_dir, rm_rf, get_executable, makedirs, is_zipinfo_symlink, is_zipinfo_dir,
+                   unlink_file)
 
 NS_PKG_PAT = re.compile(
     r'\s*__import__\([\'"]pkg_resources[\'"]\)\.declare_namespace'
@@ -30,6 +37,24 @@ NS_PKG_PAT = re.compile(
 
 EGG_INFO = "EGG-INFO"
 
+# archive members are copied to disk in chunks of this size
+EXTRACT_CHUNK_SIZE = 2 ** 18
+
+# file of the meta_dir listing the installed files (see write_files_manifest)
+FILES_MANIFEST = 'files.txt'
+# version of its format, recorded in egginst.json
+FILES_MANIFEST_VERSION = 1
+
+# escapes of the characters of the paths written to a files manifest which
+# would break its lines
+_MANIFEST_UNESCAPES = {'\\': '\\', 'n': '\n', 'r': '\r'}
+_MANIFEST_ESCAPE_PAT = re.compile(r'\\(.)')
+
+# members of the egg read when completing an install (see EggInst.stage)
+COMMIT_ARCNAMES = ('EGG-INFO/entry_points.txt',
+                   'EGG-INFO/inst/files_to_install.txt',
+                   'EGG-INFO/spec/depend', 'EGG-INFO/info.json')
+
 R_EGG_INFO = re.compile("^{0}".format(EGG_INFO))
 R_EGG_INFO_BLACK_LIST = re.compile(
         "^{0}/(usr|spec|PKG-INFO.bak|prefix|.gitignore|"
@@ -104,7 +129,8 @@ class EggInst(object):
 
     def __init__(self, path, prefix=sys.prefix,
                  hook=False, pkgs_dir=None, evt_mgr=None,
-                 verbose=False, noapp=False):
+                 verbose=False, noapp=False, extract_workers=1,
+                 remove_workers=1):
         self.path = path
         self.fn = basename(path)
         name, version = name_version_fn(self.fn)
@@ -128,29 +154,139 @@ class EggInst(object):
             self.meta_dir = join(self.egginfo_dir, self.cname)
 
         self.meta_json = join(self.meta_dir, 'egginst.json')
+        self.files_manifest = join(self.meta_dir, FILES_MANIFEST)
         self.files = []
         self.verbose = verbose
 
+        # number of threads extracting the egg members, each with its own
+        # zipfile handle. Extraction is sequential when 1
+        self.extract_workers = extract_workers
+        # number of threads removing the installed files
+        self.remove_workers = remove_workers
+        self._local = threading.local()
+
+        # maps the directories known to exist to True when they have been
+        # created by this install (nothing in them may then be overwritten)
+        self._dirs = {}
+        self._dirs_lock = threading.Lock()
+
+        # when set, the members are written under this directory instead of
+        # the prefix (see stage)
+        self._stage_dir = None
+
 
     def install(self, extra_info=None):
 
-        if not isdir(self.meta_dir):
-            os.makedirs(self.meta_dir)
+        self._ensure_dir(self.meta_dir)
+        self._open()
+        self.extract()
+        self._finish_install(extra_info)
+
+    def stage(self, stage_dir, installing=()):
+        """
+        Extract the egg into stage_dir, which mirrors the layout of the
+        prefix and should be on the same file system, without touching the
+        prefix itself.  installing lists the files about to be installed
+        into the prefix by other eggs (see object_code.set_targets).
+
+        The members of the egg which commit needs (see _finish_install),
+        and its installed size, are copied into a small egg next to
+        stage_dir, so that the egg itself is not needed anymore.
+
+        Return the list of the destinations of the staged files, which is
+        passed to commit.
+        """
+        self._open(installing)
+        self._stage_dir = stage_dir
+        try:
+            self.extract()
+            self._write_commit_egg(stage_dir)
+        finally:
+            self._stage_dir = None
+            self.z.close()
+        return self.files
 
-        self.z = zipfile.ZipFile(self.path)
+    def _commit_egg_path(self, stage_dir):
+        return stage_dir + '-commit.egg'
+
+    def _write_commit_egg(self, stage_dir):
+        arcnames = [arcname for arcname in COMMIT_ARCNAMES
+                    if arcname in self._arcnames_set]
+        if on_win:
+            # the files copied by scripts.create_proxies
+            for line in self.lines_from_arcname(
+                    'EGG-INFO/inst/files_to_install.txt'):
+                arcname, action = line.split()
+                if action != 'PROXY':
+                    arcnames.append(arcname)
+        path = self._commit_egg_path(stage_dir)
+        makedirs(dirname(path))
+        z = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+        try:
+            z.comment = json.dumps({'installed_size': self.installed_size})
+            for arcname in arcnames:
+                z.writestr(arcname, self.z.read(arcname))
+        finally:
+            z.close()
+
+    def commit(self, stage_dir, files, extra_info=None):
+        """
+        Move the files staged by stage into the prefix, and complete the
+        install from the members of the egg copied by stage (the egg itself
+        is not read).  The files already moved, e.g. by a commit which has
+        been interrupted, are skipped, so that a commit may be resumed.
+        """
+        self._ensure_dir(self.meta_dir)
+        for path in files:
+            staged = self._staged_path(path, stage_dir)
+            if not os.path.lexists(staged):
+                continue
+            self._ensure_dir(dirname(path))
+            if on_win:
+                unlink_file(path)
+            os.rename(staged, path)
+        self.files = list(files)
+
+        self.z = zipfile.ZipFile(self._commit_egg_path(stage_dir))
         self.arcnames = self.z.namelist()
+        self.installed_size = json.loads(self.z.comment)['installed_size']
+        self._finish_install(extra_info)
 
-        self.extract()
+    def _open(self, installing=()):
+        self.z = zipfile.ZipFile(self.path)
+        self.arcnames = self.z.namelist()
 
+        if not on_win:
+            import links
+            if self.verbose:
+                links.verbose = object_code.verbose = True
+            # object code is fixed while being extracted, so the libraries
+            # the egg is about to install need to be known beforehand
+            targets = [self.get_dst(arcname) for arcname in self.arcnames]
+            targets.extend(links.destinations(self))
+            targets.extend(installing)
+            object_code.set_targets(self, targets)
+
+    def _staged_path(self, path, stage_dir):
+        return stage_dir + path[len(self.prefix):]
+
+    def _target(self, path):
+        """
+        Return where the given destination is written: the destination
+        itself, or its counterpart in the staging directory while staging.
+        """
+        if self._stage_dir is None:
+            return path
+        return self._staged_path(path, self._stage_dir)
+
+    def _finish_install(self, extra_info):
         if on_win:
             scripts.create_proxies(self)
         else:
             import links
-            import object_code
             if self.verbose:
-                links.verbose = object_code.verbose = True
+                links.verbose = True
             links.create(self)
-            object_code.fix_files(self)
 
         self.entry_points()
         if ('EGG-INFO/spec/depend' in self.arcnames  or
@@ -162,6 +298,7 @@ class EggInst(object):
         scripts.fix_scripts(self)
         self.install_app()
         self.write_meta()
+        installdb.update_installed(self.prefix, self.cname)
 
         self.run('post_egginst.py')
 
@@ -186,13 +323,16 @@ class EggInst(object):
         return abspath(path).replace(self.prefix, '.').replace('\\', '/')
 
     def write_meta(self):
+        files = [self.rel_prefix(p) if abspath(p).startswith(self.prefix)
+                 else p
+                 for p in self.files + [self.meta_json, self.files_manifest]]
+        write_files_manifest(self.files_manifest, files)
         d = dict(
             egg_name = self.fn,
             prefix = self.prefix,
             installed_size = self.installed_size,
-            files = [self.rel_prefix(p)
-                           if abspath(p).startswith(self.prefix) else p
-                     for p in self.files + [self.meta_json]]
+            files_count = len(files),
+            files_manifest_version = FILES_MANIFEST_VERSION,
         )
         with open(self.meta_json, 'w') as f:
             json.dump(d, f, indent=2, sort_keys=True)
@@ -200,7 +340,23 @@ class EggInst(object):
     def read_meta(self):
         d = read_meta(self.meta_dir)
         self.installed_size = d['installed_size']
-        self.files = [join(self.prefix, f) for f in d['files']]
+        self.files = list(self._iter_installed_files(d))
+
+    def _iter_installed_files(self, d):
+        """
+        Yield the paths of the installed files, given the content of
+        egginst.json.  Older installs list them in egginst.json itself.
+        """
+        if 'files' in d:
+            rel_files = d['files']
+        else:
+            version = d.get('files_manifest_version', FILES_MANIFEST_VERSION)
+            if version != FILES_MANIFEST_VERSION:
+                raise ValueError("%s: unsupported files manifest version %r"
+                                 % (self.files_manifest, version))
+            rel_files = iter_files_manifest(self.files_manifest)
+        for f in rel_files:
+            yield join(self.prefix, f)
 
 
     def lines_from_arcname(self, arcname, ignore_empty=True):
@@ -223,7 +379,10 @@ class EggInst(object):
 
         is_custom_egg = eggmeta.is_custom_egg(self.path)
         n = 0
-        size = sum(self.z.getinfo(name).file_size for name in self.arcnames)
+        zip_infos = self.z.infolist()
+        self._arcnames_set = set(self.arcnames)
+        self._namespace_inits = {}
+        size = sum(zip_info.file_size for zip_info in zip_infos)
         self.installed_size = size
         progress = ProgressManager(
                 self.evt_mgr, source=self,
@@ -238,31 +397,90 @@ class EggInst(object):
         use_legacy_egg_info_format = has_legacy_egg_info_format(self.arcnames,
                 is_custom_egg)
 
-        if use_legacy_egg_info_format:
-            with progress:
-                for name in self.arcnames:
-                    zip_info = self.z.getinfo(name)
-                    n += zip_info.file_size
-
-                    if is_in_legacy_egg_info(name, is_custom_egg):
-                        self._write_legacy_egg_info_metadata(zip_info)
-                    else:
-                        self.write_arcname(name)
+        def extract_member(zip_info):
+            return self._extract_member(zip_info, is_custom_egg,
+                                        use_legacy_egg_info_format)
 
+        with progress:
+            if self.extract_workers > 1 and len(zip_infos) > 1:
+                # symlinks are created once every regular member has been
+                # written, so that they never race with the creation of the
+                # directories they live in or point to
+                regular = [i for i, zip_info in enumerate(zip_infos)
+                           if not is_zipinfo_symlink(zip_info)]
+                links = [i for i, zip_info in enumerate(zip_infos)
+                         if is_zipinfo_symlink(zip_info)]
+
+                files = [None] * len(zip_infos)
+                member_files = self._parallel_map(extract_member,
+                        [zip_infos[i] for i in regular])
+                for i, ret in izip(regular, member_files):
+                    files[i] = ret
+                    n += zip_infos[i].file_size
+                    progress(step=n)
+                for i in links:
+                    files[i] = extract_member(zip_infos[i])
+                    n += zip_infos[i].file_size
                     progress(step=n)
 
-        else:
-            with progress:
-                for name in self.arcnames:
-                    zip_info = self.z.getinfo(name)
+                # self.files is in archive order, whatever the order in
+                # which the members have been written
+                for member_files in files:
+                    self.files.extend(member_files)
+            else:
+                for zip_info in zip_infos:
+                    self.files.extend(extract_member(zip_info))
                     n += zip_info.file_size
-
-                    self.write_arcname(name)
-                    if should_copy_in_egg_info(name, is_custom_egg):
-                        self._write_standard_egg_info_metadata(zip_info)
-
                     progress(step=n)
 
+    def _parallel_map(self, func, zip_infos):
+        """
+        Yield func(zip_info) for each of the given members, in order, the
+        calls being spread across self.extract_workers threads.
+        """
+        handles = []
+        lock = threading.Lock()
+
+        def open_zip():
+            z = zipfile.ZipFile(self.path)
+            with lock:
+                handles.append(z)
+            self._local.z = z
+
+        pool = ThreadPool(self.extract_workers, open_zip)
+        try:
+            for ret in pool.imap(func, zip_infos):
+                yield ret
+        finally:
+            pool.terminate()
+            pool.join()
+            for z in handles:
+                z.close()
+
+    @property
+    def _zip(self):
+        """
+        The zipfile handle of the current extraction thread.
+        """
+        return getattr(self._local, 'z', None) or self.z
+
+    def _extract_member(self, zip_info, is_custom_egg,
+                        use_legacy_egg_info_format):
+        """
+        Extract the given member, and return the list of paths written.
+        """
+        name = zip_info.filename
+        if use_legacy_egg_info_format:
+            if is_in_legacy_egg_info(name, is_custom_egg):
+                paths = [self._write_legacy_egg_info_metadata(zip_info)]
+            else:
+                paths = [self._write_arcname(name, zip_info)]
+        else:
+            paths = [self._write_arcname(name, zip_info)]
+            if should_copy_in_egg_info(name, is_custom_egg):
+                paths.append(self._write_standard_egg_info_metadata(zip_info))
+        return [path for path in paths if path is not None]
+
     def _write_legacy_egg_info_metadata(self, zip_info):
         if is_zipinfo_dir(zip_info):
             return
@@ -275,7 +493,7 @@ class EggInst(object):
 
             dest = join(self.pyloc, setuptools_egg_info_dir(self.path),
                         from_egg_info)
-            self._write_egg_info_arcname(name, dest)
+            return self._write_egg_info_arcname(name, dest)
         else:
             raise ValueError(
                     "BUG: Unexpected name for legacy egg info in {0}: {1}". \
@@ -290,18 +508,79 @@ class EggInst(object):
         dest = posixpath.join(self.pyloc, setuptools_egg_info_dir(self.path),
                 from_egg_info)
 
-        self._write_egg_info_arcname(name, dest)
+        return self._write_egg_info_arcname(name, dest)
 
     def _write_egg_info_arcname(self, name, dest):
-        ensure_dir(dest)
-        source = self.z.open(name)
+        target = self._target(dest)
+        self._ensure_dir(dirname(target))
+        self._copy_member(name, target)
+        return dest
+
+    def _ensure_dir(self, path):
+        """
+        Create the given directory (and its parents) if necessary, and return
+        True if it has been created by this install.  The state of the
+        directories is cached, so that each is looked up at most once.
+        """
+        with self._dirs_lock:
+            try:
+                return self._dirs[path]
+            except KeyError:
+                pass
+            # look for the closest existing parent
+            missing = []
+            parent = path
+            while parent not in self._dirs and not isdir(parent):
+                missing.append(parent)
+                parent = dirname(parent)
+            self._dirs.setdefault(parent, False)
+            for dn in reversed(missing):
+                makedirs(dn)
+                self._dirs[dn] = True
+            return self._dirs[path]
+
+    def _clear_target(self, path):
+        """
+        Create the directory of the given destination, and remove whatever
+        is at the destination, unless its directory has just been created.
+        """
+        if not self._ensure_dir(dirname(path)):
+            unlink_file(path)
+
+    def _copy_member(self, zip_info, dest):
+        """
+        Copy the given archive member to dest, in chunks of bounded size so
+        that large members are never held in memory.
+
+        Object code is fixed (see object_code.fix_object_code) while being
+        copied, so that it is written once.
+        """
+        source = self._zip.open(zip_info)
         try:
-            with file(dest, "wb") as target:
-                shutil.copyfileobj(source, target)
-                self.files.append(dest)
+            with open(dest, "wb") as target:
+                if on_win:
+                    shutil.copyfileobj(source, target, EXTRACT_CHUNK_SIZE)
+                else:
+                    # placeholders in object code are fixed on the fly
+                    object_code.copy_fixing_object_code(source, target, dest,
+                            EXTRACT_CHUNK_SIZE)
         finally:
             source.close()
 
+    def _is_namespace_init(self, arcname):
+        """
+        Return True if the given __init__.py archive name declares a
+        namespace package. Results are memoized, as both the .py and the .pyc
+        need the answer.
+        """
+        try:
+            return self._namespace_inits[arcname]
+        except KeyError:
+            ret = (arcname in self._arcnames_set and
+                   NS_PKG_PAT.match(self._zip.read(arcname)) is not None)
+            self._namespace_inits[arcname] = ret
+            return ret
+
 
     def get_dst(self, arcname):
         for start, cond, dst_dir in [
@@ -318,52 +597,56 @@ class EggInst(object):
 
     def extract_symlink(self, arcname):
         link_name = self.get_dst(arcname)
-        source = self.z.read(arcname)
-        dirn, filename = os.path.split(link_name)
-        makedirs(dirn)
-        if os.path.exists(link_name):
-            os.unlink(link_name)
-        os.symlink(source, link_name)
+        source = self._zip.read(arcname)
+        target = self._target(link_name)
+        self._clear_target(target)
+        os.symlink(source, target)
         return link_name
 
     py_pat = re.compile(r'^(.+)\.py(c|o)?$')
     so_pat = re.compile(r'^lib.+\.so')
     py_obj = '.pyd' if on_win else '.so'
-    def write_arcname(self, arcname):
+    def write_arcname(self, arcname, zip_info=None):
+        path = self._write_arcname(arcname, zip_info)
+        if path is not None:
+            self.files.append(path)
+
+    def _write_arcname(self, arcname, zip_info=None):
+        """
+        Write the given member to its destination, and return the path
+        written, or None if the member is not installed.
+        """
         if arcname.endswith('/') or arcname.startswith('.unused'):
             return
-        zip_info = self.z.getinfo(arcname)
+        if zip_info is None:
+            zip_info = self.z.getinfo(arcname)
         if is_zipinfo_symlink(zip_info):
-            link_name = self.extract_symlink(arcname)
-            self.files.append(link_name)
-            return
+            return self.extract_symlink(arcname)
 
         m = self.py_pat.match(arcname)
-        if m and (m.group(1) + self.py_obj) in self.arcnames:
+        if m and (m.group(1) + self.py_obj) in self._arcnames_set:
             # .py, .pyc, .pyo next to .so are not written
             return
         path = self.get_dst(arcname)
         dn, fn = os.path.split(path)
-        data = self.z.read(arcname)
+        is_namespace_init = False
         if fn in ['__init__.py', '__init__.pyc']:
-            tmp = arcname.rstrip('c')
-            if tmp in self.arcnames and NS_PKG_PAT.match(self.z.read(tmp)):
-                if fn == '__init__.py':
-                    data = ''
+            if self._is_namespace_init(arcname.rstrip('c')):
                 if fn == '__init__.pyc':
                     return
-        self.files.append(path)
-        if not isdir(dn):
-            os.makedirs(dn)
-        rm_rf(path)
-        fo = open(path, 'wb')
-        fo.write(data)
-        fo.close()
+                is_namespace_init = True
+        target = self._target(path)
+        self._clear_target(target)
+        if is_namespace_init:
+            open(target, 'wb').close()
+        else:
+            self._copy_member(zip_info, target)
         if (arcname.startswith(('EGG-INFO/usr/bin/', 'EGG-INFO/scripts/')) or
                 fn.endswith(('.dylib', '.pyd', '.so')) or
                 (arcname.startswith('EGG-INFO/usr/lib/') and
                  self.so_pat.match(fn))):
-            os.chmod(path, 0755)
+            os.chmod(target, 0755)
+        return path
 
 
     def install_app(self, remove=False):
@@ -409,11 +692,14 @@ class EggInst(object):
              cwd=dirname(path))
 
 
-    def rm_dirs(self):
+    def rm_dirs(self, dir_names=None):
+        if dir_names is None:
+            dir_names = set(dirname(p) for p in self.files)
         dir_paths = set()
         len_prefix = len(self.prefix)
-        for path in set(dirname(p) for p in self.files):
-            while len(path) > len_prefix:
+        for path in dir_names:
+            # the parents of a directory already seen have been added too
+            while len(path) > len_prefix and path not in dir_paths:
                 dir_paths.add(path)
                 path = dirname(path)
 
@@ -431,13 +717,18 @@ class EggInst(object):
         else:
             from console import ProgressManager
 
-        self.read_meta()
+        d = read_meta(self.meta_dir)
+        self.installed_size = d['installed_size']
+        if 'files' in d:
+            steps = len(d['files'])
+        else:
+            steps = d['files_count']
         n = 0
         progress = ProgressManager(
                 self.evt_mgr, source=self,
                 operation_id=uuid4(),
                 message="removing egg",
-                steps=len(self.files),
+                steps=steps,
                 # ---
                 progress_type="removing", filename=self.fn,
                 disp_amount=human_bytes(self.installed_size),
@@ -446,18 +737,53 @@ class EggInst(object):
         self.run('pre_egguninst.py')
 
         with progress:
-            for p in self.files:
+            # the installed files are streamed from the manifest, which is
+            # itself removed last, with the meta_dir
+            paths = (p for p in self._iter_installed_files(d)
+                     if not (basename(p) == FILES_MANIFEST and
+                             normpath(dirname(p)) == normpath(self.meta_dir)))
+            dir_names = set()
+            for dir_name in self._remove_files(paths):
                 n += 1
                 progress(step=n)
-
-                rm_rf(p)
-                if p.endswith('.py'):
-                    rm_rf(p + 'c')
-            self.rm_dirs()
+                dir_names.add(dir_name)
+            self.rm_dirs(dir_names)
             rm_rf(self.meta_dir)
+            installdb.update_installed(self.prefix, self.cname)
             rm_empty_dir(self.egginfo_dir)
 
 
+    def _remove_file(self, path):
+        """
+        Remove an installed file (and the .pyc of a .py file), and return
+        its directory.
+        """
+        unlink_file(path)
+        if path.endswith('.py'):
+            unlink_file(path + 'c')
+        return dirname(path)
+
+    def _remove_files(self, paths):
+        """
+        Remove the given installed files, spread across
+        self.remove_workers threads, and yield their directories as they
+        are removed.
+        """
+        if self.remove_workers < 2:
+            for path in paths:
+                yield self._remove_file(path)
+            return
+
+        pool = ThreadPool(self.remove_workers)
+        try:
+            for dir_name in pool.imap_unordered(self._remove_file, paths,
+                                                chunksize=64):
+                yield dir_name
+        finally:
+            pool.terminate()
+            pool.join()
+
+
 def read_meta(meta_dir):
     meta_json = join(meta_dir, 'egginst.json')
     if isfile(meta_json):
@@ -465,23 +791,59 @@ def read_meta(meta_dir):
     return None
 
 
+def _escape_manifest_path(f):
+    return f.replace('\\', '\\\\').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def _unescape_manifest_path(f):
+    if '\\' not in f:
+        return f
+    return _MANIFEST_ESCAPE_PAT.sub(lambda m: _MANIFEST_UNESCAPES[m.group(1)],
+                                    f)
+
+
+def write_files_manifest(path, files):
+    """
+    Write the given paths to a files manifest: one line per path, made of
+    the length of the start it shares with the previous path, a space, and
+    the rest of the path.  Backslashes, newlines and carriage returns are
+    escaped with a backslash, as in Python strings.
+    """
+    prev = ''
+    with open(path, 'w') as fo:
+        for f in files:
+            if isinstance(f, unicode):
+                f = f.encode('utf-8')
+            f = _escape_manifest_path(f)
+            n = len(commonprefix([prev, f]))
+            fo.write('%d %s\n' % (n, f[n:]))
+            prev = f
+
+
+def iter_files_manifest(path):
+    """
+    Yield the paths of a files manifest (see write_files_manifest).
+    """
+    prev = ''
+    with open(path) as fi:
+        for line in fi:
+            n, _, rest = line.rstrip('\n').partition(' ')
+            prev = prev[:int(n)] + rest
+            yield _unescape_manifest_path(prev)
+
+
 def get_installed(prefix=sys.prefix):
     """
     Generator returns a sorted list of all installed packages.
     Each element is the filename of the egg which was used to install the
     package.
     """
-    egg_info_dir = join(prefix, 'EGG-INFO')
-    if not isdir(egg_info_dir):
-        return
-    pat = re.compile(r'([a-z0-9_.]+)$')
-    for fn in sorted(os.listdir(egg_info_dir)):
-        if not pat.match(fn):
-            continue
-        d = read_meta(join(egg_info_dir, fn))
-        if d is None:
+    packages = installdb.read_installed(prefix)
+    for name in sorted(packages):
+        egg_name = packages[name]['egg_name']
+        if egg_name is None:
             continue
-        yield d['egg_name']
+        yield egg_name
 
 
 def print_installed(prefix=sys.prefix):
@@ -529,6 +891,22 @@ def main(argv=None):
                  action="store_true",
                  help="remove package(s), requires the egg or project name(s)")
 
+    p.add_option("--extract-workers",
+                 action="store",
+                 type="int",
+                 default=1,
+                 help="number of threads extracting the eggs, "
+                      "defaults to %default",
+                 metavar='N')
+
+    p.add_option("--remove-workers",
+                 action="store",
+                 type="int",
+                 default=1,
+                 help="number of threads removing the files of the "
+                      "packages, defaults to %default",
+                 metavar='N')
+
     p.add_option('-v', "--verbose", action="store_true")
     p.add_option('--version', action="store_true")
 
@@ -554,7 +932,9 @@ def main(argv=None):
 
     for path in args:
         ei = EggInst(path, prefix, opts.hook, opts.pkgs_dir, evt_mgr,
-                     verbose=opts.verbose, noapp=opts.noapp)
+                     verbose=opts.verbose, noapp=opts.noapp,
+                     extract_workers=opts.extract_workers,
+                     remove_workers=opts.remove_workers)
         if opts.remove:
             ei.remove()
         else: # default is always install
@@ -1,7 +1,9 @@
 # Changes library path in object code (ELF and Mach-O).
 
+import mmap
 import sys
 import re
+import shutil
 from os.path import abspath, join, islink, isfile, exists
 
 
@@ -29,6 +31,10 @@ MAGIC = {
 # list of target direcories where shared object files are found
 _targets = []
 
+# set of paths the egg being extracted is about to install: find_lib
+# considers them as existing, as object code is fixed during extraction
+_installing = set()
+
 
 def get_object_type(path):
     """
@@ -46,7 +52,7 @@ def get_object_type(path):
 def find_lib(fn):
     for tgt in _targets:
         dst = abspath(join(tgt, fn))
-        if exists(dst):
+        if dst in _installing or exists(dst):
             return dst
     print "ERROR: library %r not found" % fn
     return join('/ERROR/path/not/found', fn)
@@ -112,59 +118,133 @@ def macho_add_rpaths_to_file(filename, rpaths):
             header.write(f)
 
 placehold_pat = re.compile(5 * '/PLACEHOLD' + '([^\0\\s]*)\0')
+def _replacement(m, tp):
+    """
+    Return the (null-padded) string replacing the placeholder match m, in an
+    object file of type tp.
+    """
+    rest = m.group(1)
+    original_r = rest
+    while rest.startswith('/PLACEHOLD'):
+        rest = rest[10:]
+
+    if tp.startswith('MachO-') and rest.startswith('/'):
+        # If the /PLACEHOLD is found in a LC_LOAD_DYLIB command
+        r = find_lib(rest[1:])
+    else:
+        # If the /PLACEHOLD is found in a LC_RPATH command (Mach-O) or in
+        # R(UN)PATH on ELF
+        assert rest == '' or rest.startswith(':')
+        rpaths = list(_targets)
+        # extend the list with rpath which were already in the binary,
+        # if any
+        rpaths.extend(p for p in rest.split(':') if p)
+        r = ':'.join(rpaths)
+
+    if verbose:
+        print "replacing rpath {} with {}".format(original_r, r)
+    if alt_replace_func is not None:
+        r = alt_replace_func(r)
+
+    padding = len(m.group(0)) - len(r)
+    if padding < 1: # we need at least one null-character
+        raise Exception("placeholder %r too short" % m.group(0))
+    r += padding * '\0'
+    assert m.start() + len(r) == m.end()
+    return r
+
 def fix_object_code(path):
     tp = get_object_type(path)
     if tp is None:
         return
-    
-    f = open(path, 'r+b')
-    data = f.read()
-    matches = list(placehold_pat.finditer(data))
-    if not matches:
-        f.close()
+
+    # The file is memory-mapped and patched in place, so that memory usage
+    # does not depend on the size of the library
+    with open(path, 'r+b') as f:
+        data = mmap.mmap(f.fileno(), 0)
+        try:
+            for i, m in enumerate(_iter_placeholders(data)):
+                if verbose and i == 0:
+                    print "Fixing placeholders in:", path
+                data[m.start():m.end()] = _replacement(m, tp)
+        finally:
+            data.close()
+
+
+def _iter_placeholders(data):
+    """
+    Yield the placeholder matches in data (a string or mmap). Unlike
+    placehold_pat.finditer, the regex is only tried where the marker is found.
+    """
+    marker = 5 * '/PLACEHOLD'
+    i = data.find(marker)
+    while i >= 0:
+        m = placehold_pat.match(data, i)
+        if m is None:
+            i = data.find(marker, i + 1)
+        else:
+            yield m
+            i = data.find(marker, m.end())
+
+
+def copy_fixing_object_code(source, target, path, chunk_size=2 ** 16):
+    """
+    Copy the file object source to target, fixing the placeholders on the fly
+    if source is object code. path is the destination of the copy, used to
+    guess whether it may be object code.
+
+    Data are read in chunks of chunk_size: only the bytes which may belong to
+    a placeholder spanning two chunks are kept around.
+    """
+    head = source.read(chunk_size)
+    tp = None if path.endswith(NO_OBJ) else MAGIC.get(head[:4])
+    if tp is None:
+        target.write(head)
+        shutil.copyfileobj(source, target, chunk_size)
         return
 
-    if verbose:
-        print "Fixing placeholders in:", path
-    for m in matches:
-        rest = m.group(1)
-        original_r = rest
-        while rest.startswith('/PLACEHOLD'):
-            rest = rest[10:]
-
-        if tp.startswith('MachO-') and rest.startswith('/'):
-            # If the /PLACEHOLD is found in a LC_LOAD_DYLIB command
-            r = find_lib(rest[1:])
+    marker = '/PLACEHOLD'
+
+    fixed = False
+    buf = head
+    while True:
+        data = source.read(chunk_size)
+        eof = not data
+        buf += data
+
+        start = 0
+        for m in _iter_placeholders(buf):
+            if verbose and not fixed:
+                print "Fixing placeholders in:", path
+            fixed = True
+            target.write(buf[start:m.start()])
+            target.write(_replacement(m, tp))
+            start = m.end()
+
+        if eof:
+            target.write(buf[start:])
+            return
+
+        # Keep the tail which may be the beginning of a placeholder: as a
+        # placeholder never contains null or whitespace characters (but the
+        # terminating null), it starts after the last of those.
+        keep = max([start] + [buf.rfind(c, start) + 1 for c in '\0 \t\n\r\x0b\x0c'])
+        i = buf.find(marker, keep)
+        if i < 0:
+            # only the beginning of the marker may be there
+            keep = max(keep, len(buf) - len(marker) + 1)
         else:
-            # If the /PLACEHOLD is found in a LC_RPATH command (Mach-O) or in
-            # R(UN)PATH on ELF
-            assert rest == '' or rest.startswith(':')
-            rpaths = list(_targets)
-            # extend the list with rpath which were already in the binary,
-            # if any
-            rpaths.extend(p for p in rest.split(':') if p)
-            r = ':'.join(rpaths)
-
-        if verbose:
-            print "replacing rpath {} with {}".format(original_r, r)
-        if alt_replace_func is not None:
-            r = alt_replace_func(r)
-
-        padding = len(m.group(0)) - len(r)
-        if padding < 1: # we need at least one null-character
-            raise Exception("placeholder %r too short" % m.group(0))
-        r += padding * '\0'
-        assert m.start() + len(r) == m.end()
-        f.seek(m.start())
-        f.write(r)
-    f.close()
+            keep = i
+        target.write(buf[start:keep])
+        buf = buf[keep:]
 
 
-def fix_files(egg):
+def set_targets(egg, installing=()):
     """
-    Tries to fix the library path for all object files installed by the egg.
+    Set the target directories where the shared object files of the egg are
+    looked for. installing is the set of paths the egg is about to install.
     """
-    global _targets
+    global _targets, _installing
 
     prefixes = [egg.prefix] if egg.prefix != abspath(sys.prefix) else [sys.prefix]
 
@@ -173,11 +253,19 @@ def fix_files(egg):
         for line in egg.lines_from_arcname('EGG-INFO/inst/targets.dat'):
             _targets.append(join(prefix, line))
         _targets.append(join(prefix, 'lib'))
+    _installing = set(installing)
 
     if verbose:
         print 'Target directories:'
         for tgt in _targets:
             print '    %r' % tgt
 
+
+def fix_files(egg):
+    """
+    Tries to fix the library path for all object files installed by the egg.
+    """
+    set_targets(egg)
+
     for p in egg.files:
         fix_object_code(p)
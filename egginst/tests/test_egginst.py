@@ -1,9 +1,11 @@
+import json
 import os
 import os.path
 import shutil
 import subprocess
 import sys
 import tempfile
+import zipfile
 
 if sys.version_info[:2] < (2, 7):
     import unittest2 as unittest
@@ -12,9 +14,11 @@ else:
 
 import mock
 
-from egginst.main import EggInst, get_installed, main
+from egginst.main import EggInst, get_installed, iter_files_manifest, main, \
+        write_files_manifest
 from egginst.testing_utils import slow, assert_same_fs
-from egginst.utils import makedirs, zip_write_symlink, ZipFile
+from egginst.utils import makedirs, rel_site_packages, zip_write_symlink, \
+        ZipFile
 
 from egginst import eggmeta
 
@@ -58,6 +62,241 @@ class TestEggInst(unittest.TestCase):
         self.assertEqual(os.readlink(link), "include")
         self.assertTrue(os.path.exists(os.path.join(link, "foo.h")))
 
+    def test_streaming_extraction(self):
+        """
+        Ensure members are streamed to disk instead of being read in memory,
+        and that namespace packages are still handled.
+        """
+        egg_filename = os.path.join(self.base_dir, "foo-1.0-1.egg")
+        big_data = "".join(chr(i % 256) for i in range(3 * 2 ** 20))
+        ns_init = "__import__('pkg_resources').declare_namespace(__name__)\n"
+        with ZipFile(egg_filename, "w", zipfile.ZIP_DEFLATED) as fp:
+            fp.writestr("foo/__init__.py", ns_init)
+            fp.writestr("foo/__init__.pyc", "dummy bytecode")
+            fp.writestr("foo/bar/__init__.py", "")
+            fp.writestr("foo/bar/big.dat", big_data)
+
+        original_read = zipfile.ZipFile.read
+        read_arcnames = []
+        def read(z, name, *a, **kw):
+            read_arcnames.append(name)
+            return original_read(z, name, *a, **kw)
+
+        installer = EggInst(egg_filename, prefix=self.prefix)
+        with mock.patch.object(zipfile.ZipFile, "read", read):
+            installer.install()
+
+        site_packages = os.path.join(self.prefix, rel_site_packages)
+        with open(os.path.join(site_packages, "foo", "bar", "big.dat"), "rb") as fp:
+            self.assertEqual(fp.read(), big_data)
+        with open(os.path.join(site_packages, "foo", "__init__.py"), "rb") as fp:
+            self.assertEqual(fp.read(), "")
+        self.assertFalse(os.path.exists(os.path.join(site_packages, "foo",
+                                                     "__init__.pyc")))
+
+        self.assertEqual(read_arcnames.count("foo/__init__.py"), 1)
+        self.assertNotIn("foo/bar/big.dat", read_arcnames)
+
+    def test_parallel_extraction(self):
+        """
+        Ensure parallel extraction writes the same files as the sequential
+        one, and records them in the same order.
+        """
+        egg_filename = os.path.join(self.base_dir, "foo-1.0-1.egg")
+        with ZipFile(egg_filename, "w", zipfile.ZIP_DEFLATED) as fp:
+            for i in range(50):
+                fp.writestr("foo/mod{0}.py".format(i), "a = {0}\n".format(i) * 100)
+            fp.writestr("EGG-INFO/usr/lib/libfoo.so.1", "\x7fELF")
+            fp.writestr("EGG-INFO/usr/include/foo.h", "/* header */")
+            if SUPPORT_SYMLINK:
+                zip_write_symlink(fp, "EGG-INFO/usr/lib/libfoo.so", "libfoo.so.1")
+
+        def _install(prefix, extract_workers):
+            installer = EggInst(egg_filename, prefix=prefix,
+                                extract_workers=extract_workers)
+            installer.install()
+            return [os.path.relpath(p, prefix) for p in installer.files]
+
+        sequential_prefix = os.path.join(self.base_dir, "sequential")
+        parallel_prefix = os.path.join(self.base_dir, "parallel")
+
+        r_files = _install(sequential_prefix, 1)
+        files = _install(parallel_prefix, 4)
+
+        self.assertEqual(files, r_files)
+        for path in files:
+            sequential_path = os.path.join(sequential_prefix, path)
+            parallel_path = os.path.join(parallel_prefix, path)
+            self.assertEqual(os.path.islink(parallel_path),
+                             os.path.islink(sequential_path))
+            with open(parallel_path, "rb") as fp:
+                with open(sequential_path, "rb") as r_fp:
+                    self.assertEqual(fp.read(), r_fp.read())
+            self.assertEqual(os.stat(parallel_path).st_mode,
+                             os.stat(sequential_path).st_mode)
+
+    def test_fresh_targets(self):
+        """
+        Ensure nothing is removed before writing into the directories created
+        by the install, while existing files are replaced.
+        """
+        egg_filename = os.path.join(self.base_dir, "foo-1.0-1.egg")
+        with ZipFile(egg_filename, "w") as fp:
+            for i in range(10):
+                fp.writestr("foo/sub{0}/mod{1}.py".format(i % 2, i), "a = 1\n")
+
+        with mock.patch("egginst.main.unlink_file") as m:
+            EggInst(egg_filename, prefix=self.prefix).install()
+            self.assertFalse(m.called)
+
+        installer = EggInst(egg_filename, prefix=self.prefix)
+        path = os.path.join(installer.site_packages, "foo", "sub0", "mod0.py")
+        if SUPPORT_SYMLINK:
+            # the existing link is replaced, not written through
+            target = os.path.join(self.base_dir, "target")
+            with open(target, "w") as fp:
+                fp.write("target")
+            os.unlink(path)
+            os.symlink(target, path)
+        else:
+            with open(path, "w") as fp:
+                fp.write("modified")
+        installer.install()
+        self.assertFalse(os.path.islink(path))
+        with open(path) as fp:
+            self.assertEqual(fp.read(), "a = 1\n")
+        if SUPPORT_SYMLINK:
+            with open(target) as fp:
+                self.assertEqual(fp.read(), "target")
+
+    def test_parallel_remove(self):
+        egg_filename = os.path.join(self.base_dir, "foo-1.0-1.egg")
+        with ZipFile(egg_filename, "w", zipfile.ZIP_DEFLATED) as fp:
+            for i in range(200):
+                fp.writestr("foo/sub{0}/mod{1}.py".format(i % 7, i), "a = 1\n")
+            fp.writestr("EGG-INFO/usr/include/foo.h", "/* header */")
+
+        installer = EggInst(egg_filename, prefix=self.prefix)
+        installer.install()
+        site_packages = installer.site_packages
+        # byte-compiled files are removed with their source
+        compiled = os.path.join(site_packages, "foo", "sub0", "mod0.pyc")
+        with open(compiled, "w") as fp:
+            fp.write("")
+
+        EggInst(egg_filename, prefix=self.prefix, remove_workers=4).remove()
+
+        self.assertFalse(os.path.exists(os.path.join(site_packages, "foo")))
+        self.assertFalse(os.path.exists(os.path.join(self.prefix, "include")))
+        self.assertFalse(os.path.exists(installer.meta_dir))
+
+    def test_stage_commit(self):
+        egg_filename = os.path.join(self.base_dir, "foo-1.0-1.egg")
+        with ZipFile(egg_filename, "w") as fp:
+            for i in range(10):
+                fp.writestr("foo/sub{0}/mod{1}.py".format(i % 2, i), "a = 1\n")
+            fp.writestr("EGG-INFO/usr/include/foo.h", "/* header */")
+            if SUPPORT_SYMLINK:
+                zip_write_symlink(fp, "EGG-INFO/usr/HEADERS", "include")
+        stage_dir = os.path.join(self.base_dir, "stage")
+        reference = os.path.join(self.base_dir, "reference")
+
+        installer = EggInst(egg_filename, prefix=self.prefix)
+        files = installer.stage(stage_dir)
+        self.assertFalse(os.path.exists(self.prefix))
+        staged = os.path.join(stage_dir, "include", "foo.h")
+        self.assertTrue(os.path.isfile(staged))
+
+        # a commit interrupted after moving the first file is resumed, and
+        # does not need the egg anymore
+        first = files[0]
+        makedirs(os.path.dirname(first))
+        os.rename(first.replace(self.prefix, stage_dir, 1), first)
+        moved = os.path.join(self.base_dir, "moved.egg")
+        os.rename(egg_filename, moved)
+        EggInst(egg_filename, prefix=self.prefix).commit(stage_dir, files)
+        os.rename(moved, egg_filename)
+        self.assertFalse(os.path.exists(staged))
+
+        EggInst(egg_filename, prefix=reference).install()
+        def installed(prefix):
+            return sorted(os.path.relpath(os.path.join(root, f), prefix)
+                          for root, dirs, files in os.walk(prefix)
+                          for f in files + [d for d in dirs if
+                              os.path.islink(os.path.join(root, d))])
+        self.assertEqual(installed(self.prefix), installed(reference))
+        self.assertEqual(
+            list(iter_files_manifest(installer.files_manifest)),
+            list(iter_files_manifest(
+                EggInst(egg_filename, prefix=reference).files_manifest)))
+        if SUPPORT_SYMLINK:
+            link = os.path.join(self.prefix, "HEADERS")
+            self.assertEqual(os.readlink(link), "include")
+
+    def test_files_manifest(self):
+        files = ["./lib/python2.7/site-packages/foo/__init__.py",
+                 "./lib/python2.7/site-packages/foo/bar.py",
+                 "./lib/python2.7/site-packages/foobar.py",
+                 "./bin/foo",
+                 "/usr/local/bin/foo",
+                 "./share/foo\nbar\\n\r",
+                 "./share/foo\\bar",
+                 u"./lib/python2.7/site-packages/foo/\xe9t\xe9.py"]
+        path = os.path.join(self.base_dir, "files.txt")
+
+        write_files_manifest(path, files)
+
+        self.assertEqual(list(iter_files_manifest(path)),
+                         files[:-1] + [files[-1].encode("utf-8")])
+        with open(path) as fp:
+            lines = fp.read().splitlines()
+        self.assertEqual(len(lines), len(files))
+        self.assertEqual(lines[1], "34 bar.py")
+        self.assertEqual(lines[2], "33 bar.py")
+        self.assertEqual(lines[5], "0 ./share/foo\\nbar\\\\n\\r")
+
+    def _installed_files(self, installer):
+        return [p for p in installer.files if os.path.exists(p)]
+
+    def test_remove_streamed_manifest(self):
+        installer = EggInst(DUMMY_EGG, self.prefix)
+        installer.install()
+        installed_files = self._installed_files(installer)
+        self.assertTrue(len(installed_files) > 0)
+
+        with open(installer.meta_json) as fp:
+            d = json.load(fp)
+        self.assertNotIn("files", d)
+        self.assertEqual(d["files_manifest_version"], 1)
+
+        EggInst(DUMMY_EGG, self.prefix).remove()
+        for path in installed_files:
+            self.assertFalse(os.path.exists(path))
+        self.assertFalse(os.path.exists(installer.meta_dir))
+
+    def test_remove_json_manifest(self):
+        """
+        Ensure packages installed with the file list in egginst.json can be
+        removed.
+        """
+        installer = EggInst(DUMMY_EGG, self.prefix)
+        installer.install()
+        installed_files = self._installed_files(installer)
+
+        # rewrite the metadata as older versions did
+        with open(installer.meta_json) as fp:
+            d = json.load(fp)
+        d["files"] = list(iter_files_manifest(installer.files_manifest))
+        del d["files_count"]
+        os.unlink(installer.files_manifest)
+        with open(installer.meta_json, "w") as fp:
+            json.dump(d, fp, indent=2, sort_keys=True)
+
+        EggInst(DUMMY_EGG, self.prefix).remove()
+        for path in installed_files:
+            self.assertFalse(os.path.exists(path))
+        self.assertFalse(os.path.exists(installer.meta_dir))
+
 class TestEggInstMain(unittest.TestCase):
     def test_print_version(self):
         # XXX: this is lousy test: we'd like to at least ensure we're printing
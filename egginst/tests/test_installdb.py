@@ -0,0 +1,115 @@
+import json
+import os.path
+import sys
+
+if sys.version_info[:2] < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+
+import mock
+
+from egginst.installdb import _entry_stamp, db_path, read_installed
+from egginst.main import EggInst, get_installed
+from egginst.utils import rm_rf
+
+from .common import DUMMY_EGG, DUMMY_EGG_WITH_ENTRY_POINTS, mkdtemp
+
+
+class TestInstallDB(unittest.TestCase):
+    def _install(self, prefix, *eggs):
+        for egg in eggs:
+            EggInst(egg, prefix).install()
+
+    def test_install_remove(self):
+        with mkdtemp() as d:
+            self._install(d, DUMMY_EGG, DUMMY_EGG_WITH_ENTRY_POINTS)
+
+            with open(db_path(d)) as fp:
+                packages = json.load(fp)["packages"]
+            self.assertItemsEqual(packages.keys(),
+                                  ["dummy", "dummy_with_entry_points"])
+            self.assertEqual(packages["dummy"]["egg_name"],
+                             os.path.basename(DUMMY_EGG))
+            self.assertEqual(packages["dummy"]["info"]["version"], "1.0.1")
+
+            EggInst(DUMMY_EGG, d).remove()
+            self.assertEqual(read_installed(d).keys(),
+                             ["dummy_with_entry_points"])
+
+            # the database is removed together with the last package
+            EggInst(DUMMY_EGG_WITH_ENTRY_POINTS, d).remove()
+            self.assertFalse(os.path.exists(os.path.join(d, "EGG-INFO")))
+
+    def test_read_uses_database(self):
+        with mkdtemp() as d:
+            self._install(d, DUMMY_EGG, DUMMY_EGG_WITH_ENTRY_POINTS)
+
+            with mock.patch("egginst.installdb._read_entry") as m:
+                self.assertEqual(list(get_installed(d)),
+                                 sorted([os.path.basename(DUMMY_EGG),
+                                         os.path.basename(
+                                             DUMMY_EGG_WITH_ENTRY_POINTS)]))
+                self.assertFalse(m.called)
+
+    def test_update_single_entry(self):
+        with mkdtemp() as d:
+            self._install(d, DUMMY_EGG, DUMMY_EGG_WITH_ENTRY_POINTS)
+
+            # installing or removing a package only looks at its metadata
+            with mock.patch("egginst.installdb._entry_stamp",
+                            wraps=_entry_stamp) as m:
+                EggInst(DUMMY_EGG, d).remove()
+                self.assertEqual(m.call_count, 0)
+                self._install(d, DUMMY_EGG)
+                m.assert_called_once_with(os.path.join(d, "EGG-INFO",
+                                                       "dummy"))
+
+            with mock.patch("egginst.installdb._read_entry") as m:
+                self.assertItemsEqual(read_installed(d).keys(),
+                                      ["dummy", "dummy_with_entry_points"])
+                self.assertFalse(m.called)
+
+    def test_rebuild(self):
+        r_installed = [os.path.basename(DUMMY_EGG)]
+        with mkdtemp() as d:
+            self._install(d, DUMMY_EGG, DUMMY_EGG_WITH_ENTRY_POINTS)
+
+            # metadata removed behind our back
+            rm_rf(os.path.join(d, "EGG-INFO", "dummy_with_entry_points"))
+            self.assertEqual(list(get_installed(d)), r_installed)
+
+            # missing database
+            rm_rf(db_path(d))
+            self.assertEqual(list(get_installed(d)), r_installed)
+            self.assertTrue(os.path.isfile(db_path(d)))
+
+            # invalid database
+            with open(db_path(d), "w") as fp:
+                fp.write("{")
+            self.assertEqual(list(get_installed(d)), r_installed)
+
+    def test_rebuild_changed(self):
+        with mkdtemp() as d:
+            self._install(d, DUMMY_EGG)
+            self.assertEqual(read_installed(d)["dummy"]["info"]["version"],
+                             "1.0.1")
+
+            # same package replaced behind our back
+            meta_dir = os.path.join(d, "EGG-INFO", "dummy")
+            for fn, key, value in [("_info.json", "version", "2.0.0"),
+                                   ("egginst.json", "egg_name",
+                                    "dummy-2.0.0-1.egg")]:
+                path = os.path.join(meta_dir, fn)
+                with open(path) as fp:
+                    data = json.load(fp)
+                data[key] = value
+                with open(path, "w") as fp:
+                    json.dump(data, fp)
+                # same size, but another modification time
+                st = os.stat(path)
+                os.utime(path, (st.st_atime, st.st_mtime + 10))
+
+            self.assertEqual(read_installed(d)["dummy"]["info"]["version"],
+                             "2.0.0")
+            self.assertEqual(list(get_installed(d)), ["dummy-2.0.0-1.egg"])
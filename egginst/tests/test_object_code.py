@@ -1,3 +1,4 @@
+import cStringIO
 import os
 import shutil
 import sys
@@ -14,7 +15,8 @@ import mock
 from machotools import rewriter_factory
 
 from egginst.main import EggInst
-from egginst.object_code import find_lib, fix_object_code, get_object_type, macho_add_rpaths_to_file
+from egginst.object_code import copy_fixing_object_code, find_lib, \
+    fix_object_code, get_object_type, macho_add_rpaths_to_file
 
 from .common import DUMMY_EGG_WITH_INST_TARGETS, FILE_TO_RPATHS, \
     LEGACY_PLACEHOLD_FILE, NOLEGACY_RPATH_FILE, MACHO_ARCH_TO_FILE, \
@@ -89,6 +91,29 @@ class TestObjectCode(unittest.TestCase):
 
                 self.assertTrue(installed_pyext_dependency in deps)
 
+    def test_fix_object_code_elf(self):
+        """
+        Test all the placeholders are fixed, and that invalid ones are left
+        alone.
+        """
+        rpath = 5 * "/PLACEHOLD" + ":/usr/local/lib\0"
+        invalid = 5 * "/PLACEHOLD" + " \0"
+        data = "\x7fELF" + rpath + invalid + "\0" * 10 + rpath
+        r_rpath = "/foo/lib:/usr/local/lib"
+        r_rpath += "\0" * (len(rpath) - len(r_rpath))
+        r_data = "\x7fELF" + r_rpath + invalid + "\0" * 10 + r_rpath
+
+        with mkdtemp() as d:
+            path = os.path.join(d, "libfoo.so")
+            with open(path, "wb") as fp:
+                fp.write(data)
+
+            with mock.patch("egginst.object_code._targets", ["/foo/lib"]):
+                fix_object_code(path)
+
+            with open(path, "rb") as fp:
+                self.assertEqual(fp.read(), r_data)
+
     @unittest.skipIf(sys.platform=="win32", "This feature is not used on windows.")
     def test_find_lib_with_targets(self):
         """
@@ -102,6 +127,53 @@ class TestObjectCode(unittest.TestCase):
                 path = "libfoo.dylib"
                 self.assertEqual(find_lib(path), os.path.join(d, "lib", "foo-4.2", path))
 
+class TestCopyFixingObjectCode(unittest.TestCase):
+    def _copy(self, data, path, chunk_size):
+        target = cStringIO.StringIO()
+        copy_fixing_object_code(cStringIO.StringIO(data), target, path,
+                                chunk_size)
+        return target.getvalue()
+
+    def test_same_as_fix_object_code(self):
+        """
+        Ensure fixing while copying gives the same result as fixing the copied
+        file, whatever the chunk size.
+        """
+        for source in (LEGACY_PLACEHOLD_FILE, NOLEGACY_RPATH_FILE,
+                       PYEXT_WITH_LEGACY_PLACEHOLD_DEPENDENCY):
+            with mkdtemp() as d:
+                copy = os.path.join(d, os.path.basename(source))
+                shutil.copy(source, copy)
+                with open(source, "rb") as fp:
+                    data = fp.read()
+
+                with mock.patch("egginst.object_code._targets", [d]):
+                    fix_object_code(copy)
+                    with open(copy, "rb") as fp:
+                        r_data = fp.read()
+
+                    for chunk_size in (5, 64, 1000, 2 ** 16):
+                        self.assertEqual(self._copy(data, copy, chunk_size),
+                                         r_data)
+
+    def test_placeholder_across_chunks(self):
+        rpath = 5 * "/PLACEHOLD" + ":/usr/local/lib\0"
+        data = "\x7fELF" + "\0" * 10 + rpath + "\0abc" * 10 + rpath
+        r_rpath = "/foo/lib:/usr/local/lib"
+        r_rpath += "\0" * (len(rpath) - len(r_rpath))
+        r_data = "\x7fELF" + "\0" * 10 + r_rpath + "\0abc" * 10 + r_rpath
+
+        with mock.patch("egginst.object_code._targets", ["/foo/lib"]):
+            for chunk_size in range(4, len(data) + 1):
+                self.assertEqual(self._copy(data, "libfoo.so", chunk_size),
+                                 r_data)
+
+    def test_not_object_code(self):
+        data = "\x7fELF" + 5 * "/PLACEHOLD" + "\0"
+        with mock.patch("egginst.object_code._targets", ["/foo/lib"]):
+            self.assertEqual(self._copy(data, "foo.txt", 4), data)
+            self.assertEqual(self._copy(data[4:], "foo", 4), data[4:])
+
 class TestMachoAddRpathsToFile(unittest.TestCase):
     def test_legacy_placehold_lib(self):
         with mkdtemp() as d:
@@ -72,6 +72,20 @@ def rm_rf(path, verbose=False):
             shutil.rmtree(path)
 
 
+def unlink_file(path):
+    """
+    Remove the file (or link) `path` without checking its type first, so
+    that only one system call is made in the usual case.  Anything else
+    than a file is removed with rm_rf.  If `path` does not exist, do
+    nothing.
+    """
+    try:
+        os.unlink(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            rm_rf(path)
+
+
 def get_executable(prefix):
     if on_win:
         paths = [prefix, join(prefix, bin_dir_name)]
@@ -238,7 +238,8 @@ class Configuration(object):
         accepted_keys_as_is = set([
             "proxy", "noapp", "use_webservice", "autoupdate",
             "prefix", "local", "IndexedRepos", "webservice_entry_point",
-            "repository_cache"
+            "repository_cache", "download_workers", "transactional_install",
+            "egg_cache", "egg_cache_size"
         ])
         parser = PythonConfigurationParser()
 
@@ -283,6 +284,16 @@ class Configuration(object):
         self._webservice_entry_point = fill_url(get_default_url())
 
         self.repository_cache = self.local
+        # number of eggs fetched concurrently by Enpkg.execute
+        self.download_workers = 4
+        # Enpkg.execute stages the eggs to install before modifying the
+        # prefix (see enstaller.transaction)
+        self.transactional_install = False
+        # directory of the egg store shared between configurations (see
+        # enstaller.eggcache), and its maximum size in bytes (None for no
+        # limit)
+        self.egg_cache = None
+        self.egg_cache_size = None
 
         self._username = None
         self._password = None
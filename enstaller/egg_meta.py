@@ -6,7 +6,7 @@ from os.path import getmtime, isfile, join
 
 from egginst.eggmeta import info_from_z
 
-from utils import info_file
+from utils import checksum_cache, info_file
 
 
 egg_fmt = '%(name)s-%(version)s-%(build)d.egg'
@@ -34,6 +34,7 @@ def update_index(dir_path, force=False, verbose=False):
     else:
         index = json.load(open(index_path, 'r'))
 
+    checksums = checksum_cache(dir_path)
     new_index = {}
     for fn in os.listdir(dir_path):
         if not is_valid_eggname(fn):
@@ -43,9 +44,10 @@ def update_index(dir_path, force=False, verbose=False):
         if info and getmtime(path) == info['mtime']:
             new_index[fn] = info
             continue
-        info = info_file(path)
+        info = info_file(path, checksums.md5(path))
         info.update(info_from_egg(path))
         new_index[fn] = info
+    checksums.save()
 
     patches_index_path = join(dir_path, 'patches', 'index.json')
     if isfile(patches_index_path):
@@ -0,0 +1,220 @@
+"""
+Content-addressed store of eggs, which may be shared by several prefixes
+(and users) of the same host.
+
+The eggs are stored under their MD5 (as given by the repository index),
+in <root>/md5/<first two hex digits>/<md5>, and are materialized into the
+local directory of each configuration (see Enpkg.local_dir) as hard links
+when possible, and copies otherwise (e.g. across file systems).  The stored
+files are made read-only, as writing through any of their links would
+corrupt the store.
+
+Concurrent writers never see each other's partial files: an egg is first
+linked or copied into <root>/tmp, under a name unique to the writer, and
+then renamed into place, which is atomic.  Readers do not take any lock:
+an egg evicted while being materialized is merely not found.
+
+The store may be given a maximum size, in which case the least recently
+used eggs (according to their access time, which is set each time an egg
+is materialized) are evicted once it is exceeded.  Eviction is serialized
+through an exclusive lock on <root>/lock; a process finding the lock taken
+leaves the eviction to its holder.
+
+Trust model: the store is not trusted.  Every materialized egg is checked
+against the MD5 of the repository index by the caller (see
+FetchAPI.fetch_egg), and the entries which do not match are discarded.
+The check goes through the checksum cache of the local directory (see
+enstaller.utils.ChecksumCache), which only hashes a file again when its
+size, modification time or inode changes: the modification time of the
+stored eggs is therefore left alone, and materializing an egg already
+checked costs a stat.  This shortcut relies on the entry not having been
+rewritten in place, which only its owner can do.  The eggs stored by
+other users are therefore copied rather than linked, so that they cannot
+be modified once checked, and each copy is hashed in full.
+"""
+import errno
+import os
+import shutil
+import stat
+import sys
+import threading
+import time
+from os.path import isfile, join
+
+from egginst.utils import makedirs, rm_rf
+
+from utils import FileLock
+
+
+# leftovers of interrupted writes older than this (in seconds) are removed
+# when evicting
+_STALE_TMP_AGE = 24 * 3600
+
+
+class EggCache(object):
+    """
+    The egg store rooted at the given directory, holding at most max_size
+    bytes of eggs (no limit when None).
+    """
+    def __init__(self, root, max_size=None):
+        self.root = root
+        self.max_size = max_size
+        self._objects_dir = join(root, 'md5')
+        self._tmp_dir = join(root, 'tmp')
+        self._lock_path = join(root, 'lock')
+
+    def path(self, md5):
+        """
+        Return the path of the egg with the given MD5 in the store.
+        """
+        return join(self._objects_dir, md5[:2], md5)
+
+    def _tmp_path(self, directory, name):
+        return join(directory, '.%s.%d.%d.tmp' % (
+            name, os.getpid(), threading.current_thread().ident))
+
+    def _link_or_copy(self, source, dest, copy=False):
+        if not copy:
+            try:
+                os.link(source, dest)
+                return
+            except (AttributeError, OSError):
+                # no hard links on this platform, or across file systems
+                pass
+        shutil.copyfile(source, dest)
+
+    def _place(self, source, dest, tmp_dir, copy=False):
+        """
+        Atomically put a link to (or a copy of, when copy is True) source at
+        dest.
+        """
+        tmp_path = self._tmp_path(tmp_dir, os.path.basename(dest))
+        try:
+            self._link_or_copy(source, tmp_path, copy)
+            if sys.platform == 'win32':
+                rm_rf(dest)
+            os.rename(tmp_path, dest)
+        except:
+            rm_rf(tmp_path)
+            raise
+
+    def get(self, md5, dest, size=None):
+        """
+        Materialize the egg with the given MD5 at dest, and return True, or
+        return False if the store does not hold it.  When size is given, an
+        egg of a different size is removed from the store.  The content of
+        dest is not checked (see the trust model above).
+        """
+        path = self.path(md5)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        if size is not None and st.st_size != size:
+            self.discard(md5)
+            return False
+        # an egg stored by another user may be modified by them after having
+        # been checked, unlike a copy of it
+        foreign = hasattr(os, 'getuid') and st.st_uid != os.getuid()
+        try:
+            self._place(path, dest, os.path.dirname(dest), copy=foreign)
+        except (IOError, OSError) as e:
+            if e.errno == errno.ENOENT and not isfile(path):
+                # evicted in the meantime
+                return False
+            raise
+        try:
+            # the modification time is part of the checksum cache key
+            os.utime(path, (time.time(), st.st_mtime))
+        except OSError:
+            # e.g. stored by another user: the recency is only approximate
+            pass
+        return True
+
+    def add(self, source, md5):
+        """
+        Add the egg at source, whose MD5 is given, to the store, and evict
+        the least recently used eggs if the store has become too large.
+        """
+        path = self.path(md5)
+        if isfile(path):
+            return
+        makedirs(os.path.dirname(path))
+        makedirs(self._tmp_dir)
+        self._place(source, path, self._tmp_dir)
+        try:
+            # the egg counts as just used, whatever the age of source
+            os.utime(path, None)
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+            os.chmod(path, mode & ~(stat.S_IWUSR | stat.S_IWGRP |
+                                    stat.S_IWOTH))
+        except OSError:
+            pass
+        if self.max_size is not None:
+            self.evict(self.max_size)
+
+    def discard(self, md5):
+        """
+        Remove the egg with the given MD5 from the store, if there (and
+        allowed to).
+        """
+        try:
+            rm_rf(self.path(md5))
+        except OSError:
+            # e.g. in a directory of another user
+            pass
+
+    def _iter_objects(self):
+        """
+        Yield tuples (atime, size, path) of the eggs in the store.
+        """
+        if not os.path.isdir(self._objects_dir):
+            return
+        for root, dirs, files in os.walk(self._objects_dir):
+            for fn in files:
+                path = join(root, fn)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield st.st_atime, st.st_size, path
+
+    def size(self):
+        """
+        Return the total size of the eggs in the store.
+        """
+        return sum(size for atime, size, path in self._iter_objects())
+
+    def evict(self, max_size):
+        """
+        Remove the least recently used eggs until the store holds at most
+        max_size bytes.  Nothing is done if another process is evicting.
+        """
+        if not os.path.isdir(self.root):
+            return
+        lock = FileLock(self._lock_path)
+        if not lock.acquire():
+            return
+        try:
+            objects = sorted(self._iter_objects())
+            total = sum(size for atime, size, path in objects)
+            for atime, size, path in objects:
+                if total <= max_size:
+                    break
+                rm_rf(path)
+                total -= size
+            self._remove_stale_tmp()
+        finally:
+            lock.release()
+
+    def _remove_stale_tmp(self):
+        if not os.path.isdir(self._tmp_dir):
+            return
+        limit = time.time() - _STALE_TMP_AGE
+        for fn in os.listdir(self._tmp_dir):
+            path = join(self._tmp_dir, fn)
+            try:
+                if os.lstat(path).st_mtime < limit:
+                    rm_rf(path)
+            except OSError:
+                pass
@@ -5,6 +5,7 @@ from os.path import isdir, isfile, join
 from abc import ABCMeta, abstractmethod
 
 import egginst
+from egginst.installdb import read_installed
 
 from egg_meta import split_eggname
 
@@ -79,6 +80,41 @@ class EggCollection(AbstractEggCollection):
 
         self.pkgs_dir = join(self.prefix, 'pkgs')
 
+        # maps meta_dir -> ((mtime, size) of its _info.json, info), so that
+        # looking an installed package up by name costs a single stat
+        self._infos = {}
+
+    def _info_from_metadir(self, meta_dir):
+        """
+        Same as info_from_metadir, but cached until the _info.json file
+        changes.  A copy of the cached dictionary is returned.
+        """
+        try:
+            st = os.stat(join(meta_dir, '_info.json'))
+        except OSError:
+            self._infos.pop(meta_dir, None)
+            return None
+        stamp = (st.st_mtime, st.st_size)
+        cached = self._infos.get(meta_dir)
+        if cached is None or cached[0] != stamp:
+            cached = self._infos[meta_dir] = (stamp,
+                                              info_from_metadir(meta_dir))
+        info = cached[1]
+        return None if info is None else dict(info)
+
+    def _installed_info(self, packages, name):
+        """
+        Return the info of the given package from the installed packages
+        database of the prefix (see egginst.installdb), or None.
+        """
+        entry = packages.get(name)
+        if entry is None or entry['info'] is None:
+            return None
+        info = dict(entry['info'])
+        info['installed'] = True
+        info['meta_dir'] = join(self.prefix, 'EGG-INFO', name)
+        return info
+
     def find(self, egg):
         try:
             n, v, b = split_eggname(egg)
@@ -87,9 +123,12 @@ class EggCollection(AbstractEggCollection):
         if self.hook:
             path = join(self.pkgs_dir,
                         '%s-%s-%d' % (n.lower(), v, b), 'EGG-INFO')
+            info = info_from_metadir(path)
         else:
-            path = join(self.prefix, 'EGG-INFO', n.lower())
-        info = info_from_metadir(path)
+            # only the metadata of the package is looked at, not the whole
+            # installed packages database
+            info = self._info_from_metadir(join(self.prefix, 'EGG-INFO',
+                                                n.lower()))
         if info and info['key'] == egg:
             return info
         else:
@@ -107,14 +146,15 @@ class EggCollection(AbstractEggCollection):
                 if info and all(info.get(k) == v
                                 for k, v in kwargs.iteritems()):
                     yield info['key'], info
+        elif name:
+            info = self._info_from_metadir(join(self.prefix, 'EGG-INFO',
+                                                name))
+            if info and all(info.get(k) == v for k, v in kwargs.iteritems()):
+                yield info['key'], info
         else:
-            egginfo_dir = join(self.prefix, 'EGG-INFO')
-            if not isdir(egginfo_dir):
-                return
-            for fn in sorted(os.listdir(egginfo_dir), key=string.lower):
-                if name and fn != name:
-                    continue
-                info = info_from_metadir(join(egginfo_dir, fn))
+            packages = read_installed(self.prefix)
+            for fn in sorted(packages, key=string.lower):
+                info = self._installed_info(packages, fn)
                 if info and all(info.get(k) == v
                                 for k, v in kwargs.iteritems()):
                     yield info['key'], info
@@ -127,6 +167,28 @@ class EggCollection(AbstractEggCollection):
         ei.super_id = getattr(self, 'super_id', None)
         ei.install(extra_info)
 
+    def stage(self, egg, dir_path, stage_dir, installing=()):
+        """
+        Extract the egg into stage_dir, see EggInst.stage.
+        """
+        ei = egginst.EggInst(join(dir_path, egg),
+                             prefix=self.prefix, hook=self.hook,
+                             evt_mgr=self.evt_mgr,
+                             pkgs_dir=self.pkgs_dir, verbose=self.verbose)
+        ei.super_id = getattr(self, 'super_id', None)
+        return ei.stage(stage_dir, installing)
+
+    def commit(self, egg, dir_path, stage_dir, files, extra_info=None):
+        """
+        Install the egg staged into stage_dir, see EggInst.commit.
+        """
+        ei = egginst.EggInst(join(dir_path, egg),
+                             prefix=self.prefix, hook=self.hook,
+                             evt_mgr=self.evt_mgr,
+                             pkgs_dir=self.pkgs_dir, verbose=self.verbose)
+        ei.super_id = getattr(self, 'super_id', None)
+        ei.commit(stage_dir, files, extra_info)
+
     def remove(self, egg):
         ei = egginst.EggInst(egg,
                              prefix=self.prefix, hook=self.hook,
@@ -163,5 +225,12 @@ class JoinedEggCollection(AbstractEggCollection):
     def install(self, egg, dir_path, extra_info=None):
         self.collections[0].install(egg, dir_path, extra_info)
 
+    def stage(self, egg, dir_path, stage_dir, installing=()):
+        return self.collections[0].stage(egg, dir_path, stage_dir, installing)
+
+    def commit(self, egg, dir_path, stage_dir, files, extra_info=None):
+        self.collections[0].commit(egg, dir_path, stage_dir, files,
+                                   extra_info)
+
     def remove(self, egg):
         self.collections[0].remove(egg)
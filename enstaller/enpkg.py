@@ -1,6 +1,10 @@
+import contextlib
 import ntpath
+import string
 import sys
 import warnings
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
 from uuid import uuid4
 from os.path import isdir, isfile, join
 import os
@@ -8,16 +12,20 @@ import threading
 
 import enstaller
 
+from egginst.utils import human_bytes
 from enstaller.errors import EnpkgError
 from store.indexed import LocalIndexedStore, RemoteHTTPIndexedStore
 from store.joined import JoinedStore
 
+from eggcache import EggCache
 from eggcollect import EggCollection, JoinedEggCollection
 
 from resolve import Req, Resolve, comparable_info
-from fetch import FetchAPI
+from utils import PY_VER
+from fetch import FetchAPI, FetchProgress
 from egg_meta import is_valid_eggname, split_eggname
 from history import History
+from transaction import Transaction
 
 # Included for backward compatibility
 from enstaller.config import Configuration
@@ -28,7 +36,8 @@ def create_joined_store(config, urls):
         if url.startswith('file://'):
             stores.append(LocalIndexedStore(url[7:]))
         elif url.startswith(('http://', 'https://')):
-            stores.append(RemoteHTTPIndexedStore(url, config.local))
+            stores.append(RemoteHTTPIndexedStore(
+                url, config.local, pool_size=config.download_workers))
         elif isdir(url):
             stores.append(LocalIndexedStore(url))
         else:
@@ -38,7 +47,8 @@ def create_joined_store(config, urls):
 
 def get_default_kvs(config):
     url = config.webservice_entry_point
-    return RemoteHTTPIndexedStore(url, config.local)
+    return RemoteHTTPIndexedStore(url, config.local,
+                                  pool_size=config.download_workers)
 
 
 def req_from_anything(arg):
@@ -72,7 +82,29 @@ def get_writable_local_dir(config):
 def get_default_remote(config):
     url = config.webservice_entry_point
     local_dir = get_writable_local_dir(config)
-    return RemoteHTTPIndexedStore(url, local_dir)
+    return RemoteHTTPIndexedStore(url, local_dir,
+                                  pool_size=config.download_workers)
+
+
+# waiting for a pending fetch without a timeout cannot be interrupted (e.g.
+# by Ctrl-C) on Python 2: it is waited for by periods of this many seconds
+_FETCH_WAIT_PERIOD = 1.0
+
+
+class _ExecutionAborted(Exception):
+    pass
+
+
+def _wait_fetch(result):
+    """
+    Wait for the given pending fetch (see Enpkg._fetch_stage) to complete,
+    and raise its error, if any.
+    """
+    while True:
+        try:
+            return result.get(_FETCH_WAIT_PERIOD)
+        except TimeoutError:
+            pass
 
 
 class Enpkg(object):
@@ -136,6 +168,16 @@ class Enpkg(object):
                 for prefix in self.prefixes])
         self._execution_aborted = threading.Event()
 
+        if self.config.egg_cache:
+            self._egg_cache = EggCache(self.config.egg_cache,
+                                       self.config.egg_cache_size)
+        else:
+            self._egg_cache = None
+
+        # resolver for self.remote, which caches the eggs available for each
+        # name until the next (re)connection
+        self._resolver = None
+
     # ============= methods which relate to remove store =================
 
     def reconnect(self):
@@ -150,6 +192,13 @@ class Enpkg(object):
     def _connect(self, force=False):
         if not self.remote.is_connected or force:
             self.remote.connect(self.userpass)
+            self._resolver = None
+
+    def _get_resolver(self):
+        self._connect()
+        if self._resolver is None or self._resolver.repo is not self.remote:
+            self._resolver = Resolve(self.remote, self.verbose)
+        return self._resolver
 
     def query_remote(self, **kwargs):
         """
@@ -161,18 +210,70 @@ class Enpkg(object):
 
     def info_list_name(self, name):
         """
-        return (sorted by versions (when possible)), a list of metadata
-        dictionaries which are available on the remote KVS for a given name
+        return (sorted by versions), a list of metadata dictionaries which
+        are available on the remote KVS for a given name
         """
         req = Req(name)
         info_list = []
         for key, info in self.query_remote(name=name):
             if req.matches(info):
                 info_list.append(dict(info))
-        try:
-            return sorted(info_list, key=comparable_info)
-        except TypeError:
-            return info_list
+        return sorted(info_list, key=comparable_info)
+
+    def info_list_groups(self, pat=None):
+        """
+        yield tuples (name, info_list) for all the projects available on the
+        remote KVS, by (case insensitive) alphabetical order of the names,
+        where info_list is a list of (key, info) tuples sorted as
+        info_list_name(name) is.  When pat (a compiled regular expression) is
+        given, only the names it matches are considered.  The remote index
+        is walked once, and each group is sorted only when it is yielded.
+        """
+        groups = {}
+        for key, info in self.query_remote():
+            name = info['name']
+            try:
+                group = groups[name]
+            except KeyError:
+                if pat and not pat.search(name):
+                    groups[name] = None
+                    continue
+                group = groups[name] = []
+            if group is None:
+                continue
+            if info['python'] in (None, PY_VER):
+                group.append((key, dict(info)))
+
+        for name in sorted(groups, key=string.lower):
+            info_list = groups[name]
+            if info_list is None:
+                continue
+            info_list.sort(key=lambda item: comparable_info(item[1]))
+            yield name, info_list
+
+    def newest_available(self, names=None):
+        """
+        return a dictionary mapping (lowercase) project names to a tuple
+        (key, info) of the largest version and build available on the
+        remote KVS, i.e. the last element of info_list_name(name).  When
+        names is given, only these projects are considered.  All projects
+        are looked up in a single pass over the remote index.
+        """
+        if names is not None:
+            names = set(name.lower() for name in names)
+        newest = {}
+        for key, info in self.query_remote():
+            name = info['name']
+            if names is not None and name not in names:
+                continue
+            if info['python'] not in (None, PY_VER):
+                continue
+            cinfo = comparable_info(info)
+            current = newest.get(name)
+            if current is None or cinfo >= current[0]:
+                newest[name] = (cinfo, key, info)
+        return dict((name, (key, dict(info)))
+                    for name, (cinfo, key, info) in newest.iteritems())
 
     # ============= methods which relate to local installation ===========
 
@@ -232,30 +333,198 @@ class Enpkg(object):
                 progress_type="super", filename=actions[-1][1],
                 disp_amount=len(actions), super_id=None)
 
-        with History(None if self.hook else self.prefixes[0]):
+        if self.config.transactional_install and not self.hook:
+            execute_actions = self._execute_transaction
+        else:
+            execute_actions = self._execute_actions
+
+        with History(None if self.hook else self.prefixes[0]) as history:
+            if not self.hook:
+                self._recover_transaction(history)
             with progress:
-                for n, (opcode, egg) in enumerate(actions):
-                    if self._execution_aborted.is_set():
-                        self._execution_aborted.clear()
-                        break
-                    if opcode.startswith('fetch_'):
-                        self.fetch(egg, force=int(opcode[-1]))
-                    elif opcode == 'remove':
-                        self.ec.remove(egg)
-                    elif opcode == 'install':
-                        if self.remote.is_connected:
-                            extra_info = self.remote.get_metadata(egg)
-                        else:
-                            extra_info = None
-                        self.ec.install(egg, self.local_dir, extra_info)
-                    else:
-                        raise Exception("unknown opcode: %r" % opcode)
-                    progress(step=n)
+                with self._fetch_stage(actions) as fetches:
+                    aborted = execute_actions(actions, fetches, progress,
+                                              history)
+        if aborted:
+            self._execution_aborted.clear()
 
         self.super_id = None
         for c in self.ec.collections:
             c.super_id = self.super_id
 
+    def _execute_actions(self, actions, fetches, progress, history):
+        """
+        Execute the actions one after the other, and return True if the
+        execution has been aborted.
+        """
+        for n, (opcode, egg) in enumerate(actions):
+            if self._execution_aborted.is_set():
+                return True
+            if opcode.startswith('fetch_'):
+                if egg not in fetches:
+                    self.fetch(egg, force=int(opcode[-1]))
+            elif opcode == 'remove':
+                self.ec.remove(egg)
+                history.record(opcode, egg)
+            elif opcode == 'install':
+                if egg in fetches:
+                    # wait for the egg to land in local_dir
+                    _wait_fetch(fetches.pop(egg))
+                    if self._execution_aborted.is_set():
+                        return True
+                if self.remote.is_connected:
+                    extra_info = self.remote.get_metadata(egg)
+                else:
+                    extra_info = None
+                self.ec.install(egg, self.local_dir, extra_info)
+                history.record(opcode, egg)
+            else:
+                raise Exception("unknown opcode: %r" % opcode)
+            progress(step=n)
+        return False
+
+    def _execute_transaction(self, actions, fetches, progress, history):
+        """
+        Execute the actions as a transaction (see enstaller.transaction): all
+        the eggs are fetched and staged before the prefix is modified, so
+        that aborting the execution until then leaves the prefix untouched.
+        Return True if the execution has been aborted.
+
+        With an event manager, the eggs fetched concurrently (see
+        _fetch_stage) are pipelined: each is staged as soon as it is in
+        local_dir, while the next ones are still being fetched.
+        """
+        steps = dict((action, n) for n, action in enumerate(actions))
+        fetch_steps = {}
+        transaction_actions = []
+        extra_infos = {}
+        for n, (opcode, egg) in enumerate(actions):
+            if self._execution_aborted.is_set():
+                return True
+            if opcode.startswith('fetch_'):
+                if egg in fetches:
+                    fetch_steps[egg] = n
+                else:
+                    self.fetch(egg, force=int(opcode[-1]))
+                    progress(step=n)
+            elif opcode in ('remove', 'install'):
+                transaction_actions.append((opcode, egg))
+                if opcode == 'install' and self.remote.is_connected:
+                    extra_infos[egg] = self.remote.get_metadata(egg)
+            else:
+                raise Exception("unknown opcode: %r" % opcode)
+
+        def fetched(opcode, egg):
+            if egg in fetches:
+                # wait for the egg to land in local_dir
+                _wait_fetch(fetches.pop(egg))
+                progress(step=fetch_steps[egg])
+            staged(opcode, egg)
+
+        def staged(opcode, egg):
+            if self._execution_aborted.is_set():
+                raise _ExecutionAborted()
+
+        def committed(opcode, egg):
+            history.record(opcode, egg)
+            progress(step=steps[opcode, egg])
+
+        transaction = Transaction(self.ec, self.local_dir, self.prefixes[0])
+        try:
+            transaction.stage(transaction_actions, extra_infos, staged,
+                              fetched)
+        except _ExecutionAborted:
+            return True
+        if self._execution_aborted.is_set():
+            transaction.rollback()
+            return True
+        # past this point, the actions are all carried out
+        transaction.commit(committed)
+        return False
+
+    def _recover_transaction(self, history):
+        """
+        Complete the transaction interrupted in the prefix by a previous
+        execution, if any (see Transaction.recover), before the prefix is
+        modified again.  If the recovery fails, so does the execution, and
+        the journal is kept for the next one.
+        """
+        transaction = Transaction(self.ec, self.local_dir, self.prefixes[0])
+        actions = transaction.recover(history.record)
+        if actions and self.verbose:
+            print "Completed interrupted transaction:"
+            for item in actions:
+                print '\t' + str(item)
+
+    @contextlib.contextmanager
+    def _fetch_stage(self, actions):
+        """
+        Start fetching the eggs of all the fetch_* actions concurrently, using
+        up to config.download_workers threads, and yield a dict mapping each
+        of those eggs to its pending result (whose get() method waits until
+        the egg is in local_dir).  The dict is empty when the eggs should
+        rather be fetched one after the other.
+
+        Without an event manager, the progress bar of the fetches would be
+        interleaved with the ones of the installs on the console: all the
+        eggs are then fetched before the dict is yielded.
+        """
+        fetch_actions = [(opcode, egg) for opcode, egg in actions
+                         if opcode.startswith('fetch_')]
+        workers = min(self.config.download_workers, len(fetch_actions))
+        if workers < 2:
+            yield {}
+            return
+
+        self._connect()
+        if self.evt_mgr:
+            from encore.events.api import ProgressManager
+        else:
+            from egginst.console import ProgressManager
+        # the fetches are reported as a single progress bar
+        size = sum(self.remote.get_metadata(egg).get('size', 0)
+                   for opcode, egg in fetch_actions)
+        progress = ProgressManager(
+                self.evt_mgr, source=self,
+                operation_id=uuid4(),
+                message="fetching",
+                steps=size,
+                # ---
+                progress_type="fetching",
+                filename="%d eggs" % len(fetch_actions),
+                disp_amount=human_bytes(size),
+                super_id=self.super_id)
+
+        fetches = {}
+        pool = ThreadPool(workers)
+
+        def join():
+            pool.close()
+            # raise the errors of the fetches nobody waited for
+            for result in fetches.itervalues():
+                _wait_fetch(result)
+            pool.join()
+
+        try:
+            with FetchProgress(progress) as fetch_progress:
+                for opcode, egg in fetch_actions:
+                    fetches[egg] = pool.apply_async(
+                        self.fetch, (egg,),
+                        dict(force=int(opcode[-1]), progress=fetch_progress))
+                if self.evt_mgr:
+                    yield fetches
+                join()
+            if not self.evt_mgr:
+                yield fetches
+        except:
+            # stop the fetches which are still running before propagating
+            # the error
+            self._execution_aborted.set()
+            pool.close()
+            pool.join()
+            self._execution_aborted.clear()
+            raise
+
     def abort_execution(self):
         self._execution_aborted.set()
 
@@ -265,9 +534,8 @@ class Enpkg(object):
             installed_version = enstaller.__version__
 
         mode = 'recur'
-        self._connect()
         req = req_from_anything("enstaller")
-        eggs = Resolve(self.remote, self.verbose).install_sequence(req, mode)
+        eggs = self._get_resolver().install_sequence(req, mode)
         if eggs is None:
             raise EnpkgError("No egg found for requirement '%s'." % req)
         elif not len(eggs) == 1:
@@ -291,8 +559,7 @@ class Enpkg(object):
         """
         req = req_from_anything(arg)
         # resolve the list of eggs that need to be installed
-        self._connect()
-        eggs = Resolve(self.remote, self.verbose).install_sequence(req, mode)
+        eggs = self._get_resolver().install_sequence(req, mode)
         if eggs is None:
              raise EnpkgError("No egg found for requirement '%s'." % req)
         return self._install_actions(eggs, mode, force, forceall)
@@ -427,9 +694,11 @@ class Enpkg(object):
                 index[key] = info
         return index.iteritems()
 
-    def fetch(self, egg, force=False):
+    def fetch(self, egg, force=False, progress=None):
         self._connect()
         f = FetchAPI(self.remote, self.local_dir, self.evt_mgr)
         f.super_id = getattr(self, 'super_id', None)
         f.verbose = self.verbose
+        f.progress = progress
+        f.cache = self._egg_cache
         f.fetch_egg(egg, force, self._execution_aborted)
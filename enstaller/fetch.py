@@ -2,12 +2,65 @@ import math
 import os
 import sys
 import hashlib
+import threading
 from uuid import uuid4
-from os.path import basename, isdir, isfile, join
+from os.path import basename, getsize, isdir, isfile, join
 
 from egginst.utils import human_bytes, rm_rf
 from enstaller.compat import close_file_or_response
-from utils import md5_file
+from utils import cached_md5_file, checksum_cache
+
+
+class FetchProgress(object):
+    """
+    Combine the progress of several (possibly concurrent) fetches into a
+    single progress manager.
+
+    Each fetch reports through its own slot (see ``slot``), which accepts the
+    same protocol as a ProgressManager; the byte counts of all the slots are
+    summed up and forwarded to the wrapped progress manager.  If progress is
+    None, nothing is reported.
+    """
+    def __init__(self, progress=None):
+        self._progress = progress
+        self._lock = threading.Lock()
+        self._step = 0
+
+    def __enter__(self):
+        if self._progress is not None:
+            self._progress.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._progress is not None:
+            self._progress.__exit__(exc_type, exc_value, traceback)
+
+    def _advance(self, n):
+        if self._progress is None:
+            return
+        with self._lock:
+            self._step += n
+            self._progress(step=self._step)
+
+    def slot(self):
+        return _FetchProgressSlot(self)
+
+
+class _FetchProgressSlot(object):
+
+    def __init__(self, parent):
+        self._parent = parent
+        self._step = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def __call__(self, step=0):
+        self._parent._advance(step - self._step)
+        self._step = step
 
 
 class FetchAPI(object):
@@ -17,6 +70,12 @@ class FetchAPI(object):
         self.local_dir = local_dir
         self.evt_mgr = evt_mgr
         self.verbose = False
+        # when set to a FetchProgress instance, progress is reported through
+        # it instead of a per-file progress manager
+        self.progress = None
+        # when set to an EggCache instance, eggs are looked up in it before
+        # being fetched, and added to it once fetched
+        self.cache = None
 
     def path(self, fn):
         return join(self.local_dir, fn)
@@ -24,42 +83,71 @@ class FetchAPI(object):
     def fetch(self, key, execution_aborted=None):
         """ Fetch the given key.
 
+        If a partial download of the key is found in local_dir (e.g. from an
+        aborted or interrupted fetch), only the missing bytes are fetched when
+        the store supports it.
+
         execution_aborted: a threading.Event object which signals when the execution
             needs to be aborted, or None, if we don't want to abort the fetching at all.
         """
         path = self.path(key)
-        fi, info = self.remote.get(key)
+        info = self.remote.get_metadata(key)
 
         size = info['size']
         md5 = info.get('md5')
 
-        if self.evt_mgr:
-            from encore.events.api import ProgressManager
+        pp = path + '.part'
+        offset = getsize(pp) if isfile(pp) else 0
+        if not 0 < offset < size:
+            offset = 0
+        try:
+            fi, start = self.remote.get_data_from(key, offset)
+        except KeyError:
+            if offset == 0:
+                raise
+            # e.g. the range is not satisfiable anymore: start from scratch
+            fi, start = self.remote.get_data_from(key, 0)
+
+        if self.progress is not None:
+            progress = self.progress.slot()
         else:
-            from egginst.console import ProgressManager
-
-        progress = ProgressManager(
-                self.evt_mgr, source=self,
-                operation_id=uuid4(),
-                message="fetching",
-                steps=size,
-                # ---
-                progress_type="fetching", filename=basename(path),
-                disp_amount=human_bytes(size),
-                super_id=getattr(self, 'super_id', None))
-
-        n = 0
+            if self.evt_mgr:
+                from encore.events.api import ProgressManager
+            else:
+                from egginst.console import ProgressManager
+
+            progress = ProgressManager(
+                    self.evt_mgr, source=self,
+                    operation_id=uuid4(),
+                    message="fetching",
+                    steps=size,
+                    # ---
+                    progress_type="fetching", filename=basename(path),
+                    disp_amount=human_bytes(size),
+                    super_id=getattr(self, 'super_id', None))
+
         h = hashlib.new('md5')
         if size < 256:
             buffsize = 1
         else:
             buffsize = 2 ** int(math.log(size / 256.0) / math.log(2.0) + 1)
 
-        pp = path + '.part'
-        if sys.platform == 'win32':
-            rm_rf(pp)
+        if start > 0:
+            if self.verbose:
+                print "Resuming fetch of %r at byte %d" % (key, start)
+            if md5:
+                # the bytes already there are part of the checksum as well
+                with open(pp, 'rb') as fo:
+                    for chunk in iter(lambda: fo.read(65536), ''):
+                        h.update(chunk)
+            mode = 'ab'
+        else:
+            mode = 'wb'
+
+        n = start
         with progress:
-            with open(pp, 'wb') as fo:
+            progress(step=n)
+            with open(pp, mode) as fo:
                 while True:
                     if execution_aborted is not None and execution_aborted.is_set():
                         close_file_or_response(fi)
@@ -76,11 +164,18 @@ class FetchAPI(object):
         close_file_or_response(fi)
 
         if md5 and h.hexdigest() != md5:
+            # do not resume from corrupted data next time
+            rm_rf(pp)
             raise ValueError("received data MD5 sums mismatch")
 
         if sys.platform == 'win32':
             rm_rf(path)
         os.rename(pp, path)
+        if md5:
+            # spare a forced fetch the hashing of the file
+            checksums = checksum_cache(self.local_dir)
+            checksums.record(path, md5)
+            checksums.save()
 
     def fetch_egg(self, egg, force=False, execution_aborted=None):
         """
@@ -96,15 +191,52 @@ class FetchAPI(object):
 
         # if force is used, make sure the md5 is the expected, otherwise
         # merely see if the file exists
+        md5 = info.get('md5')
         if isfile(path):
             if force:
-                if md5_file(path) == info.get('md5'):
+                if cached_md5_file(path) == md5:
                     if self.verbose:
                         print "Not refetching, %r MD5 match" % path
+                    self._add_to_cache(path, md5)
                     return
             else:
                 if self.verbose:
                     print "Not forcing refetch, %r exists" % path
                 return
 
+        if self._get_from_cache(path, md5, info.get('size')):
+            if self.verbose:
+                print "Using %r from the egg cache" % egg
+            return
+
         self.fetch(egg, execution_aborted)
+        if isfile(path):
+            self._add_to_cache(path, md5)
+
+    def _get_from_cache(self, path, md5, size):
+        if self.cache is None or not md5:
+            return False
+        try:
+            if not self.cache.get(md5, path, size):
+                return False
+        except (IOError, OSError) as e:
+            if self.verbose:
+                print "Warning: could not use the egg cache: %s" % e
+            return False
+        # the store is not trusted (see enstaller.eggcache)
+        if cached_md5_file(path) != md5:
+            self.cache.discard(md5)
+            rm_rf(path)
+            return False
+        return True
+
+    def _add_to_cache(self, path, md5):
+        if self.cache is None or not md5:
+            return
+        try:
+            self.cache.add(path, md5)
+        except (IOError, OSError) as e:
+            # the egg is in local_dir anyway
+            if self.verbose:
+                print "Warning: could not add %r to the egg cache: %s" % (
+                    path, e)
@@ -1,14 +1,26 @@
+import binascii
+import json
+import os
 import re
 import sys
 import time
 import string
-from os.path import isfile, join
+from os.path import getsize, isfile, join
 
 import egginst
+from egginst.utils import rm_rf
 
 
 TIME_FMT = '%Y-%m-%d %H:%M:%S %z %Z'
 
+# a snapshot of the latest state is written once that many revisions had to
+# be replayed to get it
+SNAPSHOT_INTERVAL = 20
+
+# number of bytes of the history file (before the snapshot offset) kept in
+# the snapshot, to detect a history file which has been rewritten
+_SNAPSHOT_CHECK_SIZE = 64
+
 def now():
     """
     return the current local time as an ISO formated
@@ -19,6 +31,9 @@ def now():
 def is_diff(content):
     return any(s.startswith(('-', '+')) for s in content)
 
+def _project_name(fn):
+    return egginst.name_version_fn(fn)[0].lower()
+
 def pretty_diff(diff):
     added = {}
     removed = {}
@@ -37,6 +52,22 @@ def pretty_diff(diff):
     for name in sorted(set(added) - changed):
         yield '+%s-%s' % (name, added[name])
 
+def apply_content(state, content):
+    """
+    return the state (set of eggs) resulting of a revision content (a set
+    of eggs or diffs) applied to the given state, which may be modified
+    """
+    if not is_diff(content):
+        return set(content)
+    for s in content:
+        if s.startswith('-'):
+            state.discard(s[1:])
+        elif s.startswith('+'):
+            state.add(s[1:])
+        else:
+            raise Exception('Did not expect: %s' % s)
+    return state
+
 def pretty_content(content):
     if is_diff(content):
         return pretty_diff(content)
@@ -48,19 +79,48 @@ class History(object):
 
     def __init__(self, prefix):
         self.prefix = prefix
+        # list of (opcode, egg) recorded within the context manager
+        self._actions = None
         if prefix is None:
             return
         self._log_path = join(prefix, 'enpkg.hist')
 
     def __enter__(self):
         if self.prefix is None:
-            return
-        self.update()
+            return self
+        self._state = self.update()
+        self._actions = []
+        return self
 
     def __exit__(self, exc_type, exc_value, traceback):
         if self.prefix is None:
             return
-        self.update()
+        actions, self._actions = self._actions, None
+        if exc_type is not None:
+            # some action may have been carried out partially
+            self.update()
+            return
+        curr = set(self._state)
+        for opcode, egg in actions:
+            if opcode == 'remove':
+                curr.discard(egg)
+            else:
+                # a prefix contains a single egg of a given project
+                name = _project_name(egg)
+                curr = set(fn for fn in curr if _project_name(fn) != name)
+                curr.add(egg)
+        if curr != self._state:
+            self._write_changes(self._state, curr)
+
+    def record(self, opcode, egg):
+        """
+        record an action ('install' or 'remove' of an egg) carried out
+        within the context manager, whose exit then writes the changes of
+        the recorded actions instead of scanning the installed packages
+        again
+        """
+        if self._actions is not None:
+            self._actions.append((opcode, egg))
 
     def _init_log_file(self, force=False):
         """
@@ -72,52 +132,61 @@ class History(object):
 
     def update(self):
         """
-        update the history file (creating a new one if necessary)
+        update the history file (creating a new one if necessary), and
+        return the current state
         """
         self._init_log_file()
         last = self.get_state()
         curr = set(egginst.get_installed(self.prefix))
-        if last == curr:
-            return
-        self._write_changes(last, curr)
+        if last != curr:
+            self._write_changes(last, curr)
+        return curr
 
     def parse(self):
         """
         parse the history file and return a list of
         tuples(datetime strings, set of eggs/diffs)
         """
-        res = []
+        return [(dt, cont) for dt, cont, end in self._iter_revisions()]
+
+    def _iter_revisions(self, offset=0):
+        """
+        parse the history file from the given byte offset (which has to be
+        the start of a revision), and yield tuples(datetime string, set of
+        eggs/diffs, byte offset of the end of the revision)
+        """
         if not isfile(self._log_path):
-            return res
+            return
         sep_pat = re.compile(r'==>\s*(.+?)\s*<==')
-        for line in open(self._log_path):
-            line = line.strip()
-            if not line or line.startswith('#'):
-                continue
-            m = sep_pat.match(line)
-            if m:
-                dt = m.group(1)
-                res.append((dt, set()))
-            else:
-                res[-1][1].add(line)
-        return res
+        dt = cont = None
+        with open(self._log_path, 'rb') as fi:
+            fi.seek(offset)
+            pos = offset
+            for line in fi:
+                start = pos
+                pos += len(line)
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                m = sep_pat.match(line)
+                if m:
+                    if dt is not None:
+                        yield dt, cont, start
+                    dt = m.group(1)
+                    cont = set()
+                else:
+                    cont.add(line)
+        if dt is not None:
+            yield dt, cont, pos
 
     def construct_states(self):
         """
         return a list of tuples(datetime strings, set of eggs)
         """
         res = []
+        cur = set()
         for dt, cont in self.parse():
-            if not is_diff(cont):
-                cur = cont
-            else:
-                for s in cont:
-                    if s.startswith('-'):
-                        cur.discard(s[1:])
-                    elif s.startswith('+'):
-                        cur.add(s[1:])
-                    else:
-                        raise Exception('Did not expect: %s' % s)
+            cur = apply_content(cur, cont)
             res.append((dt, cur.copy()))
         return res
 
@@ -126,9 +195,80 @@ class History(object):
         return the state, i.e. the set of eggs, for a given revision,
         defaults to latest (which is the same as the current state when
         the log file is up-to-date)
+
+        Only the revisions following the snapshot of the history file (see
+        _write_snapshot) are replayed, unless rev is older than the
+        snapshot.
+        """
+        revision, state, offset = self._read_snapshot()
+        if 0 <= rev < revision:
+            revision, state, offset = -1, set(), 0
+        tail = list(self._iter_revisions(offset))
+        n = revision + 1 + len(tail)
+        if rev < 0:
+            rev += n
+            if 0 <= rev < revision:
+                return self.get_state(rev)
+        if not 0 <= rev < n:
+            raise IndexError("no such revision: %d" % rev)
+
+        for dt, cont, end in tail[:rev - revision]:
+            state = apply_content(state, cont)
+        if rev == n - 1 and len(tail) >= SNAPSHOT_INTERVAL:
+            self._write_snapshot(rev, state, tail[-1][2])
+        return state
+
+    @property
+    def _snapshot_path(self):
+        return self._log_path + '.snapshot'
+
+    def _snapshot_check(self, offset):
+        """
+        return (the hexadecimal representation of) the bytes of the history
+        file right before the given offset
+        """
+        with open(self._log_path, 'rb') as fi:
+            start = max(0, offset - _SNAPSHOT_CHECK_SIZE)
+            fi.seek(start)
+            return binascii.hexlify(fi.read(offset - start))
+
+    def _read_snapshot(self):
+        """
+        return a tuple(revision, state, offset) from the snapshot of the
+        history file, offset being the byte offset of the revisions
+        following the given one, or (-1, set(), 0) when there is no valid
+        snapshot
+        """
+        try:
+            with open(self._snapshot_path) as fi:
+                data = json.load(fi)
+            revision = data['revision']
+            offset = data['offset']
+            if (getsize(self._log_path) < offset or
+                    self._snapshot_check(offset) != data['check']):
+                # the history file has been rewritten
+                raise ValueError()
+            return revision, set(data['state']), offset
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return -1, set(), 0
+
+    def _write_snapshot(self, revision, state, offset):
+        """
+        write the state of the given revision, ending at the given byte
+        offset, to the snapshot of the history file
         """
-        times, pkgs = zip(*self.construct_states())
-        return pkgs[rev]
+        data = {'revision': revision, 'state': sorted(state),
+                'offset': offset, 'check': self._snapshot_check(offset)}
+        tmp_path = self._snapshot_path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as fo:
+                json.dump(data, fo)
+            if sys.platform == 'win32':
+                rm_rf(self._snapshot_path)
+            os.rename(tmp_path, self._snapshot_path)
+        except (IOError, OSError):
+            # the snapshot is merely an optimization
+            pass
 
     def print_log(self):
         for i, (date, content) in enumerate(self.parse()):
@@ -10,7 +10,8 @@ from egginst.utils import human_bytes
 from enstaller.config import HOME_ENSTALLER4RC, Configuration
 from enstaller.store.indexed import LocalIndexedStore, RemoteHTTPIndexedStore
 
-from enstaller.utils import comparable_version, md5_file, uri_to_path
+from enstaller.utils import cached_md5_file, install_order, uri_to_path, \
+        version_key
 import metadata
 import dist_naming
 from requirement import Req, add_Reqs_to_spec
@@ -214,35 +215,19 @@ class Chain(object):
         # make sure each project name is listed only once
         assert len(dists) == len(set(self.cname_dist(d) for d in dists))
 
+        # maps canonical name -> distribution
+        cname_to_dist = dict((self.cname_dist(d), d) for d in dists)
+
         # the distributions corresponding to the requirements must be sorted
         # because the output of this function is otherwise not deterministic
-        dists.sort(key=self.cname_dist)
+        cnames = sorted(cname_to_dist)
 
-        # maps dist -> set of required (project) names
+        # maps cname -> set of required (project) names
         rns = {}
-        for dist in dists:
-            rns[dist] = set(r.name for r in self.reqs_dist(dist))
-
-        # as long as we have things missing, simply look for things which
-        # can be added, i.e. all the requirements have been added already
-        result = []
-        names_inst = set()
-        while len(result) < len(dists):
-            n = len(result)
-            for dist in dists:
-                if dist in result:
-                    continue
-                # see if all required packages were added already
-                if all(bool(name in names_inst) for name in rns[dist]):
-                    result.append(dist)
-                    names_inst.add(self.index[dist]['cname'])
-                    assert len(names_inst) == len(result)
+        for cname, dist in cname_to_dist.iteritems():
+            rns[cname] = set(r.name for r in self.reqs_dist(dist))
 
-            if len(result) == n:
-                # nothing was added
-                raise Exception("Loop in dependency graph\n%r" %
-                                [dist_naming.filename_dist(d) for d in dists])
-        return result
+        return [cname_to_dist[cname] for cname in install_order(cnames, rns)]
 
 
     def _sequence_flat(self, root):
@@ -348,10 +333,7 @@ class Chain(object):
             if req.matches(spec):
                 versions.add(spec['version'])
 
-        try:
-            return sorted(versions, key=comparable_version)
-        except TypeError:
-            return list(versions)
+        return sorted(versions, key=version_key)
 
 
     def fetch_dist(self, dist, fetch_dir, force=False, dry_run=False):
@@ -367,7 +349,8 @@ class Chain(object):
         path = join(fetch_dir, fn)
         # if force is used, make sure the md5 is the expected, otherwise
         # only see if the file exists
-        if isfile(path) and (not force or md5_file(path) == info.get('md5')):
+        if isfile(path) and (not force or
+                             cached_md5_file(path) == info.get('md5')):
             if self.verbose:
                 print "Not forcing refetch, %r already matches MD5" % path
             return
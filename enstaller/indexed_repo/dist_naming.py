@@ -1,7 +1,7 @@
 import re
 from os.path import isdir
 
-from enstaller.utils import abs_expanduser, comparable_version
+from enstaller.utils import abs_expanduser, version_key
 
 
 DIST_PAT = re.compile(r'(file://.*[\\/]|https?://.+/)([^\\/]+)$')
@@ -108,7 +108,8 @@ def cleanup_reponame(repo):
 
 def comparable_spec(spec):
     """
-    Returns a tuple(version, build) for a distribution, version is a
-    RationalVersion object.  The result may be used for as a sort key.
+    Returns a tuple(version, build) for a distribution, version is the
+    version key of the version string (see enstaller.utils.version_key).
+    The result may be used for as a sort key.
     """
-    return comparable_version(spec['version']), spec['build']
+    return version_key(spec['version']), spec['build']
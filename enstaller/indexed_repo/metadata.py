@@ -11,7 +11,7 @@ from os.path import basename, isfile, join, getmtime, getsize
 from dist_naming import is_valid_eggname
 from requirement import Req
 
-from enstaller.utils import md5_file
+from enstaller.utils import checksum_cache, md5_file
 
 
 def parse_index(data):
@@ -159,14 +159,16 @@ def commit_from_dist(zip_path):
     return res
 
 
-def index_section(zip_path):
+def index_section(zip_path, md5=None):
     """
     Returns a section corresponding to the zip-file, which can be appended
-    to an index.
+    to an index.  The MD5 of the file is computed unless given.
     """
+    if md5 is None:
+        md5 = md5_file(zip_path)
     return ('==> %s <==\n' % basename(zip_path) +
             'size = %i\n'  % getsize(zip_path) +
-            'md5 = %r\n' % md5_file(zip_path) +
+            'md5 = %r\n' % md5 +
             'mtime = %r\n' % getmtime(zip_path) +
             commit_from_dist(zip_path) +
             '\n' +
@@ -207,6 +209,7 @@ def update_index(dir_path, force=False, verbose=False):
     # since generating the new data may take a while, we first write to memory
     # and then write the file afterwards.
     faux = StringIO()
+    checksums = checksum_cache(dir_path)
     for fn in sorted(os.listdir(dir_path), key=string.lower):
         if not fn.endswith('.egg'):
             continue
@@ -220,10 +223,11 @@ def update_index(dir_path, force=False, verbose=False):
                 faux.write('==> %s <==\n' % fn)
                 faux.write(section[fn] + '\n')
                 continue
-        faux.write(index_section(path))
+        faux.write(index_section(path, checksums.md5(path)))
         if verbose:
             sys.stdout.write('.')
             sys.stdout.flush()
+    checksums.save()
 
     if verbose:
         print
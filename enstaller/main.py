@@ -175,20 +175,16 @@ def search(enpkg, pat=None):
     print(FMT4 % ('Name', '  Versions', 'Product', 'Note'))
     print(80 * '=')
 
-    names = {}
-    for key, info in enpkg.query_remote():
-        names[info['name']] = name_egg(key)
-
     installed = {}
     for key, info in enpkg.query_installed():
         installed[info['name']] = VB_FMT % info
 
-    for name in sorted(names, key=string.lower):
-        if pat and not pat.search(name):
+    for name, info_list in enpkg.info_list_groups(pat):
+        if not info_list:
             continue
-        disp_name = names[name]
+        disp_name = name_egg(info_list[-1][0])
         installed_version = installed.get(name)
-        for info in enpkg.info_list_name(name):
+        for key, info in info_list:
             version = VB_FMT % info
             disp_ver = (('* ' if installed_version == version else '  ') +
                         version)
@@ -215,11 +211,12 @@ def search(enpkg, pat=None):
 def updates_check(enpkg):
     updates = []
     EPD_update = []
-    for key, info in enpkg.query_installed():
-        av_infos = enpkg.info_list_name(info['name'])
-        if len(av_infos) == 0:
+    installed = list(enpkg.query_installed())
+    newest = enpkg.newest_available(info['name'] for key, info in installed)
+    for key, info in installed:
+        if info['name'].lower() not in newest:
             continue
-        av_info = av_infos[-1]
+        av_key, av_info = newest[info['name'].lower()]
         if comparable_info(av_info) > comparable_info(info):
             if info['name'] == "epd":
                 EPD_update.append({'current': info, 'update': av_info})
@@ -1,16 +1,17 @@
 import re
 from collections import defaultdict
 
-from utils import PY_VER, comparable_version
+from utils import PY_VER, install_order, version_key
 
 
 
 def comparable_info(spec):
     """
-    Returns a tuple(version, build) for a distribution, version is a
-    RationalVersion object.  The result may be used for as a sort key.
+    Returns a tuple(version, build) for a distribution, version is the
+    version key of the version string (see utils.version_key).  The result
+    may be used for as a sort key.
     """
-    return comparable_version(spec['version']), spec['build']
+    return version_key(spec['version']), spec['build']
 
 
 class Req(object):
@@ -23,23 +24,53 @@ class Req(object):
         1   only the name must match
         2   name and version must match
         3   name, version and build must match
+
+    Requirement objects are immutable, and interned: parsing a same
+    requirement string twice returns the same object.
     """
+    __slots__ = ('name', 'version', 'build', 'strictness')
+
     pat = re.compile(r'(?:([\w.]+)(?:\s+([\w.]+)(?:-(\d+))?)?)?$')
 
-    def __init__(self, req_string):
-        m = self.pat.match(str(req_string.strip()))
+    # maps requirement strings -> Req instances
+    _interned = {}
+    _max_interned = 100000
+
+    def __new__(cls, req_string):
+        try:
+            return cls._interned[req_string]
+        except KeyError:
+            pass
+
+        m = cls.pat.match(str(req_string.strip()))
         if m is None:
             raise Exception("Not a valid requirement: %r" % req_string)
-        self.name, self.version, self.build = m.groups()
-        self.strictness = 0
-        if self.name is not None:
-            self.name = self.name.lower()
-            self.strictness = 1
-        if self.version is not None:
-            self.strictness = 2
-        if self.build is not None:
-            self.build = int(self.build)
-            self.strictness = 3
+        name, version, build = m.groups()
+        strictness = 0
+        if name is not None:
+            name = name.lower()
+            strictness = 1
+        if version is not None:
+            strictness = 2
+        if build is not None:
+            build = int(build)
+            strictness = 3
+
+        self = super(Req, cls).__new__(cls)
+        for attr, value in zip(cls.__slots__,
+                               (name, version, build, strictness)):
+            object.__setattr__(self, attr, value)
+
+        if len(cls._interned) >= cls._max_interned:
+            cls._interned.clear()
+        cls._interned[req_string] = self
+        return self
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Req instances are immutable")
+
+    def __reduce__(self):
+        return (Req, (str(self),))
 
     def as_dict(self):
         res = {}
@@ -104,32 +135,48 @@ class Resolve(object):
     class (which is inexpensive), to call the install_sequence method, e.g.:
 
     eggs = Resolve(store).install_sequence(req)
+
+    The eggs available for a given name are cached: a new instance must be
+    created when the content of the store changes (e.g. after reconnecting).
     """
     def __init__(self, repo, verbose=False):
         self.repo = repo
         self.verbose = verbose
 
+        # maps name -> list of (key, info)
+        self._candidates = {}
+
+    def _get_candidates(self, name):
+        """
+        Return the list of (key, info) of the eggs with the given name,
+        sorted by decreasing version and build.
+        """
+        try:
+            return self._candidates[name]
+        except KeyError:
+            d = dict(self.repo.query(type='egg', name=name))
+            candidates = sorted(d.iteritems(),
+                                key=lambda item: comparable_info(item[1]),
+                                reverse=True)
+            self._candidates[name] = candidates
+            return candidates
+
     def get_egg(self, req):
         """
         return the egg with the largest version and build number
         """
         assert req.strictness >= 1
-        d = dict(self.repo.query(type='egg', name=req.name))
-        if not d:
-            return None
-        matches = []
-        for key, info in d.iteritems():
+        # the first match is the best one
+        for key, info in self._get_candidates(req.name):
             if req.matches(info) and info.get('available', True):
-                matches.append(key)
-        if not matches:
-            return None
-        return max(matches, key=lambda k: comparable_info(d[k]))
+                return key
+        return None
 
     def reqs_egg(self, egg):
         """
         return the set of requirement objects listed by the given egg
         """
-        return set(Req(s) for s in self.repo.get_metadata(egg)['packages'])
+        return self.repo.get_requirements(egg)
 
     def name_egg(self, egg):
         """
@@ -161,34 +208,19 @@ class Resolve(object):
         # make sure each project name is listed only once
         assert len(eggs) == len(set(self.name_egg(d) for d in eggs))
 
+        # maps (project) name -> egg
+        name_to_egg = dict((self.name_egg(egg), egg) for egg in eggs)
+
         # the eggs corresponding to the requirements must be sorted
         # because the output of this function is otherwise not deterministic
-        eggs.sort(key=self.name_egg)
+        names = sorted(name_to_egg)
 
-        # maps egg -> set of required (project) names
+        # maps name -> set of required (project) names
         rns = {}
-        for egg in eggs:
-            rns[egg] = set(r.name for r in self.reqs_egg(egg))
-
-        # as long as we have things missing, simply look for things which
-        # can be added, i.e. all the requirements have been added already
-        result = []
-        names_inst = set()
-        while len(result) < len(eggs):
-            n = len(result)
-            for egg in eggs:
-                if egg in result:
-                    continue
-                # see if all required packages were added already
-                if all(bool(name in names_inst) for name in rns[egg]):
-                    result.append(egg)
-                    names_inst.add(self.name_egg(egg))
-                    assert len(names_inst) == len(result)
-
-            if len(result) == n:
-                # nothing was added
-                raise Exception("Loop in dependency graph\n%r" % eggs)
-        return result
+        for name, egg in name_to_egg.iteritems():
+            rns[name] = set(r.name for r in self.reqs_egg(egg))
+
+        return [name_to_egg[name] for name in install_order(names, rns)]
 
     def _sequence_flat(self, root):
         eggs = [root]
@@ -38,10 +38,29 @@ class AbstractStore(object):
     def get_data(self, key):
         """Return the data associated to the given key."""
 
+    def get_data_from(self, key, offset):
+        """Return the data associated to the given key, starting at the given
+        byte offset.
+
+        Returns
+        -------
+        result: pair
+            (fp, start) where start is the offset the data returned by fp
+            actually starts at.  Stores which cannot skip the first bytes
+            return the whole data, with a start of 0.
+        """
+        return self.get_data(key), 0
+
     @abstractmethod
     def get_metadata(self, key, select=None):
         """Return the data associated to the given key."""
 
+    def get_requirements(self, key):
+        """Return the frozenset of requirements (enstaller.resolve.Req
+        instances) listed in the metadata of the given key."""
+        from enstaller.resolve import Req
+        return frozenset(Req(s) for s in self.get_metadata(key)['packages'])
+
     @abstractmethod
     def exists(self, key):
         """Returns True if the given key exists in the store."""
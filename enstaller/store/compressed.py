@@ -12,9 +12,11 @@ class CompressedHandler(urllib2.BaseHandler):
     ]
 
     def http_request(self, req):
-        if not req.headers.get('Accept-Encoding'):
-            req.headers['Accept-Encoding'] = ','.join(
-                [enc for enc, _ in self.compression_types])
+        # the header may have been set by the caller (add_header stores it
+        # as 'Accept-encoding')
+        if not req.has_header('Accept-encoding'):
+            req.add_header('Accept-Encoding', ','.join(
+                [enc for enc, _ in self.compression_types]))
         return req
 
     https_request = http_request
@@ -1,4 +1,6 @@
+import inspect
 import json
+import re
 import urlparse
 import urllib2
 from collections import defaultdict
@@ -6,6 +8,26 @@ from collections import defaultdict
 from base import AbstractStore
 from cached import CachedHandler
 from compressed import CompressedHandler
+from pooled import ConnectionPool, PooledHTTPHandler, PooledHTTPSHandler
+
+
+# metadata fields for which IndexedStore keeps an index, to speed up queries
+INDEXED_FIELDS = ('type', 'python', 'platform', 'available')
+
+_EMPTY = frozenset()
+
+_CONTENT_RANGE_PAT = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+|\*)\s*$')
+
+
+def _content_range_start(headers):
+    """
+    Return the first byte offset given by the Content-Range header of a
+    partial response, or None when the header is missing or malformed.
+    """
+    m = _CONTENT_RANGE_PAT.match(headers.getheader('Content-Range', ''))
+    if m is None:
+        return None
+    return int(m.group(1))
 
 
 class IndexedStore(AbstractStore):
@@ -26,10 +48,50 @@ class IndexedStore(AbstractStore):
             info.setdefault('python', '2.7')
             info.setdefault('packages', [])
 
+        self._build_indexes()
+
+    def _build_indexes(self, keys=None):
+        """
+        Build the indexes used by query_keys from self._index.  This is done
+        by the first query after self._index has been set (see
+        _ensure_indexes), but may be done beforehand.
+
+        keys gives the order in which keys of a same name are returned by
+        queries, and defaults to the iteration order of self._index.
+        """
+        if keys is None:
+            keys = self._index.iterkeys()
+        self._indexed = self._index
         # maps names to keys
-        self._groups = defaultdict(list)
-        for key, info in self._index.iteritems():
+        self._groups = self._built_groups = defaultdict(list)
+        # maps field -> value -> set of keys, for each indexed field
+        self._field_indexes = dict((field, defaultdict(set))
+                                   for field in INDEXED_FIELDS)
+        # maps keys -> requirements, filled as requirements are asked for
+        self._requirements = {}
+        for key in keys:
+            info = self._index[key]
             self._groups[info['name']].append(key)
+            for field, index in self._field_indexes.iteritems():
+                index[info.get(field)].add(key)
+
+    def _ensure_indexes(self):
+        """
+        Build the indexes, unless up to date with self._index.  Subclasses
+        setting self._index in their connect method may fill self._groups
+        themselves (as before the other indexes existed), in which case the
+        order of its keys is kept.
+        """
+        if getattr(self, '_indexed', None) is self._index:
+            return
+        groups = getattr(self, '_groups', None)
+        if groups is not None and groups is not getattr(self, '_built_groups',
+                                                        None):
+            keys = [key for group_keys in groups.itervalues()
+                    for key in group_keys]
+            self._build_indexes(keys)
+        else:
+            self._build_indexes()
 
     @property
     def is_connected(self):
@@ -51,6 +113,15 @@ class IndexedStore(AbstractStore):
     def get_metadata(self, key):
         return self._index[key]
 
+    def get_requirements(self, key):
+        self._ensure_indexes()
+        try:
+            return self._requirements[key]
+        except KeyError:
+            reqs = super(IndexedStore, self).get_requirements(key)
+            self._requirements[key] = reqs
+            return reqs
+
     def exists(self, key):
         return key in self._index
 
@@ -59,17 +130,43 @@ class IndexedStore(AbstractStore):
             yield key, self._index[key]
 
     def query_keys(self, **kwargs):
-        name = kwargs.get('name')
-        if name is None:
-            for key, info in self._index.iteritems():
-                if all(info.get(k) == v for k, v in kwargs.iteritems()):
-                    yield key
+        self._ensure_indexes()
+        name = kwargs.pop('name', None)
+
+        # keys matching all the indexed fields of the query, smallest set
+        # first so that intersections are cheap
+        matches = []
+        for field in INDEXED_FIELDS:
+            if field in kwargs:
+                value = kwargs[field]
+                try:
+                    matches.append(self._field_indexes[field].get(value, _EMPTY))
+                except TypeError:
+                    # unhashable value, checked against each entry below
+                    continue
+                del kwargs[field]
+        matches.sort(key=len)
+        candidates = None
+        for keys in matches:
+            candidates = keys if candidates is None else candidates & keys
+
+        if name is not None:
+            keys = self._groups.get(name, [])
+            if candidates is not None:
+                keys = (key for key in keys if key in candidates)
+        elif candidates is not None:
+            keys = candidates
         else:
-            del kwargs['name']
-            for key in self._groups[name]:
+            keys = self._index.iterkeys()
+
+        if kwargs:
+            for key in keys:
                 info = self._index[key]
                 if all(info.get(k) == v for k, v in kwargs.iteritems()):
                     yield key
+        else:
+            for key in keys:
+                yield key
 
 
 class LocalIndexedStore(IndexedStore):
@@ -88,15 +185,30 @@ class LocalIndexedStore(IndexedStore):
         except IOError as e:
             raise KeyError(str(e))
 
+    def get_data_from(self, key, offset):
+        fp = self.get_data(key)
+        if offset > 0:
+            fp.seek(offset)
+        return fp, offset
+
 
 class RemoteHTTPIndexedStore(IndexedStore):
+    """
+    Store for a repository served over http(s).
 
-    def __init__(self, url, cache_dir):
+    Connections are kept alive and reused across requests: up to pool_size
+    idle connections are kept per host, for at most idle_timeout seconds.
+    """
+    def __init__(self, url, cache_dir, pool_size=4, idle_timeout=60.0):
         super(RemoteHTTPIndexedStore, self).__init__()
 
         self.root = url
         self.cache_dir = cache_dir
 
+        self._pool = ConnectionPool(pool_size, idle_timeout)
+        self._opener = None
+        self._base_opener = None
+
     def info(self):
         return dict(root=self.root)
 
@@ -105,6 +217,25 @@ class RemoteHTTPIndexedStore(IndexedStore):
         return json.load(fp)
 
     def get_data(self, key):
+        return self._open(self._request(key))
+
+    def get_data_from(self, key, offset):
+        request = self._request(key)
+        if offset > 0:
+            request.add_header('Range', 'bytes=%d-' % offset)
+            # ranges of compressed content are useless to us
+            request.add_header('Accept-Encoding', 'identity')
+        fp = self._open(request)
+        if offset > 0 and fp.code == 206:
+            if _content_range_start(fp.info()) == offset:
+                return fp, offset
+            # not the range we asked for, so start again from scratch
+            fp.close()
+            return self.get_data(key), 0
+        # the server ignored the range, and sent everything
+        return fp, 0
+
+    def _request(self, key):
         url = self._location(key)
         scheme, netloc, path, params, query, frag = urlparse.urlparse(url)
         auth, host = urllib2.splituser(netloc)
@@ -122,23 +253,40 @@ class RemoteHTTPIndexedStore(IndexedStore):
         else:
             request = urllib2.Request(url)
         request.add_header('User-Agent', 'enstaller')
+        return request
+
+    def _open(self, request):
+        url = request.get_full_url()
         try:
             return self.opener.open(request)
         except urllib2.HTTPError as e:
             raise KeyError("%s: %s" % (e, url))
         except urllib2.URLError as e:
-            raise Exception("Could not connect to %s (reason: %s / %s)" % (host, e.reason, e.args))
+            raise Exception("Could not connect to %s (reason: %s / %s)" % (request.get_host(), e.reason, e.args))
 
     @property
     def opener(self):
-        """ Create custom urlopener with Compression and Caching handlers. """
+        """ Create custom urlopener with Compression, Caching and keep-alive
+        handlers. """
         # Use handlers from urllib2's default opener, since we already
         # added our proxy handler to it.
         opener = urllib2._opener
+        if self._opener is not None and opener is self._base_opener:
+            return self._opener
+
         http_handlers = [urllib2.HTTPHandler, urllib2.HTTPSHandler]
         handlers = opener.handlers if opener is not None else http_handlers
 
-        # Add our handlers to the default handlers.
-        handlers_ = [CompressedHandler, CachedHandler(self.cache_dir)] + handlers
-
-        return urllib2.build_opener(*handlers_)
+        # Add our handlers to the default handlers, our pooled handlers
+        # replacing the default http ones.
+        handlers_ = [CompressedHandler, CachedHandler(self.cache_dir),
+                     PooledHTTPHandler(self._pool),
+                     PooledHTTPSHandler(self._pool)]
+        for handler in handlers:
+            klass = handler if inspect.isclass(handler) else handler.__class__
+            if not issubclass(klass, tuple(http_handlers)):
+                handlers_.append(handler)
+
+        self._opener = urllib2.build_opener(*handlers_)
+        self._base_opener = opener
+        return self._opener
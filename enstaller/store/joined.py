@@ -29,12 +29,24 @@ class JoinedStore(AbstractStore):
                 return repo.get_data(key)
         raise KeyError(key)
 
+    def get_data_from(self, key, offset):
+        for repo in self.repos:
+            if repo.exists(key):
+                return repo.get_data_from(key, offset)
+        raise KeyError(key)
+
     def get_metadata(self, key):
         for repo in self.repos:
             if repo.exists(key):
                 return repo.get_metadata(key)
         raise KeyError(key)
 
+    def get_requirements(self, key):
+        for repo in self.repos:
+            if repo.exists(key):
+                return repo.get_requirements(key)
+        raise KeyError(key)
+
     def exists(self, key):
         for repo in self.repos:
             if repo.exists(key):
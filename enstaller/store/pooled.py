@@ -0,0 +1,197 @@
+import httplib
+import socket
+import threading
+import time
+import urllib2
+
+
+class ConnectionPool(object):
+    """
+    A thread-safe pool of idle keep-alive connections, grouped by host.
+
+    Parameters
+    ----------
+    maxsize: int
+        Maximum number of idle connections kept for a given host.
+    idle_timeout: float
+        Connections which have been idle for longer than this (in seconds)
+        are closed instead of being reused.
+    """
+    def __init__(self, maxsize=4, idle_timeout=60.0):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return an idle connection for the given key, or None if there is
+        none.
+        """
+        expired = []
+        conn = None
+        now = time.time()
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                candidate, last_used = idle.pop()
+                if now - last_used < self.idle_timeout:
+                    conn = candidate
+                    break
+                expired.append(candidate)
+        for candidate in expired:
+            candidate.close()
+        return conn
+
+    def put(self, key, conn):
+        """
+        Give back a connection whose last response has been read entirely.
+        """
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.maxsize:
+                idle.append((conn, time.time()))
+                return
+        conn.close()
+
+    def clear(self):
+        """
+        Close all the idle connections.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.itervalues():
+            for conn, last_used in connections:
+                conn.close()
+
+
+class _PooledResponse(object):
+    """
+    Adapter around an httplib response, which gives the connection back to
+    the pool once the body has been read entirely.  Closing the response
+    before that closes the connection.
+    """
+    def __init__(self, response, release, discard):
+        self._response = response
+        self._release = release
+        self._discard = discard
+        self._done = False
+
+        if response.length == 0:
+            # nothing to read (e.g. 304): release the connection right away
+            response.read(0)
+            self._check_done()
+
+    def _check_done(self):
+        if not self._done and self._response.isclosed():
+            self._done = True
+            self._release()
+
+    def recv(self, amt=None):
+        data = self._response.read(amt)
+        self._check_done()
+        return data
+
+    read = recv
+
+    def close(self):
+        if not self._done:
+            self._done = True
+            self._response.close()
+            self._discard()
+
+
+def _pooled_open(handler, http_class, req, **http_conn_args):
+    """
+    Like urllib2.AbstractHTTPHandler.do_open, but the connection is taken
+    from (and given back to) the pool of the handler instead of being closed
+    after the request.
+    """
+    host = req.get_host()
+    if not host:
+        raise urllib2.URLError('no host given')
+    # Python 2.6 requests may not know about tunnels
+    tunnel_host = getattr(req, '_tunnel_host', None)
+    key = (http_class.__name__, host, tunnel_host)
+
+    headers = dict(req.unredirected_hdrs)
+    headers.update(dict((k, v) for k, v in req.headers.items()
+                        if k not in headers))
+    headers["Connection"] = "keep-alive"
+    headers = dict((name.title(), val) for name, val in headers.items())
+
+    tunnel_headers = {}
+    if tunnel_host:
+        proxy_auth_hdr = "Proxy-Authorization"
+        if proxy_auth_hdr in headers:
+            # Proxy-Authorization should not be sent to origin server.
+            tunnel_headers[proxy_auth_hdr] = headers.pop(proxy_auth_hdr)
+
+    while True:
+        conn = handler.pool.get(key)
+        reused = conn is not None
+        if not reused:
+            conn = http_class(host, timeout=req.timeout, **http_conn_args)
+            conn.set_debuglevel(handler._debuglevel)
+            if tunnel_host:
+                if hasattr(conn, 'set_tunnel'):
+                    conn.set_tunnel(tunnel_host, headers=tunnel_headers)
+                else:
+                    # Python 2.6
+                    conn._set_tunnel(tunnel_host)
+        try:
+            conn.request(req.get_method(), req.get_selector(), req.data,
+                         headers)
+            try:
+                r = conn.getresponse(buffering=True)
+            except TypeError:
+                # buffering is not supported by Python 2.6
+                r = conn.getresponse()
+        except (socket.error, httplib.HTTPException) as e:
+            conn.close()
+            if reused:
+                # the server closed the idle connection in the meantime
+                continue
+            raise urllib2.URLError(e)
+        break
+
+    response = _PooledResponse(r, lambda: handler.pool.put(key, conn),
+                               conn.close)
+    fp = socket._fileobject(response, close=True)
+
+    resp = urllib2.addinfourl(fp, r.msg, req.get_full_url())
+    resp.code = r.status
+    resp.msg = r.reason
+    return resp
+
+
+class PooledHTTPHandler(urllib2.HTTPHandler):
+    """
+    HTTP handler which keeps connections alive, and reuses them for the
+    subsequent requests to the same host.
+    """
+    def __init__(self, pool, debuglevel=0):
+        urllib2.HTTPHandler.__init__(self, debuglevel)
+        self.pool = pool
+
+    def http_open(self, req):
+        return _pooled_open(self, httplib.HTTPConnection, req)
+
+
+if hasattr(httplib, 'HTTPS'):
+    class PooledHTTPSHandler(urllib2.HTTPSHandler):
+        """
+        HTTPS counterpart of PooledHTTPHandler.
+        """
+        def __init__(self, pool, debuglevel=0):
+            urllib2.HTTPSHandler.__init__(self, debuglevel)
+            self.pool = pool
+
+        def https_open(self, req):
+            context = getattr(self, '_context', None)
+            if context is None:
+                return _pooled_open(self, httplib.HTTPSConnection, req)
+            else:
+                return _pooled_open(self, httplib.HTTPSConnection, req,
+                                    context=context)
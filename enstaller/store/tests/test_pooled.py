@@ -0,0 +1,192 @@
+import BaseHTTPServer
+import SocketServer
+import httplib
+import json
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import urllib2
+
+from enstaller.store.indexed import RemoteHTTPIndexedStore
+from enstaller.store.pooled import ConnectionPool, PooledHTTPHandler, \
+        _pooled_open
+
+
+INDEX = {"dummy-1.0.1-1.egg": {"name": "dummy", "version": "1.0.1",
+                               "build": 1, "python": None,
+                               "packages": []}}
+
+
+class _KeepAliveHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        if self.path.startswith("/index.json"):
+            data = json.dumps(INDEX)
+            if self.headers.get("If-None-Match") == "index-etag":
+                self.send_response(304)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+        else:
+            data = "a" * 1024
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Etag", "index-etag")
+        self.end_headers()
+        self.wfile.write(data)
+        if self.server.close_after_response:
+            # simulate a server dropping idle connections without notice
+            self.close_connection = 1
+
+    def log_message(self, *a):
+        pass
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0),
+                                           _KeepAliveHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.close_after_response = False
+
+
+class _ServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = _Server()
+        self.url = "http://127.0.0.1:{0}/".format(self.server.server_port)
+        t = threading.Thread(target=self.server.serve_forever)
+        t.daemon = True
+        t.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestPooledHTTPHandler(_ServerTestCase):
+    def _get(self, opener, path="egg"):
+        fp = opener.open(self.url + path)
+        try:
+            return fp.read()
+        finally:
+            fp.close()
+
+    def test_connection_reused(self):
+        pool = ConnectionPool()
+        opener = urllib2.build_opener(PooledHTTPHandler(pool))
+
+        for i in range(5):
+            self.assertEqual(self._get(opener), "a" * 1024)
+
+        self.assertEqual(self.server.connections, 1)
+
+    def test_idle_timeout(self):
+        pool = ConnectionPool(idle_timeout=0.01)
+        opener = urllib2.build_opener(PooledHTTPHandler(pool))
+
+        self._get(opener)
+        time.sleep(0.05)
+        self._get(opener)
+
+        self.assertEqual(self.server.connections, 2)
+
+    def test_pool_size(self):
+        pool = ConnectionPool(maxsize=1)
+        opener = urllib2.build_opener(PooledHTTPHandler(pool))
+
+        # two responses alive at the same time need two connections, only
+        # one of which is kept afterwards
+        fp1 = opener.open(self.url + "egg")
+        fp2 = opener.open(self.url + "egg")
+        fp1.read()
+        fp2.read()
+        self._get(opener)
+
+        self.assertEqual(self.server.connections, 2)
+        self.assertEqual(len(pool._idle.values()[0]), 1)
+
+    def test_unread_response_not_reused(self):
+        pool = ConnectionPool()
+        opener = urllib2.build_opener(PooledHTTPHandler(pool))
+
+        fp = opener.open(self.url + "egg")
+        fp.read(10)
+        fp.close()
+        self._get(opener)
+
+        self.assertEqual(self.server.connections, 2)
+
+    def test_stale_connection(self):
+        self.server.close_after_response = True
+        pool = ConnectionPool()
+        opener = urllib2.build_opener(PooledHTTPHandler(pool))
+
+        for i in range(3):
+            self.assertEqual(self._get(opener), "a" * 1024)
+
+        self.assertEqual(self.server.connections, 3)
+
+
+    def test_python26_connection(self):
+        class Python26HTTPConnection(httplib.HTTPConnection):
+            def getresponse(self):
+                return httplib.HTTPConnection.getresponse(self)
+
+        class Handler(PooledHTTPHandler):
+            def http_open(self, req):
+                return _pooled_open(self, Python26HTTPConnection, req)
+
+        pool = ConnectionPool()
+        opener = urllib2.build_opener(Handler(pool))
+
+        for i in range(2):
+            self.assertEqual(self._get(opener), "a" * 1024)
+
+        self.assertEqual(self.server.connections, 1)
+
+
+class TestRemoteHTTPIndexedStorePooling(_ServerTestCase):
+    def setUp(self):
+        super(TestRemoteHTTPIndexedStorePooling, self).setUp()
+        self.d = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.d)
+        super(TestRemoteHTTPIndexedStorePooling, self).tearDown()
+
+    def test_store_reuses_connection(self):
+        store = RemoteHTTPIndexedStore(self.url, self.d)
+        store.connect()
+
+        for i in range(3):
+            fp = store.get_data("dummy-1.0.1-1.egg")
+            self.assertEqual(fp.read(), "a" * 1024)
+            fp.close()
+
+        self.assertEqual(self.server.connections, 1)
+        self.assertIs(store.opener, store.opener)
+
+    def test_cached_index(self):
+        """
+        Ensure the index cache still works through the pooled connections.
+        """
+        store = RemoteHTTPIndexedStore(self.url, self.d)
+        store.connect()
+        self.assertEqual(list(store.query_keys()), INDEX.keys())
+
+        # the second connect gets a 304, and reads the index from the cache
+        store.connect()
+        self.assertEqual(list(store.query_keys()), INDEX.keys())
+
+        self.assertEqual(self.server.connections, 1)
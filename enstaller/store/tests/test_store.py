@@ -178,6 +178,83 @@ class TestLocalIndexedStore(unittest.TestCase):
         result = list(store.query_keys(**params))
         self.assertEqual(len(result), 0)
 
+    def test_indexed_query(self):
+        """
+        Ensure queries through the field indexes return the same keys as a
+        plain scan of the index.
+        """
+        index = {}
+        for i, (name, python, platform, available) in enumerate([
+                ("numpy", "2.7", "linux-64", True),
+                ("numpy", "2.6", "linux-64", True),
+                ("numpy", None, "win-32", False),
+                ("scipy", "2.7", "linux-64", False),
+                ("scipy", "2.7", None, True),
+                ("nose", "2.7", "linux-64", True)]):
+            key = "{0}-1.0.0-{1}.egg".format(name, i)
+            index[key] = {"name": name, "version": "1.0.0", "build": i,
+                          "python": python, "platform": platform,
+                          "available": available, "product": "free"}
+        index["mkl-10.3-1.zip"] = {"name": "mkl", "type": "zip",
+                                   "python": "2.7", "product": "commercial"}
+
+        with open(os.path.join(self.d, "index.json"), "w") as fp:
+            json.dump(index, fp)
+
+        store = LocalIndexedStore(self.d)
+        store.connect()
+
+        def _scan(**kwargs):
+            return sorted(key for key, info in store._index.iteritems()
+                          if all(info.get(k) == v for k, v in kwargs.iteritems()))
+
+        for kwargs in [{}, {"type": "egg"}, {"type": "zip"},
+                       {"name": "numpy"}, {"name": "numpy", "python": "2.7"},
+                       {"name": "numpy", "python": None},
+                       {"type": "egg", "python": "2.7", "available": True},
+                       {"python": "2.7", "platform": "linux-64"},
+                       {"python": "2.5"}, {"name": "nonexistent"},
+                       {"product": "free", "available": False},
+                       {"type": "egg", "packages": []}]:
+            self.assertEqual(sorted(store.query_keys(**kwargs)),
+                             _scan(**kwargs))
+
+    def test_subclass_index(self):
+        """
+        Ensure stores setting _index (and _groups) themselves are indexed on
+        their first query.
+        """
+        from enstaller.store.indexed import IndexedStore
+
+        class _Store(IndexedStore):
+            def connect(self, userpass=None):
+                self._connected = True
+                self._index = {"b-1.0-1.egg": {"name": "b", "python": "2.7",
+                                               "packages": []},
+                               "a-1.0-1.egg": {"name": "a", "python": "2.7"},
+                               "a-2.0-1.egg": {"name": "a", "python": "2.6"}}
+                self._groups = {"a": ["a-2.0-1.egg", "a-1.0-1.egg"],
+                                "b": ["b-1.0-1.egg"]}
+
+            def get_data(self, key):
+                pass
+
+            def info(self):
+                pass
+
+        store = _Store()
+        store.connect()
+        self.assertEqual(list(store.query_keys(name="a")),
+                         ["a-2.0-1.egg", "a-1.0-1.egg"])
+        self.assertEqual(sorted(store.query_keys(python="2.7")),
+                         ["a-1.0-1.egg", "b-1.0-1.egg"])
+        self.assertEqual(store.get_requirements("b-1.0-1.egg"), set())
+
+        store._index = {"c-1.0-1.egg": {"name": "c", "python": "2.7"}}
+        self.assertEqual(list(store.query_keys(python="2.7")),
+                         ["c-1.0-1.egg"])
+        self.assertEqual(list(store.query_keys(name="a")), [])
+
     def test_get_data_missing_key(self):
         with open(os.path.join(self.d, "index.json"), "w") as fp:
             json.dump({}, fp)
@@ -0,0 +1,159 @@
+import hashlib
+import os
+import os.path
+import stat
+import sys
+import threading
+
+if sys.version_info[:2] < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+
+import mock
+
+from egginst.tests.common import mkdtemp
+
+from enstaller.eggcache import EggCache
+from enstaller.utils import FileLock
+
+
+def _write_egg(path, data):
+    with open(path, "wb") as fo:
+        fo.write(data)
+    return hashlib.md5(data).hexdigest()
+
+
+class TestEggCache(unittest.TestCase):
+    def test_add_get(self):
+        with mkdtemp() as d:
+            cache = EggCache(os.path.join(d, "cache"))
+            source = os.path.join(d, "foo-1.0-1.egg")
+            md5 = _write_egg(source, "foo")
+
+            cache.add(source, md5)
+            path = cache.path(md5)
+            self.assertTrue(os.path.isfile(path))
+            self.assertFalse(os.stat(path).st_mode & stat.S_IWUSR)
+
+            dest = os.path.join(d, "bar-1.0-1.egg")
+            self.assertTrue(cache.get(md5, dest))
+            with open(dest, "rb") as fp:
+                self.assertEqual(fp.read(), "foo")
+            if hasattr(os, "link"):
+                self.assertEqual(os.stat(dest).st_ino, os.stat(path).st_ino)
+            # no temporary file is left behind
+            self.assertEqual(sorted(os.listdir(d)),
+                             ["bar-1.0-1.egg", "cache", "foo-1.0-1.egg"])
+
+    def test_get_keeps_mtime(self):
+        with mkdtemp() as d:
+            cache = EggCache(os.path.join(d, "cache"))
+            source = os.path.join(d, "foo-1.0-1.egg")
+            md5 = _write_egg(source, "foo")
+            cache.add(source, md5)
+            path = cache.path(md5)
+            os.utime(path, (1, 1))
+
+            # only the access time is updated, so that the checksum cache
+            # entry of the materialized egg remains valid
+            self.assertTrue(cache.get(md5, os.path.join(d, "bar-1.0-1.egg")))
+            st = os.stat(path)
+            self.assertEqual(st.st_mtime, 1)
+            self.assertGreater(st.st_atime, 1)
+
+    @unittest.skipIf(not hasattr(os, "getuid"), "no file ownership")
+    def test_get_foreign_copied(self):
+        with mkdtemp() as d:
+            cache = EggCache(os.path.join(d, "cache"))
+            source = os.path.join(d, "foo-1.0-1.egg")
+            md5 = _write_egg(source, "foo")
+            cache.add(source, md5)
+
+            dest = os.path.join(d, "bar-1.0-1.egg")
+            with mock.patch("os.getuid", return_value=os.getuid() + 1):
+                self.assertTrue(cache.get(md5, dest))
+            with open(dest, "rb") as fp:
+                self.assertEqual(fp.read(), "foo")
+            self.assertNotEqual(os.stat(dest).st_ino,
+                                os.stat(cache.path(md5)).st_ino)
+
+    def test_get_missing(self):
+        with mkdtemp() as d:
+            cache = EggCache(os.path.join(d, "cache"))
+            md5 = hashlib.md5("foo").hexdigest()
+            dest = os.path.join(d, "foo-1.0-1.egg")
+
+            self.assertFalse(cache.get(md5, dest))
+            self.assertFalse(os.path.exists(dest))
+
+            source = os.path.join(d, "source.egg")
+            cache.add(source, _write_egg(source, "foo"))
+            # an egg of an unexpected size is dropped
+            self.assertFalse(cache.get(md5, dest, size=4))
+            self.assertFalse(os.path.exists(cache.path(md5)))
+
+    def test_evict_least_recently_used(self):
+        with mkdtemp() as d:
+            cache = EggCache(os.path.join(d, "cache"))
+            md5s = []
+            for i in range(3):
+                source = os.path.join(d, "egg%d.egg" % i)
+                md5s.append(_write_egg(source, str(i) * 100))
+                cache.add(source, md5s[-1])
+                os.utime(cache.path(md5s[-1]), (i, i))
+            self.assertEqual(cache.size(), 300)
+
+            # the oldest egg is used again
+            self.assertTrue(cache.get(md5s[0], os.path.join(d, "used.egg")))
+            cache = EggCache(cache.root, max_size=250)
+            source = os.path.join(d, "egg3.egg")
+            md5s.append(_write_egg(source, "3" * 100))
+            cache.add(source, md5s[-1])
+
+            self.assertEqual(cache.size(), 200)
+            self.assertEqual([os.path.isfile(cache.path(md5)) for md5 in md5s],
+                             [True, False, False, True])
+
+    def test_evict_locked(self):
+        with mkdtemp() as d:
+            cache = EggCache(os.path.join(d, "cache"))
+            source = os.path.join(d, "foo.egg")
+            cache.add(source, _write_egg(source, "foo"))
+
+            lock = FileLock(os.path.join(cache.root, "lock"))
+            self.assertTrue(lock.acquire())
+            try:
+                cache.evict(0)
+                self.assertEqual(cache.size(), 3)
+            finally:
+                lock.release()
+            cache.evict(0)
+            self.assertEqual(cache.size(), 0)
+
+    def test_concurrent_add(self):
+        with mkdtemp() as d:
+            cache = EggCache(os.path.join(d, "cache"))
+            md5 = hashlib.md5("foo").hexdigest()
+            sources = []
+            for i in range(8):
+                sources.append(os.path.join(d, "foo%d.egg" % i))
+                _write_egg(sources[-1], "foo")
+
+            errors = []
+            def add(source):
+                try:
+                    cache.add(source, md5)
+                except Exception as e:
+                    errors.append(e)
+
+            threads = [threading.Thread(target=add, args=(source,))
+                       for source in sources]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual(errors, [])
+            self.assertEqual(cache.size(), 3)
+            self.assertEqual(os.listdir(os.path.join(cache.root, "tmp")), [])
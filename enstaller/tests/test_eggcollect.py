@@ -9,11 +9,14 @@ else:
 
 import os.path as op
 
+import mock
+
 from egginst.main import EggInst
 from egginst.tests.common import mkdtemp, DUMMY_EGG, NOSE_1_2_1, NOSE_1_3_0
 from egginst.utils import makedirs
 
-from enstaller.eggcollect import EggCollection, JoinedEggCollection
+from enstaller.eggcollect import EggCollection, JoinedEggCollection, \
+    info_from_metadir
 
 # XXX: of course, installed metadata had to be different than the one in
 # eggs...
@@ -104,6 +107,66 @@ class TestEggCollection(TestCase):
             ec.remove(os.path.basename(egg))
             self.assertTrue(ec.find(egg_basename) is None)
 
+    def test_query_cached(self):
+        with mkdtemp() as d:
+            prefix = os.path.join(d, "env")
+            _install_eggs_set([DUMMY_EGG], prefix)
+
+            ec = EggCollection(prefix, False)
+            # the installed packages database is up to date: no
+            # per-package metadata is read
+            with mock.patch("egginst.installdb._read_entry") as m:
+                self.assertEqual(len(list(ec.query())), 1)
+                self.assertEqual(len(list(ec.query(name="dummy"))), 1)
+                self.assertTrue(ec.find(os.path.basename(DUMMY_EGG)))
+                self.assertFalse(m.called)
+
+                # returned dictionaries may be modified by the caller
+                key, info = list(ec.query())[0]
+                info["version"] = "2.0.0"
+                self.assertEqual(ec.find(key)["version"], "1.0.1")
+
+                # changes made by another collection are picked up
+                EggCollection(prefix, False).remove(key)
+                self.assertEqual(list(ec.query()), [])
+                self.assertTrue(ec.find(key) is None)
+
+    def test_find_by_name(self):
+        with mkdtemp() as d:
+            prefix = os.path.join(d, "env")
+            _install_eggs_set([DUMMY_EGG], prefix)
+            egg_basename = os.path.basename(DUMMY_EGG)
+
+            ec = EggCollection(prefix, False)
+            # looking a package up by name neither goes through the whole
+            # installed packages database, nor reads its metadata again
+            # while unchanged
+            with mock.patch("enstaller.eggcollect.read_installed") as m:
+                with mock.patch("enstaller.eggcollect.info_from_metadir",
+                                wraps=info_from_metadir) as m_info:
+                    self.assertTrue(ec.find(egg_basename))
+                    self.assertEqual(len(list(ec.query(name="dummy"))), 1)
+                    self.assertTrue(ec.find(egg_basename))
+                self.assertFalse(m.called)
+                self.assertEqual(m_info.call_count, 1)
+
+    def test_install_remove_query(self):
+        with mkdtemp() as d:
+            prefix = os.path.join(d, "env")
+            egg_basename = os.path.basename(DUMMY_EGG)
+
+            ec = EggCollection(prefix, False)
+            ec.install(egg_basename, os.path.dirname(DUMMY_EGG))
+            self.assertEqual([key for key, info in ec.query()],
+                             [egg_basename])
+
+            ec.remove(egg_basename)
+            self.assertEqual(list(ec.query()), [])
+
+            ec.install(egg_basename, os.path.dirname(DUMMY_EGG))
+            self.assertEqual([key for key, info in ec.query()],
+                             [egg_basename])
+
 def _create_joined_collection(prefixes, eggs):
     ecs = []
     for i, prefix in enumerate(prefixes):
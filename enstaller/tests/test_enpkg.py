@@ -1,9 +1,11 @@
 import contextlib
 import ntpath
 import os.path
+import re
 import shutil
 import sys
 import tempfile
+import threading
 import warnings
 
 if sys.version_info[:2] < (2, 7):
@@ -13,6 +15,9 @@ else:
 
 import mock
 
+from multiprocessing import TimeoutError
+
+from encore.events.api import EventManager
 from okonomiyaki.repositories.enpkg import EnpkgS3IndexEntry
 
 from egginst.main import EggInst
@@ -22,7 +27,9 @@ from egginst.utils import makedirs
 from enstaller.config import Configuration
 from enstaller.egg_meta import split_eggname
 from enstaller.eggcollect import EggCollection, JoinedEggCollection
-from enstaller.enpkg import Enpkg, EnpkgError
+from enstaller.enpkg import Enpkg, EnpkgError, _FETCH_WAIT_PERIOD, \
+    _wait_fetch
+from enstaller.history import History
 from enstaller.enpkg import get_default_kvs, req_from_anything, \
         get_writable_local_dir
 from enstaller.main import _create_enstaller_update_enpkg, create_joined_store
@@ -165,6 +172,57 @@ class TestEnpkg(unittest.TestCase):
             self.assertEqual([q["version"] for q in queried_entries],
                              ["1.6.1", "1.7.1", "1.8.0"])
 
+    def test_info_list_groups(self):
+        entries = [
+            dummy_enpkg_entry_factory("numpy", "1.8.0", 2),
+            dummy_enpkg_entry_factory("scipy", "0.13.0", 1),
+            dummy_enpkg_entry_factory("numpy", "1.6.1", 1),
+            dummy_enpkg_entry_factory("Cython", "0.19.1", 1),
+            dummy_enpkg_entry_factory("numpy", "1.7.1", 1),
+        ]
+
+        repo = MetadataOnlyStore(entries)
+        repo.connect()
+
+        with mkdtemp() as d:
+            enpkg = Enpkg(repo, prefixes=[d], hook=None,
+                          evt_mgr=None, verbose=False, config=Configuration())
+
+            groups = list(enpkg.info_list_groups())
+            self.assertEqual([name for name, info_list in groups],
+                             ["cython", "numpy", "scipy"])
+            self.assertEqual([info for key, info in groups[1][1]],
+                             enpkg.info_list_name("numpy"))
+
+            groups = list(enpkg.info_list_groups(re.compile("py")))
+            self.assertEqual([name for name, info_list in groups],
+                             ["numpy", "scipy"])
+
+    def test_newest_available(self):
+        entries = [
+            dummy_enpkg_entry_factory("numpy", "1.6.1", 1),
+            dummy_enpkg_entry_factory("numpy", "1.8.0", 2),
+            dummy_enpkg_entry_factory("numpy", "1.7.1", 1),
+            dummy_enpkg_entry_factory("scipy", "0.13.0", 1),
+            dummy_enpkg_entry_factory("nose", "1.3.0", 1),
+        ]
+
+        repo = MetadataOnlyStore(entries)
+        repo.connect()
+
+        with mkdtemp() as d:
+            enpkg = Enpkg(repo, prefixes=[d], hook=None,
+                          evt_mgr=None, verbose=False, config=Configuration())
+
+            newest = enpkg.newest_available(["NumPy", "nose", "pandas"])
+            self.assertItemsEqual(newest.keys(), ["numpy", "nose"])
+            key, info = newest["numpy"]
+            self.assertEqual(key, "numpy-1.8.0-2.egg")
+            self.assertEqual(info, enpkg.info_list_name("numpy")[-1])
+
+            newest = enpkg.newest_available()
+            self.assertItemsEqual(newest.keys(), ["numpy", "nose", "scipy"])
+
     def test_info_list_names_invalid_version(self):
         entries = [
             dummy_enpkg_entry_factory("numpy", "1.6.1", 1),
@@ -250,6 +308,30 @@ class TestEnpkgActions(unittest.TestCase):
 
             self.assertEqual(actions, r_actions)
 
+    def test_install_after_reconnect(self):
+        """
+        Ensure eggs available for a name are not cached across reconnections.
+        """
+        entries = [
+            dummy_enpkg_entry_factory("numpy", "1.6.1", 1),
+            dummy_enpkg_entry_factory("numpy", "1.8.0", 2),
+        ]
+
+        repo = MetadataOnlyStore(entries)
+        repo.connect()
+
+        with mkdtemp() as d:
+            enpkg = Enpkg(repo, prefixes=[d], hook=None,
+                          evt_mgr=None, verbose=False, config=Configuration())
+            actions = enpkg.install_actions("numpy")
+            self.assertEqual(actions[-1], ('install', 'numpy-1.8.0-2.egg'))
+
+            entries.append(dummy_enpkg_entry_factory("numpy", "1.9.0", 1))
+            enpkg.reconnect()
+
+            actions = enpkg.install_actions("numpy")
+            self.assertEqual(actions[-1], ('install', 'numpy-1.9.0-1.egg'))
+
     def test_install_no_egg_entry(self):
         entries = [
             dummy_enpkg_entry_factory("numpy", "1.6.1", 1),
@@ -395,6 +477,192 @@ class TestEnpkgExecute(unittest.TestCase):
             local_repo.install.assert_called_with(base_egg, enpkg.local_dir,
                                                   None)
 
+    def _parallel_fetch_setup(self, eggs, evt_mgr=None):
+        entries = [dummy_enpkg_entry_factory(*split_eggname(egg))
+                   for egg in eggs]
+        repo = MetadataOnlyStore(entries)
+        repo.connect()
+
+        actions = [("fetch_0", egg) for egg in eggs] + \
+                  [("install", egg) for egg in eggs]
+
+        enpkg = Enpkg(repo, prefixes=self.prefixes, hook=None,
+                      evt_mgr=evt_mgr, verbose=False, config=Configuration())
+        enpkg.ec = mock.MagicMock()
+        return enpkg, actions
+
+    def test_parallel_fetch(self):
+        eggs = ["numpy-1.8.0-1.egg", "scipy-0.13.0-1.egg", "yoyo-1.0.0-1.egg"]
+
+        with mock.patch("enstaller.enpkg.Enpkg.fetch") as mocked_fetch:
+            enpkg, actions = self._parallel_fetch_setup(eggs)
+            enpkg.execute(actions)
+
+            fetched = sorted(args[0] for args, kwargs in
+                             mocked_fetch.call_args_list)
+            self.assertEqual(fetched, sorted(eggs))
+            for args, kwargs in mocked_fetch.call_args_list:
+                self.assertEqual(kwargs["force"], 0)
+                self.assertIsNotNone(kwargs["progress"])
+
+            self.assertEqual(enpkg.ec.install.call_args_list,
+                             [mock.call(egg, enpkg.local_dir, None)
+                              for egg in eggs])
+
+    def test_parallel_fetch_console_progress(self):
+        eggs = ["numpy-1.8.0-1.egg", "scipy-0.13.0-1.egg"]
+        events = []
+
+        with mock.patch("enstaller.enpkg.Enpkg.fetch"):
+            with mock.patch("egginst.console.ProgressManager") as m:
+                m.return_value.__exit__.side_effect = \
+                    lambda *args: events.append("exit")
+                enpkg, actions = self._parallel_fetch_setup(eggs)
+                enpkg.ec.install.side_effect = \
+                    lambda *args: events.append("install")
+                enpkg.execute(actions)
+
+        # the concurrent fetches are shown as a single progress bar, which
+        # is complete before the installs start
+        progress_types = [kwargs["progress_type"]
+                          for args, kwargs in m.call_args_list]
+        self.assertEqual(progress_types.count("fetching"), 1)
+        self.assertEqual(events[:3], ["exit", "install", "install"])
+
+    def test_wait_fetch(self):
+        result = mock.Mock()
+        result.get.side_effect = [TimeoutError(), TimeoutError(), None]
+
+        # the fetch is waited for by periods, so that it may be interrupted
+        _wait_fetch(result)
+        self.assertEqual(result.get.call_args_list,
+                         [mock.call(_FETCH_WAIT_PERIOD)] * 3)
+
+    def test_parallel_fetch_disabled(self):
+        eggs = ["numpy-1.8.0-1.egg", "scipy-0.13.0-1.egg"]
+
+        with mock.patch("enstaller.enpkg.Enpkg.fetch") as mocked_fetch:
+            enpkg, actions = self._parallel_fetch_setup(eggs)
+            enpkg.config.download_workers = 1
+            enpkg.execute(actions)
+
+            self.assertEqual(mocked_fetch.call_args_list,
+                             [mock.call(egg, force=0) for egg in eggs])
+
+    def test_parallel_fetch_failure(self):
+        eggs = ["numpy-1.8.0-1.egg", "scipy-0.13.0-1.egg"]
+
+        def mocked_fetch(egg, force=False, progress=None):
+            if egg == eggs[1]:
+                raise ValueError("received data MD5 sums mismatch")
+
+        with mock.patch("enstaller.enpkg.Enpkg.fetch",
+                        side_effect=mocked_fetch):
+            enpkg, actions = self._parallel_fetch_setup(eggs, EventManager())
+            with self.assertRaises(ValueError):
+                enpkg.execute(actions)
+
+            enpkg.ec.install.assert_called_once_with(eggs[0],
+                                                     enpkg.local_dir, None)
+            self.assertFalse(enpkg._execution_aborted.is_set())
+
+            # on the console, the eggs are all fetched before being installed
+            enpkg, actions = self._parallel_fetch_setup(eggs)
+            with self.assertRaises(ValueError):
+                enpkg.execute(actions)
+            self.assertFalse(enpkg.ec.install.called)
+
+    def test_transactional_install(self):
+        egg = os.path.basename(DUMMY_EGG)
+        repo = EggsStore([DUMMY_EGG])
+        repo.connect()
+        config = Configuration()
+        config.transactional_install = True
+
+        enpkg = Enpkg(repo, prefixes=self.prefixes, hook=None,
+                      evt_mgr=None, verbose=False, config=config)
+        actions = enpkg.install_actions("dummy")
+        # interrupted right after the eggs have been staged
+        with mock.patch("enstaller.transaction.Transaction._commit",
+                        side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                enpkg.execute(actions)
+        self.assertIsNone(enpkg.find(egg))
+        journal_path = os.path.join(self.prefixes[0], "enpkg.transaction")
+
+        # merely creating an Enpkg (e.g. to query the prefix) leaves the
+        # transaction alone
+        enpkg = Enpkg(repo, prefixes=self.prefixes, hook=None,
+                      evt_mgr=None, verbose=False, config=config)
+        self.assertIsNone(enpkg.find(egg))
+        self.assertTrue(os.path.isfile(journal_path))
+
+        # the next execution completes it first
+        enpkg.execute(actions)
+        self.assertIsNotNone(enpkg.find(egg))
+        self.assertEqual(History(self.prefixes[0]).get_state(), set([egg]))
+        self.assertFalse(os.path.exists(journal_path))
+
+        enpkg.execute(enpkg.remove_actions("dummy"))
+        self.assertIsNone(enpkg.find(egg))
+
+    def test_transactional_recovery_failure(self):
+        egg = os.path.basename(DUMMY_EGG)
+        repo = EggsStore([DUMMY_EGG])
+        repo.connect()
+        config = Configuration()
+        config.transactional_install = True
+        journal_path = os.path.join(self.prefixes[0], "enpkg.transaction")
+
+        enpkg = Enpkg(repo, prefixes=self.prefixes, hook=None,
+                      evt_mgr=None, verbose=False, config=config)
+        actions = enpkg.install_actions("dummy")
+        with mock.patch("enstaller.transaction.Transaction._commit",
+                        side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                enpkg.execute(actions)
+
+        # the recovery fails as well: so does the execution, and the
+        # journal is kept
+        with mock.patch("enstaller.transaction.Transaction._commit",
+                        side_effect=IOError("disk full")):
+            with self.assertRaises(IOError):
+                enpkg.execute(actions)
+            self.assertIsNone(enpkg.find(egg))
+            self.assertTrue(os.path.isfile(journal_path))
+
+        # the recovery is attempted again by the next execution
+        enpkg.execute(actions)
+        self.assertIsNotNone(enpkg.find(egg))
+        self.assertFalse(os.path.isfile(journal_path))
+
+    def test_transactional_pipeline(self):
+        eggs = ["numpy-1.8.0-1.egg", "scipy-0.13.0-1.egg"]
+        first_staged = threading.Event()
+        staged_while_fetching = []
+
+        def mocked_fetch(egg, force=False, progress=None):
+            if egg == eggs[1]:
+                staged_while_fetching.append(first_staged.wait(5))
+
+        def mocked_stage(egg, *args):
+            if egg == eggs[0]:
+                first_staged.set()
+            return []
+
+        with mock.patch("enstaller.enpkg.Enpkg.fetch",
+                        side_effect=mocked_fetch):
+            # on the console, the eggs are all fetched before being staged
+            enpkg, actions = self._parallel_fetch_setup(eggs, EventManager())
+            enpkg.config.transactional_install = True
+            enpkg.ec.stage.side_effect = mocked_stage
+            enpkg.execute(actions)
+
+        # the first egg is staged while the second one is being fetched
+        self.assertEqual(staged_while_fetching, [True])
+        self.assertEqual([args[0] for args, kwargs in
+                          enpkg.ec.commit.call_args_list], eggs)
+
 class TestEnpkgRevert(unittest.TestCase):
     def setUp(self):
         self.prefixes = [tempfile.mkdtemp()]
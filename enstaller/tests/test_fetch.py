@@ -1,6 +1,10 @@
+import BaseHTTPServer
+import SocketServer
 import hashlib
+import json
 import os
 import os.path
+import re
 import sys
 import threading
 
@@ -14,8 +18,9 @@ import mock
 from encore.events.event_manager import EventManager
 
 from egginst.tests.common import mkdtemp
-from enstaller.fetch import FetchAPI
-from enstaller.store.indexed import LocalIndexedStore
+from enstaller.eggcache import EggCache
+from enstaller.fetch import FetchAPI, FetchProgress
+from enstaller.store.indexed import LocalIndexedStore, RemoteHTTPIndexedStore
 from enstaller.utils import md5_file
 
 class MockedFailingFile(object):
@@ -58,6 +63,9 @@ class MockedFailingFile(object):
         else:
             return None
 
+    def seek(self, n):
+        self._read_pos = n
+
     def close(self):
         pass
 
@@ -87,6 +95,52 @@ class DummyRepository(LocalIndexedStore):
     def get_data(self, key):
         return self._data[key]
 
+EGG_DATA = "".join(chr(i % 251) for i in range(100000))
+EGG_ENTRY = {"md5": hashlib.md5(EGG_DATA).hexdigest(), "size": len(EGG_DATA),
+             "name": "dummy", "version": "1.0.0", "build": 1,
+             "python": None, "packages": []}
+
+
+class _RangeRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.startswith("/index.json"):
+            data = json.dumps({"dummy-1.0.0-1.egg": EGG_ENTRY})
+            self.send_response(200)
+        else:
+            data = EGG_DATA
+            requested = self.headers.get("Range")
+            self.server.ranges.append(requested)
+            self.server.encodings.append(self.headers.get("Accept-Encoding"))
+            m = re.match(r"bytes=(\d+)-$", requested or "")
+            if m and self.server.accept_ranges:
+                start = int(m.group(1)) + self.server.range_shift
+                self.send_response(206)
+                self.send_header("Content-Range", "bytes %d-%d/%d" % \
+                                 (start, len(data) - 1, len(data)))
+                data = data[start:]
+            else:
+                self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *a):
+        pass
+
+
+class _RangeServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, accept_ranges):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0),
+                                           _RangeRequestHandler)
+        self.accept_ranges = accept_ranges
+        # sent ranges start this many bytes after the requested offset
+        self.range_shift = 0
+        self.ranges = []
+        self.encodings = []
+
+
 class TestFetchAPI(unittest.TestCase):
     def test_fetch_simple(self):
         with mkdtemp() as d:
@@ -166,6 +220,24 @@ class TestFetchAPI(unittest.TestCase):
 
             fetch_api.fetch_egg(egg)
 
+    def test_fetch_egg_refetch_cached_md5(self):
+        with mkdtemp() as d:
+            egg = "dummy-1.0.0-1.egg"
+            fp = MockedFailingFile(100000)
+
+            remote = DummyRepository(d, [Entry(egg, fp)])
+            remote.connect()
+
+            fetch_api = FetchAPI(remote, d)
+            fetch_api.fetch_egg(egg)
+
+            # the MD5 checked while fetching is not computed again
+            with mock.patch("enstaller.utils.md5_file") as mocked_md5_file:
+                with mock.patch.object(FetchAPI, "fetch") as mocked_fetch:
+                    fetch_api.fetch_egg(egg, force=True)
+                    self.assertFalse(mocked_md5_file.called)
+                    self.assertFalse(mocked_fetch.called)
+
     def test_fetch_egg_refetch_invalid_md5(self):
         with mkdtemp() as d:
             egg = "dummy-1.0.0-1.egg"
@@ -196,6 +268,40 @@ class TestFetchAPI(unittest.TestCase):
 
             self.assertEqual(md5_file(target), fp.md5)
 
+    def test_fetch_egg_cache(self):
+        with mkdtemp() as d:
+            egg = "dummy-1.0.0-1.egg"
+            cache = EggCache(os.path.join(d, "cache"))
+
+            def _fetch_api_factory(local_dir):
+                fp = MockedFailingFile(100000)
+                remote = DummyRepository(local_dir, [Entry(egg, fp)])
+                remote.connect()
+                fetch_api = FetchAPI(remote, local_dir)
+                fetch_api.cache = cache
+                return fp, fetch_api
+
+            fp, fetch_api = _fetch_api_factory(os.path.join(d, "first"))
+            fetch_api.fetch_egg(egg)
+            self.assertTrue(os.path.isfile(cache.path(fp.md5)))
+
+            fp, fetch_api = _fetch_api_factory(os.path.join(d, "second"))
+            with mock.patch.object(FetchAPI, "fetch") as mocked_fetch:
+                fetch_api.fetch_egg(egg)
+                self.assertFalse(mocked_fetch.called)
+            target = os.path.join(d, "second", egg)
+            self.assertEqual(md5_file(target), fp.md5)
+
+            # a corrupted cache entry is detected, and refetched
+            os.unlink(target)
+            path = cache.path(fp.md5)
+            os.chmod(path, 0644)
+            with open(path, "r+b") as fo:
+                fo.write("b")
+            fetch_api.fetch_egg(egg)
+            self.assertEqual(md5_file(target), fp.md5)
+            self.assertEqual(md5_file(path), fp.md5)
+
     def test_encore_event_manager(self):
         with mkdtemp() as d:
             with mock.patch.object(EventManager, "emit"):
@@ -229,3 +335,122 @@ class TestFetchAPI(unittest.TestCase):
                 fetch_api.fetch_egg(egg)
 
                 self.assertTrue(m.called)
+
+    def test_combined_progress(self):
+        """
+        Ensure fetches sharing a FetchProgress report their summed progress.
+        """
+        with mkdtemp() as d:
+            eggs = ["yoyo-1.0.0-1.egg", "dummy-1.0.0-1.egg"]
+            entries = [Entry(eggs[0], MockedFailingFile(1024 * 32)),
+                       Entry(eggs[1], MockedFailingFile(1024 * 16))]
+
+            remote = DummyRepository(d, entries)
+            remote.connect()
+
+            progress = mock.MagicMock()
+            with mock.patch("egginst.console.ProgressManager") as m:
+                with FetchProgress(progress) as fetch_progress:
+                    fetch_api = FetchAPI(remote, d)
+                    fetch_api.progress = fetch_progress
+                    for egg in eggs:
+                        fetch_api.fetch_egg(egg)
+
+                self.assertFalse(m.called)
+
+            progress.assert_called_with(step=1024 * 48)
+            self.assertTrue(progress.__enter__.called)
+            self.assertTrue(progress.__exit__.called)
+
+
+class TestFetchResume(unittest.TestCase):
+    egg = "dummy-1.0.0-1.egg"
+
+    def _write_partial(self, d, data):
+        with open(os.path.join(d, self.egg + ".part"), "wb") as fo:
+            fo.write(data)
+
+    def _fetch_from_server(self, accept_ranges, partial, range_shift=0):
+        server = _RangeServer(accept_ranges)
+        server.range_shift = range_shift
+        t = threading.Thread(target=server.serve_forever)
+        t.daemon = True
+        t.start()
+        try:
+            with mkdtemp() as d:
+                url = "http://127.0.0.1:{0}/".format(server.server_port)
+                remote = RemoteHTTPIndexedStore(url, d)
+                remote.connect()
+
+                self._write_partial(d, partial)
+                FetchAPI(remote, d).fetch_egg(self.egg)
+
+                with open(os.path.join(d, self.egg), "rb") as fp:
+                    self.assertEqual(fp.read(), EGG_DATA)
+                self.assertFalse(os.path.exists(os.path.join(d, self.egg + ".part")))
+        finally:
+            server.shutdown()
+            server.server_close()
+        return server
+
+    def test_resume_local(self):
+        with mkdtemp() as d:
+            remote_dir = os.path.join(d, "remote")
+            os.makedirs(remote_dir)
+            with open(os.path.join(remote_dir, "index.json"), "wb") as fo:
+                json.dump({self.egg: EGG_ENTRY}, fo)
+            with open(os.path.join(remote_dir, self.egg), "wb") as fo:
+                fo.write(EGG_DATA)
+
+            remote = LocalIndexedStore(remote_dir)
+            remote.connect()
+
+            self._write_partial(d, EGG_DATA[:40000])
+            with mock.patch.object(remote, "get_data_from",
+                                   wraps=remote.get_data_from) as m:
+                FetchAPI(remote, d).fetch_egg(self.egg)
+                m.assert_called_once_with(self.egg, 40000)
+
+            self.assertEqual(md5_file(os.path.join(d, self.egg)), EGG_ENTRY["md5"])
+
+    def test_resume_corrupted_partial(self):
+        with mkdtemp() as d:
+            fp = MockedFailingFile(100000)
+            remote = DummyRepository(d, [Entry(self.egg, fp)])
+            remote.connect()
+
+            self._write_partial(d, "b" * 1000)
+            fetch_api = FetchAPI(remote, d)
+            with self.assertRaises(ValueError):
+                fetch_api.fetch(self.egg)
+
+            # the corrupted partial download is not kept around
+            self.assertFalse(os.path.exists(os.path.join(d, self.egg + ".part")))
+
+    def test_resume_abort_keeps_partial(self):
+        event = threading.Event()
+
+        with mkdtemp() as d:
+            fp = MockedFailingFile(100000, event, 0.5)
+            remote = DummyRepository(d, [Entry(self.egg, fp)])
+            remote.connect()
+
+            FetchAPI(remote, d).fetch(self.egg, event)
+
+            self.assertTrue(os.path.exists(os.path.join(d, self.egg + ".part")))
+
+    def test_resume_http_range(self):
+        server = self._fetch_from_server(True, EGG_DATA[:40000])
+        self.assertEqual(server.ranges, ["bytes=40000-"])
+        # a range of compressed content could not be appended to the file
+        self.assertEqual(server.encodings, ["identity"])
+
+    def test_resume_http_wrong_range(self):
+        server = self._fetch_from_server(True, EGG_DATA[:40000], 1000)
+        # the partial response does not start at the requested offset, so
+        # the whole egg is fetched again
+        self.assertEqual(server.ranges, ["bytes=40000-", None])
+
+    def test_resume_http_range_not_supported(self):
+        server = self._fetch_from_server(False, "b" * 40000)
+        self.assertEqual(server.ranges, ["bytes=40000-"])
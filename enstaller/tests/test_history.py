@@ -2,7 +2,9 @@ import unittest
 from os.path import dirname, join, isfile
 from os import unlink
 
-from enstaller.history import History
+import mock
+
+from enstaller.history import History, SNAPSHOT_INTERVAL
 
 
 PATH = join(dirname(__file__), 'history')
@@ -35,8 +37,9 @@ class TestHistory(unittest.TestCase):
             self.history._write_changes(state, self.package_sets[i+1])
 
     def tearDown(self):
-        if isfile(self.history._log_path):
-            unlink(self.history._log_path)
+        for path in (self.history._log_path, self.history._snapshot_path):
+            if isfile(path):
+                unlink(path)
 
     def test_get_state(self):
         self.assertEqual(self.history.get_state(0), self.package_sets[0])
@@ -61,5 +64,97 @@ class TestHistory(unittest.TestCase):
         self.assertEqual(self.history.parse()[-1][1],
                          package_changes(self.package_sets[-1], set()))
 
+    def _write_revisions(self, states, n):
+        """
+        append n revisions (updating numpy) to the history, and to the given
+        list of states
+        """
+        for i in range(n):
+            numpy = [egg for egg in states[-1] if egg.startswith('numpy')]
+            state = states[-1] - set(numpy) | \
+                    set(['numpy-1.8.%d-1.egg' % len(states)])
+            self.history._write_changes(states[-1], state)
+            states.append(state)
+        return states
+
+    def test_get_state_snapshot(self):
+        states = self._write_revisions(list(self.package_sets),
+                                       SNAPSHOT_INTERVAL)
+        self.assertFalse(isfile(self.history._snapshot_path))
+
+        self.assertEqual(self.history.get_state(), states[-1])
+        self.assertTrue(isfile(self.history._snapshot_path))
+
+        # only the revisions after the snapshot are replayed
+        self._write_revisions(states, 2)
+        with mock.patch.object(self.history, "_iter_revisions",
+                               wraps=self.history._iter_revisions) as m:
+            self.assertEqual(self.history.get_state(), states[-1])
+            offset, = m.call_args[0]
+            self.assertTrue(offset > 0)
+
+        for rev in range(-len(states), len(states)):
+            self.assertEqual(self.history.get_state(rev), states[rev])
+        self.assertEqual([state for dt, state in
+                          self.history.construct_states()], states)
+        with self.assertRaises(IndexError):
+            self.history.get_state(len(states))
+
+    def test_get_state_snapshot_rewritten(self):
+        self._write_revisions(list(self.package_sets), SNAPSHOT_INTERVAL)
+        self.history.get_state()
+        self.assertTrue(isfile(self.history._snapshot_path))
+
+        # the history file is started again: the snapshot does not apply
+        state = set(['numpy-1.8.0-1.egg'])
+        self.history._write_egg_names(state)
+        self.assertEqual(self.history.get_state(), state)
+        self.assertEqual(self.history.get_state(0), state)
+
+    def _get_installed(self, state):
+        return mock.patch("enstaller.history.egginst.get_installed",
+                          return_value=sorted(state))
+
+    def test_context_manager_records_actions(self):
+        state = self.package_sets[-1]
+        r_state = state - set(['numpy-1.7.0-1.egg']) | \
+                set(['numpy-1.8.0-1.egg', 'nose-1.3.0-1.egg'])
+
+        with self._get_installed(state) as m:
+            with self.history as history:
+                history.record('remove', 'numpy-1.7.0-1.egg')
+                history.record('install', 'numpy-1.8.0-1.egg')
+                history.record('install', 'nose-1.3.0-1.egg')
+            # the installed packages are only scanned when entering
+            self.assertEqual(m.call_count, 1)
+
+        self.assertEqual(self.history.get_state(), r_state)
+        self.assertEqual(len(self.history.parse()),
+                         len(self.package_sets) + 1)
+
+    def test_context_manager_install_replaces(self):
+        state = self.package_sets[-1]
+        r_state = state - set(['numpy-1.7.0-1.egg']) | \
+                set(['numpy-1.8.0-1.egg'])
+
+        with self._get_installed(state):
+            with self.history as history:
+                history.record('install', 'numpy-1.8.0-1.egg')
+
+        self.assertEqual(self.history.get_state(), r_state)
+
+    def test_context_manager_error(self):
+        state = self.package_sets[-1]
+        r_state = state | set(['nose-1.3.0-1.egg'])
+
+        with self._get_installed(state) as m:
+            with self.assertRaises(ValueError):
+                with self.history as history:
+                    # the changes are scanned for when an error occurs
+                    m.return_value = sorted(r_state)
+                    raise ValueError()
+
+        self.assertEqual(self.history.get_state(), r_state)
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,4 +1,5 @@
 import os
+import pickle
 import sys
 
 from collections import defaultdict
@@ -9,6 +10,8 @@ if sys.version_info[:2] < (2, 7):
 else:
     import unittest
 
+import mock
+
 from enstaller.store.indexed import IndexedStore
 from enstaller.store.joined import JoinedStore
 
@@ -86,6 +89,14 @@ class TestReq(unittest.TestCase):
         self.assertNotEqual(Req('foo'), Req('bar'))
         self.assertNotEqual(Req('foo 1.4'), Req('foo 1.4-5'))
 
+    def test_interned(self):
+        self.assertIs(Req('foo 1.4-5'), Req('foo 1.4-5'))
+        with self.assertRaises(AttributeError):
+            Req('foo').name = 'bar'
+
+        r = Req('baz 2.6.7-5')
+        self.assertIs(pickle.loads(pickle.dumps(r, 2)), r)
+
     def test_matches(self):
         spec = dict(name='foo_bar', version='2.4.1', build=3, python=None)
         for req_string, m in [
@@ -193,6 +204,28 @@ class TestChain1(unittest.TestCase):
                     self.r.get_metadata(egg).get('repo_dispname'),
                     repo_name)
 
+    def test_get_dist_cached(self):
+        """
+        Ensure the store is queried once per name.
+        """
+        c = Resolve(self.r)
+        with mock.patch.object(self.r, "query", wraps=self.r.query) as query:
+            for req_string in ('swig', 'swig 1.3.36', 'swig 1.3.40-1'):
+                c.get_egg(Req(req_string))
+
+            query.assert_called_once_with(type='egg', name='swig')
+
+        self.assertEqual(c.get_egg(Req('swig 1.3.40')), 'swig-1.3.40-2.egg')
+
+    def test_reqs_dist_memoized(self):
+        reqs = self.c.reqs_egg('FiPy-2.1-1.egg')
+        self.assertIs(self.c.reqs_egg('FiPy-2.1-1.egg'), reqs)
+
+        # requirements are parsed again after reconnecting
+        self.r.connect()
+        self.assertIsNot(self.c.reqs_egg('FiPy-2.1-1.egg'), reqs)
+        self.assertEqual(self.c.reqs_egg('FiPy-2.1-1.egg'), reqs)
+
     def test_reqs_dist(self):
         self.assertEqual(self.c.reqs_egg('FiPy-2.1-1.egg'),
                          set([Req('distribute'),
@@ -0,0 +1,161 @@
+import json
+import os.path
+import shutil
+import sys
+import tempfile
+
+if sys.version_info[:2] < (2, 7):
+    import unittest2 as unittest
+else:
+    import unittest
+
+import mock
+
+from egginst.main import get_installed
+from egginst.tests.common import DUMMY_EGG, DUMMY_EGG_WITH_ENTRY_POINTS
+from egginst.utils import bin_dir_name, on_win
+
+from enstaller.eggcollect import EggCollection, JoinedEggCollection
+from enstaller.errors import EnpkgError
+from enstaller.transaction import Transaction
+
+
+EGGS = [os.path.basename(DUMMY_EGG),
+        os.path.basename(DUMMY_EGG_WITH_ENTRY_POINTS)]
+LOCAL_DIR = os.path.dirname(DUMMY_EGG)
+
+
+class TestTransaction(unittest.TestCase):
+    def setUp(self):
+        self.prefix = tempfile.mkdtemp()
+        self.ec = JoinedEggCollection([EggCollection(self.prefix, False)])
+
+    def tearDown(self):
+        shutil.rmtree(self.prefix)
+
+    def _transaction(self):
+        return Transaction(self.ec, LOCAL_DIR, self.prefix)
+
+    def _assert_clean(self, transaction):
+        self.assertFalse(os.path.exists(transaction.journal_path))
+        self.assertFalse(os.path.exists(transaction.staging_dir))
+
+    def test_stage_commit(self):
+        transaction = self._transaction()
+        transaction.stage([("install", egg) for egg in EGGS])
+
+        self.assertEqual(list(get_installed(self.prefix)), [])
+        self.assertTrue(os.path.isfile(transaction.journal_path))
+
+        committed = []
+        transaction.commit(lambda opcode, egg: committed.append(egg))
+        self.assertEqual(committed, EGGS)
+        self.assertEqual(list(get_installed(self.prefix)), EGGS)
+        self._assert_clean(transaction)
+
+        transaction = self._transaction()
+        transaction.stage([("remove", EGGS[0])])
+        transaction.commit()
+        self.assertEqual(list(get_installed(self.prefix)), EGGS[1:])
+        self._assert_clean(transaction)
+
+    def test_stage_failure(self):
+        transaction = self._transaction()
+
+        def abort(opcode, egg):
+            raise KeyboardInterrupt()
+
+        with self.assertRaises(KeyboardInterrupt):
+            transaction.stage([("install", egg) for egg in EGGS],
+                              callback=abort)
+        self.assertEqual(os.listdir(self.prefix), ["enpkg.lock"])
+
+    def test_recover_staging(self):
+        transaction = self._transaction()
+        transaction.stage([("install", egg) for egg in EGGS])
+        # the process staging the transaction is gone
+        transaction.lock.release()
+
+        transaction = self._transaction()
+        self.assertEqual(transaction.recover(), [])
+        self.assertEqual(list(get_installed(self.prefix)), [])
+        self._assert_clean(transaction)
+
+    def test_locked(self):
+        actions = [("install", egg) for egg in EGGS]
+        transaction = self._transaction()
+        transaction.stage(actions)
+
+        # another process neither recovers the transaction being carried
+        # out, nor starts another one
+        other = self._transaction()
+        self.assertEqual(other.recover(), [])
+        self.assertTrue(os.path.isfile(transaction.journal_path))
+        self.assertTrue(os.path.isdir(transaction.staging_dir))
+        with self.assertRaises(EnpkgError):
+            other.stage(actions)
+
+        transaction.commit()
+        self.assertEqual(list(get_installed(self.prefix)), EGGS)
+        self._assert_clean(transaction)
+
+        other.stage([("remove", EGGS[0])])
+        other.commit()
+        self.assertEqual(list(get_installed(self.prefix)), EGGS[1:])
+
+    def test_recover_committing(self):
+        actions = [("install", egg) for egg in EGGS]
+        transaction = self._transaction()
+        transaction.stage(actions, {EGGS[1]: {"product": "free"}})
+
+        # interrupted while committing the second egg
+        commit = EggCollection.commit
+        def interrupted_commit(collection, egg, *args):
+            if egg == EGGS[1]:
+                raise KeyboardInterrupt()
+            commit(collection, egg, *args)
+
+        with mock.patch.object(EggCollection, "commit", interrupted_commit):
+            with self.assertRaises(KeyboardInterrupt):
+                transaction.commit()
+        self.assertEqual(list(get_installed(self.prefix)), EGGS[:1])
+        with open(transaction.journal_path) as fp:
+            self.assertEqual(json.load(fp)["done"], 1)
+
+        # the interrupted transaction cannot be discarded by another one
+        with self.assertRaises(EnpkgError):
+            self._transaction().stage(actions)
+
+        transaction = self._transaction()
+        self.assertEqual(transaction.recover(), actions[1:])
+        self.assertEqual(list(get_installed(self.prefix)), EGGS)
+        info = self.ec.find(EGGS[1])
+        self.assertEqual(info["product"], "free")
+        self._assert_clean(transaction)
+
+        self.assertEqual(self._transaction().recover(), [])
+
+    def test_recover_without_eggs(self):
+        local_dir = tempfile.mkdtemp()
+        try:
+            for egg in EGGS:
+                shutil.copy(os.path.join(LOCAL_DIR, egg), local_dir)
+            actions = [("install", egg) for egg in EGGS]
+            transaction = Transaction(self.ec, local_dir, self.prefix)
+            transaction.stage(actions)
+            with mock.patch.object(Transaction, "_commit",
+                                   side_effect=KeyboardInterrupt):
+                with self.assertRaises(KeyboardInterrupt):
+                    transaction.commit()
+        finally:
+            # the eggs are gone, and local_dir is configured elsewhere
+            shutil.rmtree(local_dir)
+
+        transaction = self._transaction()
+        self.assertEqual(transaction.recover(), actions)
+        self.assertEqual(list(get_installed(self.prefix)), EGGS)
+        # the entry points of the egg are installed as well
+        script = "dummy.exe" if on_win else "dummy"
+        self.assertTrue(os.path.isfile(os.path.join(self.prefix, bin_dir_name,
+                                                    script)))
+        self._assert_clean(transaction)
@@ -1,3 +1,4 @@
+import os
 import os.path
 import random
 import sys
@@ -12,10 +13,11 @@ import mock
 
 from egginst.main import name_version_fn
 from egginst.tests.common import DUMMY_EGG_SIZE, DUMMY_EGG, \
-    DUMMY_EGG_MTIME, DUMMY_EGG_MD5
+    DUMMY_EGG_MTIME, DUMMY_EGG_MD5, mkdtemp
 
 from enstaller.utils import canonical, comparable_version, path_to_uri, \
-    uri_to_path, info_file, cleanup_url, exit_if_sudo_on_venv
+    uri_to_path, info_file, cleanup_url, exit_if_sudo_on_venv, install_order, \
+    lru_cache, version_key, ChecksumCache, cached_md5_file, md5_file
 
 class TestUtils(unittest.TestCase):
 
@@ -53,6 +55,41 @@ class TestUtils(unittest.TestCase):
             versions.sort(key=comparable_version)
             self.assertEqual(versions, org)
 
+    def test_version_key(self):
+        versions = ['1.0.4', '1.3.0b1', '1.3.0', '1.3.11.dev7', '1.3.11',
+                    '1.4.0rc1', '1.4.0', '214', '1.8k', '2008j', '2009b']
+        org = list(versions)
+        random.shuffle(versions)
+        versions.sort(key=version_key)
+        self.assertEqual(versions, org)
+
+        self.assertIsInstance(version_key('1.3.0'), tuple)
+        self.assertEqual(version_key('214'), version_key('214.0.0'))
+        self.assertEqual(version_key('1.0.0.dev'), version_key('1.0.0.dev1'))
+
+    def test_lru_cache(self):
+        calls = []
+
+        @lru_cache(maxsize=2)
+        def f(x):
+            calls.append(x)
+            return x * 2
+
+        self.assertEqual(f(1), 2)
+        self.assertEqual(f(2), 4)
+        self.assertEqual(f(1), 2)
+        self.assertEqual(calls, [1, 2])
+
+        # 2 is the least recently used result, and gets evicted
+        f(3)
+        f(1)
+        f(2)
+        self.assertEqual(calls, [1, 2, 3, 2])
+
+        f.cache_clear()
+        f(1)
+        self.assertEqual(calls, [1, 2, 3, 2, 1])
+
     def test_info_file(self):
         r_info = {
                 "size": DUMMY_EGG_SIZE,
@@ -63,6 +100,32 @@ class TestUtils(unittest.TestCase):
         info = info_file(DUMMY_EGG)
         self.assertEqual(info, r_info)
 
+    def test_checksum_cache(self):
+        with mkdtemp() as d:
+            path = os.path.join(d, "foo.egg")
+            with open(path, "wb") as fo:
+                fo.write("foo")
+            self.assertEqual(cached_md5_file(path), md5_file(path))
+
+            # the cache is persistent
+            with mock.patch("enstaller.utils.md5_file") as mocked:
+                self.assertEqual(ChecksumCache(d).md5(path), md5_file(path))
+                self.assertFalse(mocked.called)
+
+            with open(path, "ab") as fo:
+                fo.write("bar")
+            cache = ChecksumCache(d)
+            self.assertEqual(cache.md5(path), md5_file(path))
+
+            # the entries of the files which are gone are dropped
+            other = os.path.join(d, "bar.egg")
+            with open(other, "wb") as fo:
+                fo.write("bar")
+            cache.md5(other)
+            os.unlink(path)
+            cache.save()
+            self.assertEqual(ChecksumCache(d)._load().keys(), ["bar.egg"])
+
     def test_cleanup_url(self):
         r_data = [
             ("http://www.acme.com/", "http://www.acme.com/"),
@@ -152,6 +215,60 @@ class TestUri(unittest.TestCase):
         path = uri_to_path(uri)
         self.assertEqual(r_path, path)
 
+class TestInstallOrder(unittest.TestCase):
+    def _scan_install_order(self, names, requirements):
+        # reference implementation: repeated scans of the names
+        result = []
+        while len(result) < len(names):
+            for name in names:
+                if name not in result and \
+                        all(r in result for r in requirements[name]):
+                    result.append(name)
+        return result
+
+    def test_simple(self):
+        names = ["a", "b", "c", "d"]
+        requirements = {"a": set(["b"]), "b": set(), "c": set(),
+                        "d": set(["a", "c"])}
+
+        # a comes after c, as it is only found in the second scan
+        self.assertEqual(install_order(names, requirements),
+                         ["b", "c", "a", "d"])
+
+    def test_same_as_scanning(self):
+        rng = random.Random(42)
+        for i in range(20):
+            names = ["p{0:03d}".format(j) for j in range(100)]
+            # a random DAG, in which projects may require any project
+            # preceding them in a random permutation
+            permutation = names[:]
+            rng.shuffle(permutation)
+            requirements = {}
+            for j, name in enumerate(permutation):
+                n = rng.randint(0, min(j, 4))
+                requirements[name] = set(rng.sample(permutation[:j], n))
+
+            self.assertEqual(install_order(names, requirements),
+                             self._scan_install_order(names, requirements))
+
+    def test_cycle(self):
+        names = ["a", "b", "c", "d", "e"]
+        requirements = {"a": set(["d"]), "b": set(), "c": set(["e"]),
+                        "d": set(["b", "c"]), "e": set(["d"])}
+
+        with self.assertRaises(Exception) as ctx:
+            install_order(names, requirements)
+
+        self.assertEqual(str(ctx.exception),
+                         "Loop in dependency graph: c -> e -> d -> c")
+
+    def test_self_requirement(self):
+        with self.assertRaises(Exception) as ctx:
+            install_order(["a"], {"a": set(["a"])})
+
+        self.assertEqual(str(ctx.exception),
+                         "Loop in dependency graph: a -> a")
+
 
 if __name__ == '__main__':
     unittest.main()
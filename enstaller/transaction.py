@@ -0,0 +1,203 @@
+"""
+Staged, atomic execution of the remove and install actions of Enpkg.
+
+The eggs to install are first extracted into a staging directory of the
+prefix (and so on the same file system), which leaves the prefix untouched:
+an error or an abort while staging only requires the staging directory to
+be removed.  The transaction is then committed: the eggs to remove are
+removed, and the staged files are moved into the prefix by renaming them,
+which is much quicker than extracting the eggs.
+
+The progress of the transaction is kept in a journal (enpkg.transaction in
+the prefix), so that a transaction interrupted by a crash is completed on
+the next execution (see Transaction.recover): rolled back if it was still staging,
+rolled forward from the last completed action if it was committing.
+Committing only requires the staging directory (see EggInst.stage): the
+eggs may have been removed from local_dir in the meantime.  The journal
+also records the local_dir of the transaction, in case the configuration
+has changed.
+
+A transaction holds an exclusive lock on the prefix (enpkg.lock) from the
+start of its staging to the end of its commit, as does its recovery, so
+that a transaction is never recovered (or rolled back) while the process
+carrying it out is still running.
+"""
+import json
+import os
+import sys
+from os.path import isfile, join
+
+from egginst.main import iter_files_manifest, write_files_manifest
+from egginst.utils import makedirs, rm_rf
+
+from enstaller.errors import EnpkgError
+from utils import FileLock
+
+
+JOURNAL_FILENAME = 'enpkg.transaction'
+STAGING_DIRNAME = '.enpkg-staging'
+LOCK_FILENAME = 'enpkg.lock'
+
+
+class Transaction(object):
+    """
+    A transaction over the given egg collection (whose first collection is
+    the one written to), installing the eggs found in local_dir.
+    """
+    def __init__(self, collection, local_dir, prefix):
+        self.ec = collection
+        self.local_dir = local_dir
+        self.prefix = prefix
+        self.lock = FileLock(join(prefix, LOCK_FILENAME))
+        self.journal_path = join(prefix, JOURNAL_FILENAME)
+        self.staging_dir = join(prefix, STAGING_DIRNAME)
+        self._journal = None
+
+    def _egg_stage_dir(self, egg):
+        return join(self.staging_dir, egg)
+
+    def _egg_files_path(self, egg):
+        return join(self.staging_dir, egg + '.files')
+
+    def _write_journal(self):
+        tmp_path = self.journal_path + '.tmp'
+        with open(tmp_path, 'w') as fo:
+            json.dump(self._journal, fo, indent=2, sort_keys=True)
+            fo.flush()
+            os.fsync(fo.fileno())
+        if sys.platform == 'win32':
+            rm_rf(self.journal_path)
+        os.rename(tmp_path, self.journal_path)
+
+    def _read_journal(self):
+        try:
+            with open(self.journal_path) as fp:
+                return json.load(fp)
+        except ValueError:
+            # the journal is written before anything is staged, and replaced
+            # atomically afterwards: a corrupted one cannot be acted upon
+            return None
+
+    def _cleanup(self):
+        rm_rf(self.staging_dir)
+        rm_rf(self.journal_path)
+        self._journal = None
+
+    def stage(self, actions, extra_infos=None, callback=None, before=None):
+        """
+        Start the transaction: actions is a list of tuples (opcode, egg),
+        where opcode is 'remove' or 'install', and the eggs of the install
+        actions are extracted into the staging directory.  extra_infos maps
+        eggs to the extra information passed on to EggInst.commit.
+        before(opcode, egg) and callback(opcode, egg) are called before and
+        after each egg is staged (e.g. to wait for the egg to be fetched),
+        and may raise an exception to abort the transaction.
+
+        If an exception is raised, the transaction is rolled back.  An
+        EnpkgError is raised if another process is modifying the prefix, or
+        if an interrupted transaction needs to be recovered first.
+        """
+        if not self.lock.acquire():
+            raise EnpkgError("Another process is modifying %s" % self.prefix)
+        if isfile(self.journal_path):
+            journal = self._read_journal()
+            if journal is not None and journal['state'] == 'committing':
+                self.lock.release()
+                raise EnpkgError("The interrupted transaction in %s needs to "
+                                 "be recovered first" % self.prefix)
+        self._cleanup()
+        self._journal = {'state': 'staging', 'done': 0,
+                         'local_dir': self.local_dir,
+                         'actions': [list(action) for action in actions],
+                         'extra_infos': extra_infos or {}}
+        try:
+            self._write_journal()
+            makedirs(self.staging_dir)
+            installing = []
+            for opcode, egg in actions:
+                if opcode != 'install':
+                    continue
+                if before is not None:
+                    before(opcode, egg)
+                files = self.ec.stage(egg, self.local_dir,
+                                      self._egg_stage_dir(egg), installing)
+                write_files_manifest(self._egg_files_path(egg), files)
+                installing.extend(files)
+                if callback is not None:
+                    callback(opcode, egg)
+        except:
+            self.rollback()
+            raise
+
+    def commit(self, callback=None):
+        """
+        Carry out the actions of the staged transaction, calling
+        callback(opcode, egg) after each of them.  If the commit is
+        interrupted, it is resumed by recover.
+        """
+        try:
+            self._journal['state'] = 'committing'
+            self._write_journal()
+            self._commit(callback)
+        finally:
+            self.lock.release()
+
+    def _commit(self, callback):
+        actions = self._journal['actions']
+        extra_infos = self._journal['extra_infos']
+        for i in xrange(self._journal['done'], len(actions)):
+            opcode, egg = actions[i]
+            if opcode == 'remove':
+                # may have been removed by an interrupted commit
+                if self.ec.find(egg):
+                    self.ec.remove(egg)
+            elif opcode == 'install':
+                files = list(iter_files_manifest(self._egg_files_path(egg)))
+                self.ec.commit(egg, self._journal['local_dir'],
+                               self._egg_stage_dir(egg), files,
+                               extra_infos.get(egg))
+            else:
+                raise Exception("unknown opcode: %r" % opcode)
+            self._journal['done'] = i + 1
+            self._write_journal()
+            if callback is not None:
+                callback(opcode, egg)
+        self._cleanup()
+
+    def rollback(self):
+        """
+        Discard the staged transaction; the prefix has not been modified.
+        """
+        self._cleanup()
+        self.lock.release()
+
+    def recover(self, callback=None):
+        """
+        Complete the transaction interrupted in the prefix, if any: it is
+        rolled back if it had not been committed yet, and its remaining
+        actions are carried out otherwise.  Return the list of the actions
+        carried out (empty when there was nothing to recover).
+        If an exception is raised, the journal is kept, so that the
+        recovery may be attempted again.  Nothing is done while another
+        process holds the lock of the prefix, as it is then still carrying
+        out the transaction.
+        """
+        if not isfile(self.journal_path):
+            return []
+        if not self.lock.acquire():
+            return []
+        try:
+            if not isfile(self.journal_path):
+                # completed by its process in the meantime
+                return []
+            self._journal = self._read_journal()
+            if (self._journal is None or
+                    self._journal['state'] != 'committing'):
+                self._cleanup()
+                return []
+            done = self._journal['done']
+            actions = [tuple(action) for action in self._journal['actions']]
+            self._commit(callback)
+            return actions[done:]
+        finally:
+            self.lock.release()
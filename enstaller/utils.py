@@ -1,6 +1,11 @@
+import os
 import sys
+import json
 import hashlib
-from os.path import abspath, expanduser, getmtime, getsize, isdir, isfile, join
+import heapq
+import threading
+from os.path import (abspath, basename, dirname, expanduser, getmtime,
+                     getsize, isdir, isfile, join)
 
 import urllib
 import urlparse
@@ -10,6 +15,9 @@ from verlib import NormalizedVersion, IrrationalVersionError
 
 PY_VER = '%i.%i' % sys.version_info[:2]
 
+# file of the checksum cache of a directory (see ChecksumCache)
+CHECKSUM_CACHE_FILENAME = '.md5-cache.json'
+
 
 def abs_expanduser(path):
     return abspath(expanduser(path))
@@ -77,6 +85,139 @@ def comparable_version(version):
         return version
 
 
+def lru_cache(maxsize=1024):
+    """
+    Decorator memoizing a function of one hashable argument, keeping (at
+    most) the maxsize most recently used results.
+    """
+    def decorator(func):
+        # circular doubly linked list of [prev, next, key, result] links, the
+        # root being the sentinel, root[1] the least recently used link
+        root = []
+        root[:] = [root, root, None, None]
+        cache = {}
+        lock = threading.Lock()
+
+        def wrapper(arg):
+            with lock:
+                link = cache.get(arg)
+                if link is not None:
+                    # move the link to the most recently used position
+                    prev, next = link[0], link[1]
+                    prev[1] = next
+                    next[0] = prev
+                    last = root[0]
+                    last[1] = root[0] = link
+                    link[0] = last
+                    link[1] = root
+                    return link[3]
+            result = func(arg)
+            with lock:
+                if arg in cache:
+                    return result
+                if len(cache) >= maxsize:
+                    oldest = root[1]
+                    root[1] = oldest[1]
+                    oldest[1][0] = root
+                    del cache[oldest[2]]
+                last = root[0]
+                link = [last, root, arg, result]
+                last[1] = root[0] = cache[arg] = link
+            return result
+
+        def cache_clear():
+            with lock:
+                cache.clear()
+                root[:] = [root, root, None, None]
+
+        wrapper.cache_clear = cache_clear
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+
+    return decorator
+
+
+@lru_cache(maxsize=8192)
+def version_key(version):
+    """
+    Given a version string, return a plain tuple to be used as a sort key,
+    e.g. version_key('1.3.10') > version_key('1.3.8').
+
+    Contrary to comparable_version, all keys are comparable with each other:
+    versions which cannot be converted to a NormalizedVersion (e.g. '2009j')
+    are compared as strings, and sort after all the rational versions.
+    Results are memoized, as the same versions are compared over and over.
+    """
+    try:
+        ver = normalize_version_string(version)
+        return (0, NormalizedVersion(ver).parts)
+    except IrrationalVersionError:
+        return (1, version)
+
+
+def install_order(names, requirements):
+    """
+    Given a sorted list of (unique) project names, and a dict mapping each
+    name to the names it requires, return the names in an order in which
+    each project comes after its requirements.
+
+    The order is the one of repeatedly scanning the names in the given
+    order, adding each project as soon as all its requirements have been
+    added. An Exception listing the projects of a dependency cycle is raised
+    if there is one.
+    """
+    index = dict((name, i) for i, name in enumerate(names))
+    required = [sorted(set(index[r] for r in requirements[name]))
+                for name in names]
+
+    # Kahn's algorithm: missing[i] is the number of requirements of i which
+    # are not added yet
+    missing = [len(reqs) for reqs in required]
+    dependents = [[] for name in names]
+    for i, reqs in enumerate(required):
+        for j in reqs:
+            dependents[j].append(i)
+
+    # heap of the indices to add during the current scan, and list of the
+    # ones to add in the next scan, because they come before the project
+    # which made them ready
+    current = [i for i in range(len(names)) if missing[i] == 0]
+    next_scan = []
+    result = []
+    while current:
+        i = heapq.heappop(current)
+        result.append(names[i])
+        for j in dependents[i]:
+            missing[j] -= 1
+            if missing[j] == 0:
+                if j > i:
+                    heapq.heappush(current, j)
+                else:
+                    next_scan.append(j)
+        if not current:
+            heapq.heapify(next_scan)
+            current, next_scan = next_scan, []
+
+    if len(result) < len(names):
+        # each project which is not added has a requirement which is not
+        # added either: following those requirements leads to a cycle
+        path = []
+        position = {}
+        i = min(i for i in range(len(names)) if missing[i] > 0)
+        while i not in position:
+            position[i] = len(path)
+            path.append(i)
+            i = min(j for j in required[i] if missing[j] > 0)
+        cycle = path[position[i]:]
+        # start from the first project in the given order
+        k = cycle.index(min(cycle))
+        cycle = [names[j] for j in cycle[k:] + cycle[:k + 1]]
+        raise Exception("Loop in dependency graph: %s" % " -> ".join(cycle))
+
+    return result
+
+
 def md5_file(path):
     """
     Returns the md5sum of the file (located at `path`) as a hexadecimal
@@ -93,10 +234,155 @@ def md5_file(path):
     return h.hexdigest()
 
 
-def info_file(path):
+class ChecksumCache(object):
+    """
+    Persistent cache of the MD5 of the files of a directory, kept in the
+    file CHECKSUM_CACHE_FILENAME of that directory.  The MD5 of a file is
+    computed again only when its size, modification time or inode changes.
+    """
+    def __init__(self, dir_path):
+        self.path = join(dir_path, CHECKSUM_CACHE_FILENAME)
+        self._lock = threading.Lock()
+        # maps file names -> [size, mtime, inode, md5]
+        self._entries = None
+        self._dirty = False
+
+    def _load(self):
+        try:
+            with open(self.path) as fp:
+                entries = json.load(fp)
+        except (IOError, ValueError):
+            entries = None
+        if not isinstance(entries, dict):
+            entries = {}
+        return entries
+
+    def md5(self, path):
+        """
+        Return the MD5 of the given file of the directory.
+        """
+        st = os.stat(path)
+        key = [st.st_size, st.st_mtime, st.st_ino]
+        fn = basename(path)
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._load()
+            entry = self._entries.get(fn)
+        if entry is not None and entry[:3] == key:
+            return entry[3]
+
+        md5 = md5_file(path)
+        self.record(path, md5, st)
+        return md5
+
+    def record(self, path, md5, st=None):
+        """
+        Record the MD5 of the given file of the directory, when already
+        known (e.g. computed while writing the file).
+        """
+        if st is None:
+            st = os.stat(path)
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._load()
+            self._entries[basename(path)] = [st.st_size, st.st_mtime,
+                                             st.st_ino, md5]
+            self._dirty = True
+
+    def save(self):
+        """
+        Write the cache, if modified, leaving out the files which are gone.
+        Failures to write it (e.g. in a read-only directory) are ignored.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            dir_path = dirname(self.path)
+            for fn in list(self._entries):
+                if not isfile(join(dir_path, fn)):
+                    del self._entries[fn]
+            tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+            try:
+                with open(tmp_path, 'w') as fo:
+                    json.dump(self._entries, fo, separators=(',', ':'))
+                if sys.platform == 'win32' and isfile(self.path):
+                    os.unlink(self.path)
+                os.rename(tmp_path, self.path)
+            except (IOError, OSError):
+                return
+            self._dirty = False
+
+
+class FileLock(object):
+    """
+    Non-blocking, exclusive lock on the given file, shared with other
+    processes: acquire returns False when the lock is held by another
+    process (or through another FileLock of the same file).  The lock is
+    released when the process exits.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._fp = None
+
+    def acquire(self):
+        self._fp = open(self.path, 'a')
+        try:
+            if sys.platform == 'win32':
+                import msvcrt
+                msvcrt.locking(self._fp.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(self._fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            self._fp.close()
+            self._fp = None
+            return False
+        return True
+
+    def release(self):
+        """
+        Release the lock, if held.
+        """
+        if self._fp is not None:
+            # closing the file releases the lock
+            self._fp.close()
+            self._fp = None
+
+
+_checksum_caches = {}
+_checksum_caches_lock = threading.Lock()
+
+
+def checksum_cache(dir_path):
+    """
+    Return the (per-process) ChecksumCache of the given directory.
+    """
+    dir_path = abspath(dir_path)
+    with _checksum_caches_lock:
+        try:
+            return _checksum_caches[dir_path]
+        except KeyError:
+            cache = _checksum_caches[dir_path] = ChecksumCache(dir_path)
+            return cache
+
+
+def cached_md5_file(path):
+    """
+    Same as md5_file, but the MD5 is looked up in (and saved to) the
+    checksum cache of the directory of the file.
+    """
+    cache = checksum_cache(dirname(abspath(path)))
+    md5 = cache.md5(path)
+    cache.save()
+    return md5
+
+
+def info_file(path, md5=None):
+    if md5 is None:
+        md5 = md5_file(path)
     return dict(size=getsize(path),
                 mtime=getmtime(path),
-                md5=md5_file(path))
+                md5=md5)
 
 
 def cleanup_url(url):
@@ -0,0 +1,98 @@
+"""
+Count the file system calls made per member when installing a synthetic egg
+of N modules (spread over a few packages), in a fresh prefix and again over
+the existing install.
+
+The calls are counted by wrapping the functions of the os module the
+installation goes through (stat, lstat, mkdir, unlink, ...), so calls made
+from C code (e.g. by open) are not counted.
+"""
+import argparse
+import collections
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+
+from egginst.main import EggInst
+
+
+COUNTED = ("stat", "lstat", "mkdir", "makedirs", "unlink", "rmdir", "chmod",
+           "symlink", "listdir")
+
+
+def create_egg(path, n, packages=20):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED) as fp:
+        for i in range(n):
+            fp.writestr("pkg{0}/sub{1}/mod{2}.py".format(i % packages,
+                                                         i % 3, i),
+                        "a = {0}\n".format(i))
+        fp.writestr("EGG-INFO/spec/depend",
+                    "metadata_version = '1.1'\nname = 'bench'\n"
+                    "version = '1.0'\nbuild = 1\n\narch = None\n"
+                    "platform = None\nosdist = None\npython = None\n"
+                    "packages = []\n")
+
+
+class _Counter(object):
+    def __init__(self):
+        self.counts = collections.Counter()
+        self._originals = {}
+
+    def __enter__(self):
+        for name in COUNTED:
+            func = getattr(os, name)
+            self._originals[name] = func
+            setattr(os, name, self._wrap(name, func))
+        return self
+
+    def __exit__(self, *a):
+        for name, func in self._originals.items():
+            setattr(os, name, func)
+
+    def _wrap(self, name, func):
+        def wrapper(*a, **kw):
+            self.counts[name] += 1
+            return func(*a, **kw)
+        return wrapper
+
+
+def _install(egg, prefix, n):
+    with _Counter() as counter:
+        t0 = time.time()
+        EggInst(egg, prefix).install()
+        elapsed = time.time() - t0
+    total = sum(counter.counts.values())
+    details = ", ".join("{0}: {1}".format(name, count)
+                        for name, count in sorted(counter.counts.items()))
+    print "  {0:.2f} calls per member in {1:.3f} s ({2})".format(
+        float(total) / n, elapsed, details)
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+
+    p = argparse.ArgumentParser(description=__doc__)
+    p.add_argument("-n", type=int, default=5000,
+                   help="Number of modules in the egg (default: "
+                        "%(default)s).")
+    namespace = p.parse_args(argv)
+
+    d = tempfile.mkdtemp()
+    try:
+        egg = os.path.join(d, "bench-1.0-1.egg")
+        create_egg(egg, namespace.n)
+        prefix = os.path.join(d, "prefix")
+
+        print "fresh prefix:"
+        _install(egg, prefix, namespace.n)
+        print "over the existing install:"
+        _install(egg, prefix, namespace.n)
+    finally:
+        shutil.rmtree(d)
+
+if __name__ == "__main__":
+    main()
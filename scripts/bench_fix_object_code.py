@@ -0,0 +1,152 @@
+"""
+Benchmark object_code.fix_object_code on a large, synthetic ELF-like file.
+
+Each run happens in its own process, so that the peak memory usage reported
+is the one of the run itself. The "read" mode is the former implementation,
+which reads the whole file in memory, and is given for comparison.
+
+On linux, the peak of anonymous (i.e. not file-backed) resident memory is
+reported, as pages of a memory-mapped file count in the RSS while they are
+not allocated by the process. Elsewhere, the peak RSS is reported.
+"""
+import argparse
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from egginst import object_code
+
+CHUNK_SIZE = 2 ** 20
+
+RPATH_PLACEHOLDER = 5 * "/PLACEHOLD" + ":/usr/lib" + "\0" * 40
+
+
+def write_synthetic_elf(path, size, n_placeholders=10):
+    """
+    Write an ELF-like file of the given size, with n_placeholders rpath
+    placeholders evenly spread in it.
+    """
+    chunk = "".join(chr(i % 251) for i in range(CHUNK_SIZE))
+    every = max(size // n_placeholders, 1)
+    with open(path, "wb") as fp:
+        fp.write("\x7fELF")
+        written = 4
+        next_placeholder = every // 2
+        while written < size:
+            if written >= next_placeholder:
+                fp.write(RPATH_PLACEHOLDER)
+                written += len(RPATH_PLACEHOLDER)
+                next_placeholder += every
+            n = min(CHUNK_SIZE, size - written,
+                    max(next_placeholder - written, 1))
+            fp.write(chunk[:n])
+            written += n
+
+
+def fix_object_code_read(path):
+    tp = object_code.get_object_type(path)
+    if tp is None:
+        return
+    with open(path, "r+b") as f:
+        data = f.read()
+        for m in list(object_code.placehold_pat.finditer(data)):
+            f.seek(m.start())
+            f.write(object_code._replacement(m, tp))
+
+
+def _anonymous_rss():
+    """
+    Current anonymous resident memory in kB, or None if not available.
+    """
+    try:
+        with open("/proc/self/status") as fp:
+            for line in fp:
+                if line.startswith("RssAnon:"):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return None
+
+
+class PeakMemorySampler(threading.Thread):
+    def __init__(self, interval=0.005):
+        super(PeakMemorySampler, self).__init__()
+        self.daemon = True
+        self.interval = interval
+        self.peak = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.peak = max(self.peak, _anonymous_rss())
+            time.sleep(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def run(mode, path):
+    object_code._targets = ["/opt/foo/lib"]
+    func = {"mmap": object_code.fix_object_code,
+            "read": fix_object_code_read}[mode]
+
+    sampler = None
+    if _anonymous_rss() is not None:
+        sampler = PeakMemorySampler()
+        sampler.start()
+
+    t0 = time.time()
+    func(path)
+    elapsed = time.time() - t0
+
+    if sampler is not None:
+        sampler.stop()
+        label, peak = "peak anonymous RSS", sampler.peak
+    else:
+        # ru_maxrss is in kB on linux, in bytes on os x
+        label = "peak RSS"
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin":
+            peak /= 1024
+    print "{0:>5}: {1:8.3f} s, {2} {3:8.1f} MB".format(mode, elapsed, label,
+                                                     peak / 1024.)
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+
+    p = argparse.ArgumentParser(description=__doc__)
+    p.add_argument("--size", type=int, default=500,
+                   help="Size of the synthetic file in MB (default: "
+                        "%(default)s).")
+    p.add_argument("--modes", nargs="+", default=["mmap", "read"],
+                   choices=["mmap", "read"],
+                   help="Implementations to benchmark.")
+    p.add_argument("--run", nargs=2, help=argparse.SUPPRESS)
+    namespace = p.parse_args(argv)
+
+    if namespace.run:
+        run(*namespace.run)
+        return
+
+    d = tempfile.mkdtemp()
+    try:
+        template = os.path.join(d, "libtemplate.so")
+        write_synthetic_elf(template, namespace.size * 2 ** 20)
+        for mode in namespace.modes:
+            path = os.path.join(d, "lib{0}.so".format(mode))
+            shutil.copy(template, path)
+            subprocess.check_call([sys.executable, __file__,
+                                   "--run", mode, path])
+    finally:
+        shutil.rmtree(d)
+
+if __name__ == "__main__":
+    main()
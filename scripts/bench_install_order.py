@@ -0,0 +1,122 @@
+"""
+Benchmark the install ordering of a synthetic dependency graph of N
+packages, all required by a metapackage. In the "random" graph, each package
+requires a few random packages created before it. In the "chain" graph, each
+package requires the next one in name order, which is the worst case of
+scanning the packages in name order repeatedly.
+
+The "scan" mode is the former implementation of
+Resolve.determine_install_order, and is given for comparison.
+"""
+import argparse
+import random
+import sys
+import time
+
+from enstaller.resolve import Resolve
+from enstaller.store.indexed import IndexedStore
+
+
+class SyntheticStore(IndexedStore):
+    def __init__(self, n, shape="random", max_requirements=5, seed=0):
+        super(SyntheticStore, self).__init__()
+        self.n = n
+        self.shape = shape
+        self.max_requirements = max_requirements
+        self.seed = seed
+
+    def info(self):
+        return {"root": "synthetic"}
+
+    def get_data(self, key):
+        raise KeyError(key)
+
+    def get_index(self):
+        rng = random.Random(self.seed)
+        names = ["package{0:05d}".format(i) for i in range(self.n)]
+
+        def _spec(name, requirements):
+            return {"name": name, "version": "1.0.0", "build": 1,
+                    "python": None, "type": "egg",
+                    "packages": ["{0} 1.0.0".format(r) for r in requirements]}
+
+        index = {}
+        for i, name in enumerate(names):
+            if self.shape == "chain":
+                requirements = names[i + 1:i + 2]
+            else:
+                n = rng.randint(0, min(i, self.max_requirements))
+                requirements = rng.sample(names[:i], n)
+            index[name + "-1.0.0-1.egg"] = _spec(name, requirements)
+        index["meta-1.0.0-1.egg"] = _spec("meta", names)
+        return index
+
+
+def scan_determine_install_order(self, eggs):
+    eggs = list(eggs)
+    assert self.are_complete(eggs)
+    assert len(eggs) == len(set(self.name_egg(d) for d in eggs))
+    eggs.sort(key=self.name_egg)
+
+    rns = {}
+    for egg in eggs:
+        rns[egg] = set(r.name for r in self.reqs_egg(egg))
+
+    result = []
+    names_inst = set()
+    while len(result) < len(eggs):
+        n = len(result)
+        for egg in eggs:
+            if egg in result:
+                continue
+            if all(bool(name in names_inst) for name in rns[egg]):
+                result.append(egg)
+                names_inst.add(self.name_egg(egg))
+                assert len(names_inst) == len(result)
+
+        if len(result) == n:
+            raise Exception("Loop in dependency graph\n%r" % eggs)
+    return result
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+
+    p = argparse.ArgumentParser(description=__doc__)
+    p.add_argument("-n", type=int, default=2000,
+                   help="Number of packages (default: %(default)s).")
+    p.add_argument("--shape", choices=["random", "chain"], default="random",
+                   help="Shape of the dependency graph (default: "
+                        "%(default)s).")
+    p.add_argument("--repeat", type=int, default=3,
+                   help="Number of runs, the best one is reported (default: "
+                        "%(default)s).")
+    namespace = p.parse_args(argv)
+
+    store = SyntheticStore(namespace.n, namespace.shape)
+    store.connect()
+
+    results = {}
+    for mode, determine_install_order in [
+            ("kahn", Resolve.determine_install_order.im_func),
+            ("scan", scan_determine_install_order)]:
+        class _Resolve(Resolve):
+            pass
+        _Resolve.determine_install_order = determine_install_order
+
+        best = None
+        for i in range(namespace.repeat):
+            resolver = _Resolve(store)
+            eggs = list(store.query_keys(type="egg"))
+            t0 = time.time()
+            results[mode] = resolver.determine_install_order(eggs)
+            elapsed = time.time() - t0
+            best = elapsed if best is None else min(best, elapsed)
+        print "{0}: determine_install_order of {1} eggs in {2:.3f} s". \
+                format(mode, len(eggs), best)
+
+    assert results["kahn"] == results["scan"]
+
+if __name__ == "__main__":
+    main()
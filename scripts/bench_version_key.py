@@ -0,0 +1,72 @@
+"""
+Benchmark the version sort keys over the versions of a real index: the index
+is given either as the index.json file of a repository (e.g. as written by
+download_index.py), or as an index-depend.txt file. By default, the index of
+the indexed_repo tests is used.
+
+Each round sorts the versions of every project of the index, as done by
+Enpkg.info_list_name or Resolve.get_egg when resolving several requirements.
+"""
+import argparse
+import json
+import os.path
+import sys
+import time
+from collections import defaultdict
+
+from enstaller.indexed_repo.metadata import parse_depend_index
+from enstaller.utils import comparable_version, version_key
+
+
+DEFAULT_INDEX = os.path.join(os.path.dirname(__file__), os.pardir,
+                             "enstaller", "indexed_repo", "tests",
+                             "index-5.1.txt")
+
+
+def load_index(path):
+    with open(path) as fp:
+        data = fp.read()
+    if path.endswith(".json"):
+        return json.loads(data)
+    else:
+        return parse_depend_index(data)
+
+
+def _sort_all(groups, key):
+    for versions in groups:
+        try:
+            sorted(versions, key=key)
+        except TypeError:
+            pass
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+
+    p = argparse.ArgumentParser(description=__doc__)
+    p.add_argument("index", nargs="?", default=DEFAULT_INDEX,
+                   help="Index file (default: %(default)s).")
+    p.add_argument("--rounds", type=int, default=20,
+                   help="Number of times each project's versions are sorted "
+                        "(default: %(default)s).")
+    namespace = p.parse_args(argv)
+
+    index = load_index(namespace.index)
+    by_name = defaultdict(list)
+    for spec in index.itervalues():
+        by_name[spec["name"].lower()].append(spec["version"])
+    groups = by_name.values()
+
+    print "{0} versions of {1} projects".format(len(index), len(groups))
+    for mode, key in [("comparable_version", comparable_version),
+                      ("version_key", version_key)]:
+        t0 = time.time()
+        for i in range(namespace.rounds):
+            _sort_all(groups, key)
+        elapsed = time.time() - t0
+        print "{0}: {1} rounds in {2:.3f} s".format(mode, namespace.rounds,
+                                                   elapsed)
+
+if __name__ == "__main__":
+    main()
@@ -1,50 +1,50 @@
 import sys
 from collections import defaultdict
 
-import egginst
+from enstaller.config import Configuration
+from enstaller.enpkg import Enpkg, create_joined_store
+from enstaller.resolve import comparable_info
+from enstaller.utils import fill_url
 
-from enstaller.indexed_repo import Chain, Req, dist_naming
-from enstaller.utils import get_installed_info, comparable_version
-import enstaller.config as config
+
+def _create_enpkg():
+    config = Configuration._get_default_config()
+    if config.use_webservice:
+        remote = None # Enpkg will create the default
+    else:
+        urls = [fill_url(u) for u in config.IndexedRepos]
+        remote = create_joined_store(config, urls)
+    return Enpkg(remote, prefixes=[sys.prefix], hook=False, config=config)
 
 
 def get_status():
     # the result is a dict mapping cname to ...
+    enpkg = _create_enpkg()
+
     res = {}
-    for cname in egginst.get_installed_cnames(sys.prefix):
+    installed = {}
+    for key, info in enpkg.query_installed():
+        cname = info['name']
         d = defaultdict(str)
-        info = get_installed_info(sys.prefix, cname)
-        if info is None:
-            continue
         d.update(info)
+        d['egg_name'] = key
         res[cname] = d
+        installed[cname] = info
 
-    c = Chain(config.get('IndexedRepos'))
-
-    for cname in c.groups.iterkeys():
-        dist = c.get_dist(Req(cname))
-        if dist is None:
-            continue
-        repo, fn = dist_naming.split_dist(dist)
-        n, v, b = dist_naming.split_eggname(fn)
+    for cname, (key, info) in enpkg.newest_available().iteritems():
         if cname not in res:
             d = defaultdict(str)
-            d['name'] = n
+            d['name'] = info['name']
             res[cname] = d
-        res[cname]['a-egg'] = fn
-        res[cname]['a-ver'] = '%s-%d' % (v, b)
-
-    def vb_egg(fn):
-        try:
-            n, v, b = dist_naming.split_eggname(fn)
-            return comparable_version(v), b
-        except:
-            return None
+        res[cname]['a-egg'] = key
+        res[cname]['a-ver'] = '%(version)s-%(build)d' % info
+        res[cname]['a-info'] = info
 
-    for d in res.itervalues():
+    for cname, d in res.iteritems():
         if d['egg_name']:                    # installed
             if d['a-egg']:
-                if vb_egg(d['egg_name']) >= vb_egg(d['a-egg']):
+                if (comparable_info(installed[cname]) >=
+                        comparable_info(d['a-info'])):
                     d['status'] = 'up-to-date'
                 else:
                     d['status'] = 'updateable'